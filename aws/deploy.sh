@@ -59,6 +59,17 @@ aws s3 cp \
 
 echo "✅ Decision matrix uploaded."
 
+# Upload the trained action posteriors (scripts/train_action_posteriors.py), if present
+POSTERIORS_FILE="${SCRIPT_DIR}/decision-matrix/action-posteriors.json"
+if [ -f "${POSTERIORS_FILE}" ]; then
+  aws s3 cp \
+    "${POSTERIORS_FILE}" \
+    "s3://${BUCKET_NAME}/action-posteriors.json" \
+    --sse AES256 \
+    --region "${REGION}"
+  echo "✅ Action posteriors uploaded."
+fi
+
 # Update Lambda function code with actual handlers
 echo "📦 Updating Lambda function code..."
 
@@ -83,7 +94,7 @@ MCP_LAMBDA_NAME=$(aws cloudformation describe-stacks \
 # Update Decision Engine Lambda
 echo "  Updating decision engine..."
 pushd "${SCRIPT_DIR}/lambda/decision_engine" > /dev/null
-zip -r /tmp/decision-engine.zip handler.py
+zip -r /tmp/decision-engine.zip handler.py action_policy.py matrix_rules.py experiments.py
 aws lambda update-function-code \
   --function-name "${DECISION_LAMBDA_NAME}" \
   --zip-file fileb:///tmp/decision-engine.zip \
@@ -93,7 +104,7 @@ popd > /dev/null
 # Update Recovery Action Lambda
 echo "  Updating recovery action..."
 pushd "${SCRIPT_DIR}/lambda/recovery_action" > /dev/null
-zip -r /tmp/recovery-action.zip handler.py
+zip -r /tmp/recovery-action.zip handler.py send_governor.py send_scheduler.py frequency_cap.py
 aws lambda update-function-code \
   --function-name "${RECOVERY_LAMBDA_NAME}" \
   --zip-file fileb:///tmp/recovery-action.zip \
@@ -0,0 +1,201 @@
+"""
+Per-invocation metrics in CloudWatch Embedded Metric Format (EMF).
+
+Shared by the Lambda handlers through the CommonLayer layer. Counters and
+latency samples are recorded in memory per (dependency, outcome) and written
+once per invocation by ``flush()``, so a batch of events costs a handful of
+log lines rather than one per event:
+
+    metrics = Metrics("recovery_action")
+
+    @metrics.instrument
+    def handler(event, context):
+        with metrics.time("ses.send_email") as call:
+            ...
+            call.outcome = "throttled"
+
+Each (dependency, outcome) pair becomes one EMF document with dimensions
+Service / Dependency / Outcome and the metrics ``Calls`` (Count) and
+``Latency`` (Milliseconds, one value per call). EMF accepts at most 100
+values per metric, so larger sample sets are split across documents.
+
+Sinks: ``EmfStdoutSink`` (default, picked up by CloudWatch Logs) and
+``InMemorySink`` for tests and benchmarks. METRICS_SINK=memory|none selects
+the others without code changes.
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "AbandonedCartRecovery")
+MAX_VALUES_PER_DOCUMENT = 100
+
+
+class EmfStdoutSink:
+    """Write each EMF document as one JSON log line."""
+
+    def emit(self, document):
+        sys.stdout.write(json.dumps(document, separators=(",", ":")) + "\n")
+        sys.stdout.flush()
+
+
+class InMemorySink:
+    """Keep emitted EMF documents in memory for assertions and benchmarks."""
+
+    def __init__(self):
+        self.documents = []
+
+    def emit(self, document):
+        self.documents.append(document)
+
+    def clear(self):
+        self.documents = []
+
+    def calls(self, dependency, outcome=None):
+        return sum(
+            d["Calls"] for d in self.documents
+            if d["Dependency"] == dependency and (outcome is None or d["Outcome"] == outcome)
+        )
+
+    def latencies(self, dependency, outcome=None):
+        values = []
+        for d in self.documents:
+            if d["Dependency"] == dependency and (outcome is None or d["Outcome"] == outcome):
+                values.extend(d.get("Latency", []))
+        return values
+
+
+class NullSink:
+    def emit(self, document):
+        pass
+
+
+def _default_sink():
+    kind = os.environ.get("METRICS_SINK", "emf").lower()
+    if kind == "memory":
+        return InMemorySink()
+    if kind == "none":
+        return NullSink()
+    return EmfStdoutSink()
+
+
+class _Call:
+    """Handle yielded by ``Metrics.time``; set ``outcome`` to override the default."""
+
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+
+class Metrics:
+    """Counters and latency histograms per dependency and outcome."""
+
+    def __init__(self, service, sink=None, namespace=NAMESPACE):
+        self.service = service
+        self.namespace = namespace
+        self.sink = sink or _default_sink()
+        self._calls = defaultdict(int)
+        self._latencies = defaultdict(list)
+        # Handlers may record from worker threads (e.g. batch tool calls)
+        self._lock = threading.Lock()
+
+    def incr(self, dependency, outcome="ok", count=1):
+        with self._lock:
+            self._calls[(dependency, outcome)] += count
+
+    def observe(self, dependency, outcome, latency_ms):
+        with self._lock:
+            self._calls[(dependency, outcome)] += 1
+            self._latencies[(dependency, outcome)].append(round(latency_ms, 3))
+
+    def time(self, dependency):
+        """Context manager timing one call; exceptions record outcome 'error'."""
+        return _Timer(self, dependency)
+
+    def snapshot(self):
+        """Unflushed counters and latencies, keyed by (dependency, outcome)."""
+        with self._lock:
+            return {
+                key: {"calls": calls, "latency_ms": list(self._latencies.get(key, ()))}
+                for key, calls in self._calls.items()
+            }
+
+    def flush(self):
+        """Emit everything recorded since the last flush and reset."""
+        with self._lock:
+            recorded, self._calls = self._calls, defaultdict(int)
+            samples, self._latencies = self._latencies, defaultdict(list)
+        if not recorded:
+            return
+        timestamp = int(time.time() * 1000)
+        for (dependency, outcome), calls in recorded.items():
+            latencies = samples.get((dependency, outcome), [])
+            chunks = [
+                latencies[i:i + MAX_VALUES_PER_DOCUMENT]
+                for i in range(0, len(latencies), MAX_VALUES_PER_DOCUMENT)
+            ] or [[]]
+            for i, chunk in enumerate(chunks):
+                metrics = [{"Name": "Calls", "Unit": "Count"}]
+                document = {
+                    "_aws": {
+                        "Timestamp": timestamp,
+                        "CloudWatchMetrics": [{
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Service", "Dependency", "Outcome"]],
+                            "Metrics": metrics,
+                        }],
+                    },
+                    "Service": self.service,
+                    "Dependency": dependency,
+                    "Outcome": outcome,
+                    # Count the calls once even when latencies span documents
+                    "Calls": calls if i == 0 else 0,
+                }
+                if chunk:
+                    metrics.append({"Name": "Latency", "Unit": "Milliseconds"})
+                    document["Latency"] = chunk
+                self.sink.emit(document)
+
+    def instrument(self, handler):
+        """
+        Decorate a Lambda handler: time the whole invocation as dependency
+        'handler' (outcome 'error' for exceptions or 5xx responses) and flush
+        once when it returns.
+        """
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            try:
+                with self.time("handler") as call:
+                    result = handler(event, context)
+                    if isinstance(result, dict) and result.get("statusCode", 200) >= 500:
+                        call.outcome = "error"
+                    return result
+            finally:
+                self.flush()
+        return wrapper
+
+
+class _Timer:
+    __slots__ = ("_metrics", "_dependency", "_call", "_start")
+
+    def __init__(self, metrics, dependency):
+        self._metrics = metrics
+        self._dependency = dependency
+        self._call = _Call()
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self._call
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ms = (time.perf_counter() - self._start) * 1000.0
+        if exc_type is not None and self._call.outcome == "ok":
+            self._call.outcome = "error"
+        self._metrics.observe(self._dependency, self._call.outcome, elapsed_ms)
+        return False
@@ -0,0 +1,177 @@
+"""
+Structured JSON logging shared by the Lambda handlers.
+
+Deployed as the CommonLayer Lambda layer (importable as ``structured_log``).
+
+- One JSON object per line. Records are only built and serialized when the
+  level is enabled and the invocation is sampled, so disabled debug/info
+  calls cost a method call, not a ``json.dumps``.
+- debug()/info() are the success path and are sampled per invocation with
+  LOG_SAMPLE_RATE (0.0–1.0). warning()/error()/exception() are always emitted.
+- Email addresses and phone numbers are redacted, both by field name and
+  inside free text.
+- Each record is capped at LOG_MAX_BYTES; oversized records are replaced by a
+  truncated preview.
+- The bound fields and sampling decision live in a context variable, so
+  handlers called concurrently from threads (scripts/pipeline_daemon.py) keep
+  their own invocation context.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+import traceback
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", "4096"))
+
+REDACTED = "[redacted]"
+PII_KEYS = frozenset({"email", "phone", "recipient", "customer_name", "ToAddresses"})
+_EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+# International format only, so timestamps and ids are left alone
+_PHONE_RE = re.compile(r"\+\d[\d\s().-]{6,}\d")
+
+_MAX_DEPTH = 6
+
+
+def redact_text(text):
+    """Mask email addresses and phone numbers in free text."""
+    if "@" in text:
+        text = _EMAIL_RE.sub("[email]", text)
+    if "+" in text:
+        text = _PHONE_RE.sub("[phone]", text)
+    return text
+
+
+def _scrub(value, depth=0):
+    """Copy ``value`` with PII-named keys masked, bounded in depth."""
+    if depth > _MAX_DEPTH:
+        return "..."
+    if isinstance(value, dict):
+        return {
+            k: (REDACTED if k in PII_KEYS and v else _scrub(v, depth + 1))
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_scrub(v, depth + 1) for v in value]
+    return value
+
+
+class _Record:
+    """A log record whose JSON is produced only when a handler formats it."""
+
+    __slots__ = ("level", "name", "msg", "fields", "created")
+
+    def __init__(self, level, name, msg, fields):
+        self.level = level
+        self.name = name
+        self.msg = msg
+        self.fields = fields
+        self.created = time.time()
+
+    def __str__(self):
+        record = {
+            "ts": round(self.created, 3),
+            "level": self.level,
+            "logger": self.name,
+            "msg": self.msg,
+        }
+        record.update(_scrub(self.fields))
+        line = redact_text(json.dumps(record, default=str, separators=(",", ":")))
+        if len(line) > LOG_MAX_BYTES:
+            line = json.dumps({
+                "ts": record["ts"],
+                "level": self.level,
+                "logger": self.name,
+                "msg": redact_text(str(self.msg))[:256],
+                "truncated": True,
+                "bytes": len(line),
+                "preview": line[: LOG_MAX_BYTES // 2],
+            }, separators=(",", ":"))
+        return line
+
+
+class StructuredLogger:
+    """JSON logger with per-invocation sampling of the success path."""
+
+    def __init__(self, name):
+        self.name = name
+        self._logger = logging.getLogger(f"structured.{name}")
+        self._logger.setLevel(LOG_LEVEL)
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+        # (bound fields, sampled) of the current invocation
+        self._state = contextvars.ContextVar(f"structured_log.{name}", default=({}, True))
+
+    @property
+    def _context(self):
+        return self._state.get()[0]
+
+    def begin(self, context=None, **fields):
+        """
+        Start a new invocation: bind the Lambda request id plus ``fields`` to
+        every record and roll the sampling decision for debug/info.
+        """
+        request_id = getattr(context, "aws_request_id", None)
+        bound = {"request_id": request_id} if request_id else {}
+        bound.update(fields)
+        self._state.set((bound, LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE))
+
+    def bind(self, **fields):
+        """Attach ``fields`` to every following record of this invocation."""
+        bound, sampled = self._state.get()
+        self._state.set(({**bound, **fields}, sampled))
+
+    @property
+    def sampled(self):
+        return self._state.get()[1]
+
+    def _log(self, level, levelname, msg, fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        if self._context:
+            fields = {**self._context, **fields}
+        self._logger.log(level, _Record(levelname, self.name, msg, fields))
+
+    def debug(self, msg, **fields):
+        if self.sampled:
+            self._log(logging.DEBUG, "DEBUG", msg, fields)
+
+    def info(self, msg, **fields):
+        if self.sampled:
+            self._log(logging.INFO, "INFO", msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, "WARNING", msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, "ERROR", msg, fields)
+
+    def exception(self, msg, exc=None, **fields):
+        """Log an error with the exception type and a bounded traceback."""
+        exc = exc or sys.exc_info()[1]
+        if exc is not None:
+            fields["error_type"] = type(exc).__name__
+            fields["error"] = str(exc)
+            fields["traceback"] = "".join(traceback.format_exception(exc))[-2048:]
+        self._log(logging.ERROR, "ERROR", msg, fields)
+
+
+_loggers = {}
+
+
+def get_logger(name):
+    """Return the process-wide structured logger for ``name``."""
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = StructuredLogger(name)
+    return logger
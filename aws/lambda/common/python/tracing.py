@@ -0,0 +1,286 @@
+"""
+Lightweight distributed tracing for the recovery Lambdas.
+
+Shared through the CommonLayer layer. Trace context uses the W3C
+``traceparent`` format and travels as:
+
+- the ``traceparent`` HTTP header or ``params._meta.traceparent`` on JSON-RPC
+  requests to the MCP server,
+- ``_meta.traceparent`` in the payloads the MCP server sends to the tool
+  Lambdas, and in the recovery_history events they publish back.
+
+Finished spans are buffered per invocation and exported on ``flush()`` as
+OTLP/JSON (``{"resourceSpans": [...]}``):
+
+- TRACE_EXPORT_FILE=/tmp/traces.jsonl appends one OTLP/JSON document per line
+- OTEL_EXPORTER_OTLP_ENDPOINT=http://collector:4318 POSTs to ``/v1/traces``
+
+With neither set, context is still propagated but spans are dropped.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import secrets
+import time
+import urllib.request
+
+SCOPE_NAME = "ai-abandoned-cart-recovery"
+MAX_BUFFERED_SPANS = 1000
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class SpanContext:
+    __slots__ = ("trace_id", "span_id")
+
+    def __init__(self, trace_id, span_id):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    @classmethod
+    def parse(cls, traceparent):
+        """Parse a W3C traceparent header; returns None if malformed."""
+        if not isinstance(traceparent, str):
+            return None
+        parts = traceparent.strip().split("-")
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+            return None
+        return cls(parts[1].lower(), parts[2].lower())
+
+
+class Span:
+    __slots__ = ("name", "context", "parent_id", "kind", "attributes",
+                 "start_ns", "end_ns", "status", "status_message")
+
+    def __init__(self, name, context, parent_id, kind, attributes):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = str(message)[:256]
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class FileExporter:
+    """Append OTLP/JSON documents to a local file, one per line."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, payload):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+        except OSError:
+            # A full or read-only disk drops the spans, not the invocation
+            pass
+
+
+class OtlpHttpExporter:
+    """POST OTLP/JSON to a collector's ``/v1/traces`` endpoint."""
+
+    def __init__(self, endpoint, timeout=2.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, payload):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload, separators=(",", ":")).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except OSError:
+            # Tracing must never fail the request it observes
+            pass
+
+
+class InMemoryExporter:
+    """Keep exported payloads in memory (tests, local runs)."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def export(self, payload):
+        self.payloads.append(payload)
+
+    def spans(self):
+        return [
+            span
+            for payload in self.payloads
+            for resource in payload["resourceSpans"]
+            for scope in resource["scopeSpans"]
+            for span in scope["spans"]
+        ]
+
+
+def _default_exporter():
+    path = os.environ.get("TRACE_EXPORT_FILE")
+    if path:
+        return FileExporter(path)
+    endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if endpoint:
+        return OtlpHttpExporter(endpoint)
+    return None
+
+
+class Tracer:
+    """Creates spans, propagates ``traceparent`` and exports per invocation."""
+
+    def __init__(self, service, exporter=None):
+        self.service = service
+        self.exporter = exporter if exporter is not None else _default_exporter()
+        self._finished = []
+
+    # ── Propagation ──────────────────────────────────────────
+
+    @staticmethod
+    def extract(carrier):
+        """Read a SpanContext from a dict carrying ``traceparent``."""
+        if not isinstance(carrier, dict):
+            return None
+        return SpanContext.parse(carrier.get("traceparent"))
+
+    @staticmethod
+    def current_span():
+        return _current_span.get()
+
+    def inject(self, carrier=None):
+        """Return ``carrier`` (or a new dict) with the current traceparent set."""
+        carrier = dict(carrier or {})
+        span = _current_span.get()
+        if span is not None:
+            carrier["traceparent"] = span.context.traceparent
+        return carrier
+
+    # ── Spans ────────────────────────────────────────────────
+
+    def span(self, name, kind="internal", parent=None, **attributes):
+        """
+        Context manager for a span. ``parent`` is a SpanContext (e.g. from
+        ``extract``); by default the current span is the parent. Exceptions
+        mark the span as errored and propagate.
+        """
+        return _SpanScope(self, name, kind, parent, attributes)
+
+    def _start(self, name, kind, parent, attributes):
+        if parent is None:
+            current = _current_span.get()
+            parent = current.context if current is not None else None
+        trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        context = SpanContext(trace_id, secrets.token_hex(8))
+        return Span(name, context, parent.span_id if parent is not None else None, kind, attributes)
+
+    def _finish(self, span):
+        span.end_ns = time.time_ns()
+        if self.exporter is not None and len(self._finished) < MAX_BUFFERED_SPANS:
+            self._finished.append(span)
+
+    def flush(self):
+        """Export the spans finished since the last flush."""
+        if not self._finished:
+            return
+        spans, self._finished = self._finished, []
+        self.exporter.export({
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service)]},
+                "scopeSpans": [{
+                    "scope": {"name": SCOPE_NAME},
+                    "spans": [s.to_otlp() for s in spans],
+                }],
+            }]
+        })
+
+    def instrument(self, handler=None, *, carrier=None):
+        """
+        Decorate a Lambda handler: open a server span whose parent comes from
+        ``event["_meta"]["traceparent"]`` (or from ``carrier(event)``) and
+        flush spans when it returns.
+        """
+        if handler is None:
+            return functools.partial(self.instrument, carrier=carrier)
+        get_carrier = carrier or (lambda event: event.get("_meta"))
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            parent = self.extract(get_carrier(event)) if isinstance(event, dict) else None
+            try:
+                with self.span(self.service, kind="server", parent=parent) as span:
+                    result = handler(event, context)
+                    if isinstance(result, dict) and result.get("statusCode", 200) >= 500:
+                        span.set_error(f"status {result['statusCode']}")
+                    return result
+            finally:
+                self.flush()
+        return wrapper
+
+
+class _SpanScope:
+    __slots__ = ("_tracer", "_args", "_span", "_token")
+
+    def __init__(self, tracer, name, kind, parent, attributes):
+        self._tracer = tracer
+        self._args = (name, kind, parent, attributes)
+
+    def __enter__(self):
+        self._span = self._tracer._start(*self._args)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._span.set_error(f"{exc_type.__name__}: {exc}")
+        _current_span.reset(self._token)
+        self._tracer._finish(self._span)
+        return False
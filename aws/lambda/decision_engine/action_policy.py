@@ -0,0 +1,80 @@
+"""
+Thompson-sampling action policy for the decision engine.
+
+Posterior parameters are trained offline (scripts/train_action_posteriors.py)
+and shipped as a compact JSON table next to the decision matrix:
+
+    {
+      "version": 1,
+      "generated_at": "2024-01-01T00:00:00Z",
+      "arms": {
+        "standard|browsing_abandonment": [["browsing_abandonment", 41.0, 60.0],
+                                          ["shipping_issue", 30.0, 22.0]]
+      }
+    }
+
+Each arm names a matrix entry of the same segment together with the Beta
+(alpha, beta) posterior of its recovery rate. The table is indexed once at
+load time, so online selection is a dict lookup plus one Beta draw per arm.
+"""
+
+import random
+from typing import Dict, Optional, Tuple
+
+# Static decisions the learning policy must never override
+GUARDRAIL_ACTION_TYPES = frozenset({"blocked", "reminder_only"})
+GUARDRAIL_SEGMENTS = frozenset({"high_fraud_risk"})
+
+Arm = Tuple[str, float, float]
+
+
+class ThompsonPolicy:
+    """Select a matrix entry per (segment, reason) by sampling Beta posteriors."""
+
+    def __init__(self, table: dict, rng: Optional[random.Random] = None):
+        self.version = table.get("version")
+        self.generated_at = table.get("generated_at")
+        self._rng = rng or random.Random()
+        self._arms: Dict[Tuple[str, str], Tuple[Arm, ...]] = {}
+        for key, arms in table.get("arms", {}).items():
+            segment_key, _, reason_key = key.partition("|")
+            self._arms[(segment_key, reason_key)] = tuple(
+                (str(entry), float(alpha), float(beta)) for entry, alpha, beta in arms
+            )
+
+    def __len__(self):
+        return len(self._arms)
+
+    def select(self, segment_key: str, reason_key: str) -> Optional[str]:
+        """Return the matrix entry key with the highest sampled recovery rate."""
+        arms = self._arms.get((segment_key, reason_key))
+        if not arms:
+            return None
+        betavariate = self._rng.betavariate
+        best_entry = None
+        best_draw = -1.0
+        for entry, alpha, beta in arms:
+            draw = betavariate(alpha, beta)
+            if draw > best_draw:
+                best_entry, best_draw = entry, draw
+        return best_entry
+
+    def choose(self, matrix: dict, segment_key: str, reason_key: str, static_action: dict) -> Optional[dict]:
+        """
+        Return the sampled matrix entry for this cart, or None to keep the
+        static action. Guardrail segments and action types always keep the
+        static decision.
+        """
+        if segment_key in GUARDRAIL_SEGMENTS:
+            return None
+        if static_action.get("type") in GUARDRAIL_ACTION_TYPES:
+            return None
+
+        entry_key = self.select(segment_key, reason_key)
+        if entry_key is None:
+            return None
+
+        entry = matrix.get("segments", {}).get(segment_key, {}).get(entry_key)
+        if not entry or entry.get("type") in GUARDRAIL_ACTION_TYPES:
+            return None
+        return entry
@@ -0,0 +1,123 @@
+"""
+Deterministic A/B experiments for the decision engine.
+
+Experiments are defined in an optional ``experiments`` list of
+decision-matrix.json:
+
+    "experiments": [
+      {
+        "name": "standard_discount_depth",
+        "salt": "2024-06",
+        "segment": "standard",
+        "action_type": "discount",
+        "variants": [
+          {"name": "control", "weight": 50},
+          {"name": "15pct", "weight": 50,
+           "action": {"discount": "15%", "message": "Complete your purchase and enjoy 15% off!"}}
+        ]
+      }
+    ]
+
+A cart is eligible when its segment, reason and decided action type match the
+optional ``segment`` / ``reason`` / ``action_type`` scopes. Its variant is
+picked by hashing ``salt:customer_id`` into one of BUCKETS buckets split by
+the variant weights, so a customer always gets the same variant for the same
+salt (change the salt to reshuffle) with no assignment storage. A variant's
+``action`` fields override the decided action. Only the first eligible
+experiment applies, and guardrail segments and action types are never
+experimented on.
+"""
+
+import hashlib
+from typing import List, Optional, Sequence, Tuple
+
+from action_policy import GUARDRAIL_ACTION_TYPES, GUARDRAIL_SEGMENTS
+
+BUCKETS = 10000
+# Fields a variant may override; type changes would bypass the guardrails.
+# Free shipping follows the action type, so it is not overridable either.
+OVERRIDABLE_FIELDS = frozenset({"discount", "message"})
+
+
+def _normalize(value) -> Optional[str]:
+    return str(value).strip().lower().replace(" ", "_") if value else None
+
+
+def bucket(salt: str, customer_id: str) -> int:
+    digest = hashlib.sha256(f"{salt}:{customer_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % BUCKETS
+
+
+class Experiment:
+    """One experiment with its variants' cumulative bucket boundaries."""
+
+    def __init__(self, definition: dict):
+        self.name = definition.get("name")
+        if not self.name:
+            raise ValueError("experiment name is required")
+        self.salt = str(definition.get("salt") or self.name)
+        self.segment = _normalize(definition.get("segment"))
+        self.reason = _normalize(definition.get("reason"))
+        self.action_type = definition.get("action_type")
+
+        variants = definition.get("variants") or []
+        total = sum(float(v.get("weight", 0)) for v in variants)
+        if len(variants) < 2 or total <= 0:
+            raise ValueError(f"experiment {self.name}: at least two weighted variants are required")
+        self._variants: List[Tuple[int, str, dict]] = []
+        cumulative = 0.0
+        for variant in variants:
+            if not variant.get("name"):
+                raise ValueError(f"experiment {self.name}: every variant needs a name")
+            overrides = variant.get("action") or {}
+            extra = set(overrides) - OVERRIDABLE_FIELDS
+            if extra:
+                raise ValueError(f"experiment {self.name}: variant {variant['name']} overrides {sorted(extra)}")
+            cumulative += float(variant.get("weight", 0))
+            self._variants.append((round(cumulative / total * BUCKETS), variant["name"], overrides))
+
+    def eligible(self, segment_key: Optional[str], reason_key: Optional[str], action_type: Optional[str]) -> bool:
+        return (
+            (self.segment is None or self.segment == segment_key)
+            and (self.reason is None or self.reason == reason_key)
+            and (self.action_type is None or self.action_type == action_type)
+        )
+
+    def variant(self, customer_id: str) -> Tuple[str, dict]:
+        """Return ``(variant name, action overrides)`` for this customer."""
+        b = bucket(self.salt, customer_id)
+        for upper, name, overrides in self._variants:
+            if b < upper:
+                return name, overrides
+        _, name, overrides = self._variants[-1]
+        return name, overrides
+
+
+def compile_experiments(matrix: dict) -> Sequence[Experiment]:
+    """Build the matrix's experiments; raises ValueError on a bad definition."""
+    definitions = matrix.get("experiments") or []
+    if not isinstance(definitions, list):
+        raise ValueError("experiments must be a list")
+    return tuple(Experiment(d) for d in definitions)
+
+
+def assign(
+    experiments: Sequence[Experiment],
+    customer_id: Optional[str],
+    segment_key: Optional[str],
+    reason_key: Optional[str],
+    action: dict,
+) -> Optional[Tuple[str, str, dict]]:
+    """
+    Return ``(experiment, variant, action)`` with the variant's overrides
+    applied, or None when no experiment applies to this cart.
+    """
+    if not experiments or not customer_id or customer_id == "unknown":
+        return None
+    if segment_key in GUARDRAIL_SEGMENTS or action.get("type") in GUARDRAIL_ACTION_TYPES:
+        return None
+    for experiment in experiments:
+        if experiment.eligible(segment_key, reason_key, action.get("type")):
+            variant, overrides = experiment.variant(customer_id)
+            return experiment.name, variant, {**action, **overrides}
+    return None
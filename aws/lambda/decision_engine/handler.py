@@ -1,16 +1,42 @@
 import json
 import os
-import logging
+import time
 import boto3
 from botocore.exceptions import ClientError
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from action_policy import GUARDRAIL_SEGMENTS, ThompsonPolicy
+from experiments import assign as assign_experiment, compile_experiments
+from matrix_rules import compile_rules
+from metrics import Metrics
+from structured_log import get_logger
+from tracing import Tracer
+
+logger = get_logger("decision_engine")
+metrics = Metrics("decision_engine")
+tracer = Tracer("decision_engine")
 
 s3_client = boto3.client("s3")
 
 DECISION_BUCKET = os.environ.get("DECISION_BUCKET", "")
 DECISION_MATRIX_KEY = "decision-matrix.json"
+MATRIX_TTL_SECONDS = int(os.environ.get("MATRIX_TTL_SECONDS", "60"))
+
+# Optional learning policy: "static" (matrix lookup only) or "thompson"
+ACTION_POLICY = os.environ.get("ACTION_POLICY", "static").lower()
+POSTERIORS_KEY = os.environ.get("POSTERIORS_KEY", "action-posteriors.json")
+POSTERIORS_TTL_SECONDS = int(os.environ.get("POSTERIORS_TTL_SECONDS", "300"))
+
+# Decision matrix cache: parsed matrix, compiled rules and experiments and the
+# S3 ETag, revalidated with a conditional GET once per MATRIX_TTL_SECONDS
+_matrix = None
+_matrix_rules = None
+_matrix_experiments = ()
+_matrix_etag = None
+_matrix_loaded_at = 0.0
+
+# Posterior table cache (reused across warm starts)
+_policy = None
+_policy_loaded_at = 0.0
 
 FALLBACK_ACTION = {
     "type": "reminder",
@@ -23,21 +49,131 @@ def console_error(message):
     logger.error(message)
 
 
-def fetch_decision_matrix():
-    """Fetch and parse the decision matrix JSON from S3."""
+def get_decision_matrix():
+    """
+    Return ``(matrix, rules, experiments)``, compiling the matrix's
+    conditional rules and experiments once per matrix version. Within
+    MATRIX_TTL_SECONDS the cached copy is used as is; after that S3 is asked
+    for it only if the ETag changed.
+    """
+    global _matrix, _matrix_rules, _matrix_experiments, _matrix_etag, _matrix_loaded_at
+    if _matrix is not None and time.monotonic() - _matrix_loaded_at < MATRIX_TTL_SECONDS:
+        return _matrix, _matrix_rules, _matrix_experiments
+
+    request = {"Bucket": DECISION_BUCKET, "Key": DECISION_MATRIX_KEY}
+    if _matrix is not None and _matrix_etag:
+        request["IfNoneMatch"] = _matrix_etag
     try:
-        response = s3_client.get_object(
-            Bucket=DECISION_BUCKET,
-            Key=DECISION_MATRIX_KEY
-        )
-        body = response["Body"].read().decode("utf-8")
-        return json.loads(body)
+        with tracer.span("s3.get_object", kind="client", **{"s3.key": DECISION_MATRIX_KEY}), \
+                metrics.time("s3.get_object") as call:
+            try:
+                response = s3_client.get_object(**request)
+                body = response["Body"].read().decode("utf-8")
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("304", "NotModified"):
+                    raise
+                call.outcome = "not_modified"
+                body = None
+        if body is not None:
+            matrix = json.loads(body)
+            try:
+                rules = compile_rules(matrix)
+            except (ValueError, TypeError) as e:
+                # A bad rule must not take the segment table down with it
+                console_error(f"Invalid decision matrix rules, ignoring them: {e}")
+                rules = None
+            try:
+                experiments = compile_experiments(matrix)
+            except (ValueError, TypeError) as e:
+                console_error(f"Invalid decision matrix experiments, ignoring them: {e}")
+                experiments = ()
+            _matrix, _matrix_rules, _matrix_etag = matrix, rules, response.get("ETag")
+            _matrix_experiments = experiments
+            logger.info(
+                "Loaded decision matrix",
+                etag=_matrix_etag,
+                rules=len(rules) if rules else 0,
+                experiments=len(experiments),
+            )
     except ClientError as e:
         console_error(f"S3 ClientError fetching decision matrix: {e}")
-        raise
+        if _matrix is None:
+            raise
     except json.JSONDecodeError as e:
         console_error(f"Failed to parse decision matrix JSON: {e}")
-        raise
+        if _matrix is None:
+            raise
+    _matrix_loaded_at = time.monotonic()
+    return _matrix, _matrix_rules, _matrix_experiments
+
+
+def _to_float(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def match_rule(rules, user_segment, abandonment_reason, facts):
+    """
+    Return ``(rule name, action)`` for the first matching conditional rule,
+    or None. Rules that do not name a segment never apply to guardrail
+    segments.
+    """
+    if rules is None:
+        return None
+    segment = user_segment.lower().replace(" ", "_") if user_segment else "default"
+    return rules.match(
+        {**facts, "segment": segment, "reason": _reason_key(abandonment_reason)},
+        segment_any=segment not in GUARDRAIL_SEGMENTS,
+    )
+
+
+def get_action_policy():
+    """
+    Return the Thompson-sampling policy, loading the posterior table from S3
+    at most once per POSTERIORS_TTL_SECONDS. Returns None when the static
+    policy is configured or the table cannot be loaded.
+    """
+    global _policy, _policy_loaded_at
+    if ACTION_POLICY != "thompson":
+        return None
+    if _policy is not None and time.monotonic() - _policy_loaded_at < POSTERIORS_TTL_SECONDS:
+        return _policy
+
+    try:
+        with tracer.span("s3.get_object", kind="client", **{"s3.key": POSTERIORS_KEY}), \
+                metrics.time("s3.get_object.posteriors"):
+            response = s3_client.get_object(Bucket=DECISION_BUCKET, Key=POSTERIORS_KEY)
+            table = json.loads(response["Body"].read().decode("utf-8"))
+        _policy = ThompsonPolicy(table)
+        logger.info("Loaded action posteriors", version=_policy.version, keys=len(_policy))
+    except (ClientError, json.JSONDecodeError, ValueError, TypeError) as e:
+        console_error(f"Failed to load action posteriors, keeping static policy: {e}")
+    # Retry a failed load only after the TTL, keeping any previous table
+    _policy_loaded_at = time.monotonic()
+    return _policy
+
+
+def _segment_key(matrix, user_segment):
+    """Normalize a segment name, falling back to 'default' if not in the matrix."""
+    segment_key = user_segment.lower().replace(" ", "_") if user_segment else "default"
+    if segment_key not in matrix.get("segments", {}):
+        segment_key = "default"
+    return segment_key
+
+
+def _reason_key(abandonment_reason):
+    return abandonment_reason.lower().replace(" ", "_") if abandonment_reason else None
+
+
+def _action_from_entry(action_data):
+    return {
+        "type": action_data.get("type", "reminder"),
+        "discount": action_data.get("discount"),
+        "message": action_data.get("message", ""),
+        "free_shipping": action_data.get("free_shipping", False)
+    }
 
 
 def resolve_action(matrix, user_segment, abandonment_reason, cart_value=None):
@@ -47,6 +183,10 @@ def resolve_action(matrix, user_segment, abandonment_reason, cart_value=None):
 
     Falls back to 'default' segment if user_segment not found.
     Returns a fallback action if abandonment_reason not found.
+
+    Returns ``(action, source)`` where source names the entry used:
+    ``"table"`` for the segment × reason entry, ``"high_cart_value"`` for the
+    threshold override, or ``"fallback"``.
     """
     segments = matrix.get("segments", {})
 
@@ -69,12 +209,7 @@ def resolve_action(matrix, user_segment, abandonment_reason, cart_value=None):
         if high_cart_action:
             threshold = high_cart_action.get("cart_value_threshold", 0)
             if cart_value > threshold:
-                return {
-                    "type": high_cart_action.get("type", "reminder"),
-                    "discount": high_cart_action.get("discount"),
-                    "message": high_cart_action.get("message", ""),
-                    "free_shipping": high_cart_action.get("free_shipping", False)
-                }
+                return _action_from_entry(high_cart_action), "high_cart_value"
 
     # Return fallback if abandonment_reason not found
     if not reason_key or reason_key not in segment_data:
@@ -82,18 +217,13 @@ def resolve_action(matrix, user_segment, abandonment_reason, cart_value=None):
             f"Abandonment reason '{reason_key}' not found for segment '{segment_key}'. "
             f"Returning fallback action."
         )
-        return FALLBACK_ACTION.copy()
-
-    action_data = segment_data[reason_key]
+        return FALLBACK_ACTION.copy(), "fallback"
 
-    return {
-        "type": action_data.get("type", "reminder"),
-        "discount": action_data.get("discount"),
-        "message": action_data.get("message", ""),
-        "free_shipping": action_data.get("free_shipping", False)
-    }
+    return _action_from_entry(segment_data[reason_key]), "table"
 
 
+@metrics.instrument
+@tracer.instrument
 def handler(event, context):
     """
     Lambda handler for the decision engine.
@@ -105,13 +235,17 @@ def handler(event, context):
         "user_segment": "VIP | standard | high_fraud_risk",
         "abandonment_reason": "payment_failure | shipping_issue | browsing_abandonment",
         "cart_value": 450.00,
-        "fraud_risk": "low | medium | high"
+        "fraud_risk": "low | medium | high",
+        "lifetime_value": 2400.00 (optional, for matrix rules),
+        "device_type": "mobile | desktop | tablet (optional, for matrix rules)",
+        "locale": "en-US (optional, for matrix rules)"
     }
     """
     try:
-        logger.info(f"Received event: {json.dumps(event)}")
-
         cart_id = event.get("cart_id", "unknown")
+        logger.begin(context, cart_id=cart_id)
+        logger.debug("Received event", event=event)
+
         user_segment = event.get("user_segment", "default")
         abandonment_reason = event.get("abandonment_reason", "")
         cart_value = event.get("cart_value")
@@ -121,35 +255,96 @@ def handler(event, context):
         if fraud_risk and fraud_risk.lower() == "high":
             user_segment = "high_fraud_risk"
 
-        # Fetch decision matrix from S3
-        matrix = fetch_decision_matrix()
+        # Fetch decision matrix from S3 (cached, rules precompiled)
+        matrix, rules, experiments = get_decision_matrix()
 
-        # Resolve the recommended action
-        recommended_action = resolve_action(
-            matrix=matrix,
-            user_segment=user_segment,
-            abandonment_reason=abandonment_reason,
-            cart_value=cart_value
-        )
+        # Conditional rules take precedence over the segment × reason table
+        rule = match_rule(rules, user_segment, abandonment_reason, {
+            "cart_value": _to_float(cart_value),
+            "lifetime_value": _to_float(event.get("lifetime_value")),
+            "device_type": event.get("device_type"),
+            "locale": event.get("locale"),
+            "fraud_risk": fraud_risk,
+        })
+        if rule is not None:
+            rule_name, recommended_action = rule[0], _action_from_entry(rule[1])
+            source = "rule"
+        else:
+            rule_name = None
+            # Resolve the recommended action
+            recommended_action, source = resolve_action(
+                matrix=matrix,
+                user_segment=user_segment,
+                abandonment_reason=abandonment_reason,
+                cart_value=cart_value
+            )
+
+        # Optionally let the learned policy pick among the segment's actions;
+        # the static decision stays in place for guardrail cases, rules and
+        # the high_cart_value threshold override.
+        policy_name = "rule" if rule_name else "static"
+        policy = get_action_policy() if source == "table" else None
+        if policy is not None:
+            entry = policy.choose(
+                matrix,
+                _segment_key(matrix, user_segment),
+                _reason_key(abandonment_reason),
+                recommended_action,
+            )
+            if entry is not None:
+                recommended_action = _action_from_entry(entry)
+                policy_name = "thompson"
+
+        # Stateless A/B assignment on the final action; the bandit's own
+        # choices are left alone so its posteriors stay unconfounded
+        experiment = None
+        if policy_name != "thompson":
+            experiment = assign_experiment(
+                experiments,
+                event.get("customer_id"),
+                user_segment.lower().replace(" ", "_") if user_segment else "default",
+                _reason_key(abandonment_reason),
+                recommended_action,
+            )
+            if experiment is not None:
+                recommended_action = experiment[2]
+                metrics.incr(f"experiment.{experiment[0]}", experiment[1])
+
+        metrics.incr(f"decision.{policy_name}", recommended_action.get("type") or "none")
+
+        response_action = {
+            "type": recommended_action.get("type"),
+            "discount": recommended_action.get("discount"),
+            "message": recommended_action.get("message")
+        }
+        if experiment is not None:
+            response_action["experiment"], response_action["variant"] = experiment[0], experiment[1]
 
         # Build response
         result = {
             "statusCode": 200,
             "body": json.dumps({
                 "cart_id": cart_id,
-                "recommended_action": {
-                    "type": recommended_action.get("type"),
-                    "discount": recommended_action.get("discount"),
-                    "message": recommended_action.get("message")
-                }
+                "recommended_action": response_action,
+                "policy": policy_name,
+                "rule": rule_name,
             })
         }
 
-        logger.info(f"Decision engine result: {json.dumps(result)}")
+        logger.info(
+            "Decision engine result",
+            user_segment=user_segment,
+            abandonment_reason=abandonment_reason,
+            action_type=recommended_action.get("type"),
+            policy=policy_name,
+            rule=rule_name,
+            experiment=experiment[0] if experiment else None,
+            variant=experiment[1] if experiment else None,
+        )
         return result
 
     except Exception as e:
-        console_error(f"Decision engine error: {e}")
+        logger.exception("Decision engine error", e)
 
         # Return fallback response on failure
         return {
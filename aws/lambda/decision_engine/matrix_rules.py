@@ -0,0 +1,175 @@
+"""
+Conditional rules for the decision matrix.
+
+An optional ``rules`` list in decision-matrix.json refines the segment ×
+reason table with predicates on the cart and customer:
+
+    "rules": [
+      {
+        "name": "vip_mobile_big_spender",
+        "segment": "VIP",
+        "reason": "browsing_abandonment",
+        "when": {
+          "lifetime_value": {"gte": 2000},
+          "cart_value": {"gt": 100, "lte": 500},
+          "device_type": ["mobile", "tablet"],
+          "locale": "en",
+          "fraud_risk": "low"
+        },
+        "priority": 10,
+        "action": {"type": "discount", "discount": "20%", "message": "..."}
+      }
+    ]
+
+``segment`` and ``reason`` are optional (any). Categorical conditions
+(``device_type``, ``locale``, ``fraud_risk``) take a value or a list of
+values; a language-only locale ("en") also matches regional ones ("en-US").
+Numeric conditions (``lifetime_value``, ``cart_value``) take ``gt``/``gte``/
+``lt``/``lte`` bounds and never match a missing value. The matching rule
+with the highest ``priority`` wins, earlier rules first on ties.
+
+Rules are compiled once per matrix load. Every categorical condition becomes
+part of a hash key, so a lookup probes a fixed number of buckets (one per
+combination of the cart's values and "any") however many rules there are,
+and only the rules in those buckets run their numeric checks, which are
+compiled to closures.
+"""
+
+import itertools
+import operator
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+ANY = "*"
+CATEGORICAL_FIELDS = ("device_type", "locale", "fraud_risk")
+NUMERIC_FIELDS = ("lifetime_value", "cart_value")
+NUMERIC_OPERATORS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+
+# Key order: segment, reason, then CATEGORICAL_FIELDS
+_KEY_FIELDS = ("segment", "reason") + CATEGORICAL_FIELDS
+
+Check = Callable[[dict], bool]
+CompiledRule = Tuple[int, str, Check, dict]  # (rank, name, numeric check, action)
+
+
+def _normalize(value) -> str:
+    return str(value).strip().lower().replace(" ", "_")
+
+
+def _normalize_locale(value) -> str:
+    return str(value).strip().lower().replace("_", "-")
+
+
+def _values(field: str, condition) -> Tuple[str, ...]:
+    values = condition if isinstance(condition, (list, tuple)) else [condition]
+    if not values:
+        raise ValueError(f"empty condition for {field}")
+    normalize = _normalize_locale if field == "locale" else _normalize
+    return tuple(normalize(v) for v in values)
+
+
+def _numeric_check(field: str, bounds) -> Check:
+    if not isinstance(bounds, dict) or not bounds:
+        raise ValueError(f"{field} condition must be an object of gt/gte/lt/lte bounds")
+    tests = []
+    for op_name, bound in bounds.items():
+        if op_name not in NUMERIC_OPERATORS:
+            raise ValueError(f"unknown operator {op_name!r} for {field}")
+        tests.append((NUMERIC_OPERATORS[op_name], float(bound)))
+
+    def check(facts: dict) -> bool:
+        value = facts.get(field)
+        return value is not None and all(op(value, bound) for op, bound in tests)
+
+    return check
+
+
+def _all_of(checks: Sequence[Check]) -> Check:
+    if not checks:
+        return lambda facts: True
+    if len(checks) == 1:
+        return checks[0]
+    return lambda facts: all(check(facts) for check in checks)
+
+
+class RuleSet:
+    """Rules compiled into hash buckets keyed by their categorical conditions."""
+
+    def __init__(self, rules: Sequence[dict]):
+        self._buckets: Dict[tuple, List[CompiledRule]] = {}
+        # Which key positions any rule constrains; unconstrained ones are always ANY
+        constrained = [False] * len(_KEY_FIELDS)
+        ordered = sorted(enumerate(rules), key=lambda item: (-int(item[1].get("priority", 0)), item[0]))
+
+        for rank, (position, rule) in enumerate(ordered):
+            name = rule.get("name") or f"rule_{position}"
+            action = rule.get("action")
+            if not isinstance(action, dict) or not action.get("type"):
+                raise ValueError(f"rule {name}: action with a type is required")
+            when = rule.get("when") or {}
+            unknown = set(when) - set(CATEGORICAL_FIELDS) - set(NUMERIC_FIELDS)
+            if unknown:
+                raise ValueError(f"rule {name}: unknown condition fields {sorted(unknown)}")
+
+            key_values = []
+            for index, field in enumerate(_KEY_FIELDS):
+                condition = rule.get(field) if field in ("segment", "reason") else when.get(field)
+                if condition is None:
+                    key_values.append((ANY,))
+                else:
+                    key_values.append(_values(field, condition))
+                    constrained[index] = True
+
+            check = _all_of([_numeric_check(f, when[f]) for f in NUMERIC_FIELDS if f in when])
+            compiled = (rank, name, check, action)
+            for key in itertools.product(*key_values):
+                self._buckets.setdefault(key, []).append(compiled)
+
+        self._constrained = tuple(constrained)
+        self.size = len(ordered)
+
+    def __len__(self):
+        return self.size
+
+    def _candidates(self, index: int, value) -> Tuple[str, ...]:
+        if not self._constrained[index] or value in (None, ""):
+            return (ANY,)
+        if _KEY_FIELDS[index] == "locale":
+            locale = _normalize_locale(value)
+            language = locale.split("-", 1)[0]
+            return (locale, language, ANY) if language != locale else (locale, ANY)
+        return (_normalize(value), ANY)
+
+    def match(self, facts: dict, segment_any: bool = True) -> Optional[Tuple[str, dict]]:
+        """
+        Return ``(rule name, action)`` of the winning rule for ``facts``
+        (segment, reason, condition fields), or None. With ``segment_any``
+        False only rules naming the segment apply.
+        """
+        candidates = [self._candidates(i, facts.get(field)) for i, field in enumerate(_KEY_FIELDS)]
+        if not segment_any and self._constrained[0]:
+            candidates[0] = candidates[0][:1]
+        elif not segment_any:
+            return None
+
+        best = None
+        for key in itertools.product(*candidates):
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            for rule in bucket:
+                if best is not None and rule[0] >= best[0]:
+                    break
+                if rule[2](facts):
+                    best = rule
+                    break
+        return (best[1], best[3]) if best is not None else None
+
+
+def compile_rules(matrix: dict) -> Optional[RuleSet]:
+    """Compile ``matrix["rules"]``; None when the matrix has no rules."""
+    rules = matrix.get("rules")
+    if not rules:
+        return None
+    if not isinstance(rules, list):
+        raise ValueError("rules must be a list")
+    return RuleSet(rules)
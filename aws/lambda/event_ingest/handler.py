@@ -1,8 +1,19 @@
 import os
 import json
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional
-from elasticsearch import Elasticsearch
+from typing import Callable, Dict, List, Optional, Tuple
+from elasticsearch import ConflictError, Elasticsearch, NotFoundError, helpers
+
+from metrics import Metrics
+from session_sketch import SessionSketch
+from structured_log import get_logger
+from tracing import Tracer
+
+
+log = get_logger("event_ingest")
+metrics = Metrics("event_ingest")
+tracer = Tracer("event_ingest")
 
 
 # Initialize Elasticsearch client (singleton, reused across warm starts)
@@ -21,12 +32,12 @@ def _get_es_client():
     password = os.getenv("ES_PASSWORD")
     
     if not es_endpoint:
-        print("ES_ENDPOINT not set; cannot create ES client")
+        log.error("ES_ENDPOINT not set; cannot create ES client")
         return None
     
     # API key authentication (recommended)
     if api_key:
-        print(f"Connecting to Elasticsearch with API key")
+        log.info("Connecting to Elasticsearch", auth="api_key")
         _es_client = Elasticsearch(
             es_endpoint,
             api_key=api_key,
@@ -35,7 +46,7 @@ def _get_es_client():
         )
     # Basic authentication fallback
     elif username and password:
-        print(f"Connecting to Elasticsearch with basic auth")
+        log.info("Connecting to Elasticsearch", auth="basic")
         _es_client = Elasticsearch(
             es_endpoint,
             basic_auth=(username, password),
@@ -43,7 +54,7 @@ def _get_es_client():
             verify_certs=False
         )
     else:
-        print("No authentication configured")
+        log.warning("No Elasticsearch authentication configured")
         _es_client = Elasticsearch(
             es_endpoint,
             request_timeout=10,
@@ -53,6 +64,65 @@ def _get_es_client():
     return _es_client
 
 
+# Customers opted out via suppression_list, refreshed every
+# SUPPRESSION_REFRESH_SECONDS. Fraud risk is left to the decision matrix:
+# high_fraud_risk carts may still get a reminder_only send.
+_suppressed: Dict[str, str] = {}
+_suppressed_loaded_at = float("-inf")
+
+
+def _load_suppressed() -> Dict[str, str]:
+    """customer_id → reason, paged with a composite aggregation over suppression_list."""
+    es = _get_es_client()
+    if not es:
+        raise RuntimeError("ES client not available")
+    suppressed: Dict[str, str] = {}
+    after = None
+    while True:
+        composite = {
+            "size": 10000,
+            "sources": [{"customer_id": {"terms": {"field": "customer_id"}}}],
+        }
+        if after:
+            composite["after"] = after
+        with tracer.span("es.search", kind="client", **{"es.index": "suppression_list"}), metrics.time("es.search"):
+            result = es.search(
+                index="suppression_list",
+                size=0,
+                aggs={"suppressed": {"composite": composite}},
+            )
+        agg = result["aggregations"]["suppressed"]
+        for bucket in agg["buckets"]:
+            suppressed[bucket["key"]["customer_id"]] = "opt_out"
+        after = agg.get("after_key")
+        if not after or not agg["buckets"]:
+            return suppressed
+
+
+def _suppression_reason(customer_id: Optional[str]) -> Optional[str]:
+    """Why this customer's carts are suppressed, or None. Fails open."""
+    global _suppressed, _suppressed_loaded_at
+    if not customer_id:
+        return None
+    now = time.monotonic()
+    if now - _suppressed_loaded_at >= int(os.getenv("SUPPRESSION_REFRESH_SECONDS", "300")):
+        # A failed refresh is retried after the interval with the last list kept
+        _suppressed_loaded_at = now
+        try:
+            _suppressed = _load_suppressed()
+            log.debug("Suppression list loaded", customers=len(_suppressed))
+        except Exception as e:
+            log.warning("Suppression list refresh failed", error=str(e))
+    return _suppressed.get(customer_id)
+
+
+def _update_suppression(body: dict):
+    """Apply an opt-out to the cached list without waiting for a refresh."""
+    customer_id = body.get("customer_id")
+    if customer_id:
+        _suppressed[customer_id] = "opt_out"
+
+
 def _iso_to_dt(s: str) -> datetime:
     return datetime.fromisoformat(s.replace("Z", "+00:00"))
 
@@ -65,22 +135,328 @@ def _index_document(index: str, doc_id: Optional[str], body: dict):
     """Index a document to Elasticsearch"""
     es = _get_es_client()
     if not es:
-        print(f"ES client not available; skipping {index} id={doc_id}")
+        log.error("ES client not available; skipping document", index=index, doc_id=doc_id)
+        metrics.incr("es.index", "skipped")
         return
     
     try:
-        if doc_id:
-            result = es.index(index=index, id=doc_id, document=body)
-        else:
-            result = es.index(index=index, document=body)
-        print(f"Indexed {index} id={doc_id} -> {result.get('result')}")
+        with tracer.span("es.index", kind="client", **{"es.index": index}), metrics.time("es.index"):
+            if doc_id:
+                result = es.index(index=index, id=doc_id, document=body)
+            else:
+                result = es.index(index=index, document=body)
+        log.debug("Indexed document", index=index, doc_id=doc_id, result=result.get("result"))
     except Exception as e:
-        print(f"Error indexing {index} id={doc_id}: {type(e).__name__}: {e}")
+        log.exception("Error indexing document", e, index=index, doc_id=doc_id)
+
+
+# Bulk status codes worth redelivering the SQS message for; others (mapping
+# errors and the like) fail the same way again and are only logged
+RETRYABLE_BULK_STATUSES = {429, 500, 502, 503, 504}
+
+IndexFn = Callable[[str, Optional[str], dict], None]
+UpdateFn = Callable[[str, str, dict], None]
+DeleteFn = Callable[[str, str], None]
+TimingFn = Callable[[dict], None]
+UPDATE_RETRY_ON_CONFLICT = 5
+
+
+def _update_document(index: str, doc_id: str, update: dict):
+    """Apply a scripted upsert (``update`` is the _update request body)"""
+    es = _get_es_client()
+    if not es:
+        log.error("ES client not available; skipping update", index=index, doc_id=doc_id)
+        metrics.incr("es.update", "skipped")
+        return
+
+    try:
+        with tracer.span("es.update", kind="client", **{"es.index": index}), metrics.time("es.update"):
+            es.update(index=index, id=doc_id, retry_on_conflict=UPDATE_RETRY_ON_CONFLICT, **update)
+    except Exception as e:
+        log.exception("Error updating document", e, index=index, doc_id=doc_id)
+
+
+def _delete_document(index: str, doc_id: str):
+    """Delete a document; a missing one is not an error"""
+    es = _get_es_client()
+    if not es:
+        log.error("ES client not available; skipping delete", index=index, doc_id=doc_id)
+        metrics.incr("es.delete", "skipped")
+        return
+
+    try:
+        with tracer.span("es.delete", kind="client", **{"es.index": index}), metrics.time("es.delete") as call:
+            try:
+                es.delete(index=index, id=doc_id)
+            except NotFoundError:
+                call.outcome = "not_found"
+    except Exception as e:
+        log.exception("Error deleting document", e, index=index, doc_id=doc_id)
+
+
+# cart_due_queue/<cart_id> mirrors the cart_state of active carts only, in an
+# index sorted on check_at: the abandonment scan reads the oldest due entries
+# and stops, however many completed and recovered carts cart_state holds
+DUE_QUEUE_INDEX = "cart_due_queue"
+DUE_QUEUE_FIELDS = ("@timestamp", "cart_id", "customer_id", "session_id", "last_seen", "check_at", "status",
+                    "cart_value", "currency", "device_type")
+
+
+def _sync_due_queue(cart_state: dict, index_document: IndexFn, delete_document: DeleteFn):
+    """Enqueue an active cart, or remove a cart that left the active state."""
+    cart_id = cart_state["cart_id"]
+    if cart_state.get("status") == "active":
+        index_document(DUE_QUEUE_INDEX, cart_id, {k: cart_state.get(k) for k in DUE_QUEUE_FIELDS})
+    else:
+        delete_document(DUE_QUEUE_INDEX, cart_id)
+
+
+# cart_contents/<cart_id> holds the cart's current line items, maintained by
+# a scripted upsert per cart_events row so readers never re-aggregate
+# cart_events. The event's _id is remembered (last CART_CONTENTS_APPLIED_IDS)
+# so a redelivered event is a no-op.
+CART_CONTENTS_INDEX = "cart_contents"
+CART_CONTENTS_APPLIED_IDS = 100
+CART_ITEM_OPS = {
+    "add_to_cart": "add",             # quantity is added to the line
+    "remove_from_cart": "remove",     # quantity is removed; without one, the whole line
+    "update_quantity": "set",         # quantity replaces the line's; 0 removes it; required
+}
+CART_CONTENTS_SCRIPT = """
+def src = ctx._source;
+if (src.items == null) {
+  src.cart_id = params.cart_id;
+  src.items = [:];
+  src.applied = [];
+}
+if (params.event_id != null) {
+  if (src.applied.contains(params.event_id)) { ctx.op = 'noop'; return; }
+  src.applied.add(params.event_id);
+  if (src.applied.size() > params.max_applied) { src.applied.remove(0); }
+}
+if (params.op == 'set' && params.quantity == null) { ctx.op = 'noop'; return; }
+def items = src.items;
+def line = items.get(params.product_id);
+if (params.op == 'remove') {
+  if (line != null) {
+    if (params.quantity == null) { items.remove(params.product_id); }
+    else {
+      line.quantity -= params.quantity;
+      if (line.quantity <= 0) { items.remove(params.product_id); }
+    }
+  }
+} else if (params.op == 'set' && params.quantity != null && params.quantity <= 0) {
+  items.remove(params.product_id);
+} else {
+  if (line == null) { line = ['quantity': 0]; items.put(params.product_id, line); }
+  int quantity = params.quantity == null ? 1 : params.quantity;
+  line.quantity = params.op == 'set' ? quantity : line.quantity + quantity;
+  if (params.unit_price != null) { line.unit_price = params.unit_price; }
+  if (params.product_name != null) { line.product_name = params.product_name; }
+}
+int totalQuantity = 0;
+double value = 0;
+for (def item : items.values()) {
+  totalQuantity += item.quantity;
+  if (item.unit_price != null) { value += item.quantity * item.unit_price; }
+}
+src.item_count = items.size();
+src.total_quantity = totalQuantity;
+src.cart_value = Math.round(value * 100) / 100.0;
+src['@timestamp'] = params.timestamp;
+if (params.customer_id != null) { src.customer_id = params.customer_id; }
+if (params.currency != null) { src.currency = params.currency; }
+"""
+
+
+def _cart_contents_update(body: dict, event_id: Optional[str]) -> Optional[dict]:
+    """The cart_contents scripted upsert for a cart_events row, or None if it changes no line"""
+    op = CART_ITEM_OPS.get((body.get("event_type") or "").lower())
+    if not op or not body.get("cart_id") or not body.get("product_id"):
+        return None
+    quantity = body.get("quantity")
+    if op == "set" and quantity is None:
+        log.warning("update_quantity without quantity, skipping", cart_id=body["cart_id"],
+                    product_id=body["product_id"])
+        return None
+    unit_price = body.get("unit_price")
+    return {
+        "script": {
+            "lang": "painless",
+            "source": CART_CONTENTS_SCRIPT,
+            "params": {
+                "cart_id": body["cart_id"],
+                "product_id": str(body["product_id"]),
+                "op": op,
+                "quantity": int(quantity) if quantity is not None else None,
+                "unit_price": float(unit_price) if unit_price is not None else None,
+                "product_name": body.get("product_name"),
+                "customer_id": body.get("customer_id"),
+                "currency": body.get("currency"),
+                "timestamp": body.get("@timestamp") or _now_iso(),
+                "event_id": event_id,
+                "max_applied": CART_CONTENTS_APPLIED_IDS,
+            },
+        },
+        "scripted_upsert": True,
+        "upsert": {},
+    }
+
+
+# Send statuses of a recovery that went out or is on its way (mirrors
+# recovery_action.PENDING_OR_SENT); only these make an agent decision reusable
+PENDING_OR_SENT = ("sent", "deferred", "scheduled")
+
+
+# Raw page timings (``_index: page_timings``) are not stored; they are folded
+# into a per-session sketch in session_sketches, and session_metrics is
+# derived from the sketches by the scheduled flush
+TIMING_INDEX = "page_timings"
+SKETCH_INDEX = "session_sketches"
+SKETCH_MAX_RETRIES = int(os.getenv("SKETCH_MAX_RETRIES", "5"))
+# Ids of the last timings merged into a sketch, so a redelivered SQS message
+# does not count its timings twice
+SKETCH_APPLIED_IDS = int(os.getenv("SKETCH_APPLIED_IDS", "1000"))
+FLUSH_PAGE_SIZE = 500
+
+
+def _update_session_sketches(timings: Dict[str, List[Tuple[Optional[str], dict]]]) -> List[str]:
+    """
+    Merge each session's ``(timing_id, timing)`` pairs into its
+    session_sketches document with an optimistic-concurrency
+    read-modify-write (``if_seq_no`` / ``if_primary_term``, retried on
+    conflict). Timings whose id is in the document's ``applied`` list are
+    skipped. Returns the session ids that could not be updated.
+    """
+    es = _get_es_client()
+    if not es:
+        log.error("ES client not available; skipping timings", sessions=len(timings))
+        return []
+
+    failed = []
+    for session_id, session_timings in timings.items():
+        latest = session_timings[-1][1]
+        for attempt in range(SKETCH_MAX_RETRIES):
+            try:
+                with tracer.span("es.sketch", kind="client", **{"es.index": SKETCH_INDEX}), \
+                        metrics.time("es.sketch") as call:
+                    try:
+                        current = es.get(index=SKETCH_INDEX, id=session_id)
+                        doc = current["_source"]
+                        guard = {"if_seq_no": current["_seq_no"], "if_primary_term": current["_primary_term"]}
+                    except NotFoundError:
+                        doc, guard = {"session_id": session_id}, {"op_type": "create"}
+                    applied = list(doc.get("applied") or [])
+                    seen = set(applied)
+                    new_timings = []
+                    for timing_id, timing in session_timings:
+                        if timing_id is not None:
+                            if timing_id in seen:
+                                continue
+                            seen.add(timing_id)
+                            applied.append(timing_id)
+                        new_timings.append(timing)
+                    if not new_timings:
+                        call.outcome = "duplicate"
+                        break
+                    sketch = SessionSketch.from_dict(doc.get("sketch"))
+                    sketch.add_timings(new_timings)
+                    doc.update({
+                        "@timestamp": _now_iso(),
+                        "customer_id": latest.get("customer_id") or doc.get("customer_id"),
+                        "route": latest.get("route") or doc.get("route"),
+                        "device_type": latest.get("device_type") or doc.get("device_type"),
+                        "sketch": sketch.to_dict(),
+                        "applied": applied[-SKETCH_APPLIED_IDS:],
+                        "dirty": True,
+                    })
+                    try:
+                        es.index(index=SKETCH_INDEX, id=session_id, document=doc, **guard)
+                    except ConflictError:
+                        call.outcome = "conflict"
+                        continue
+                break
+            except Exception as e:
+                log.exception("Error updating session sketch", e, session_id=session_id)
+                failed.append(session_id)
+                break
+        else:
+            log.warning("Session sketch update kept conflicting", session_id=session_id, attempts=SKETCH_MAX_RETRIES)
+            failed.append(session_id)
+    return failed
 
 
-def _process_event(detail: dict, detail_type: Optional[str] = None):
+def _record_timing(body: dict):
+    _update_session_sketches({body["session_id"]: [(None, body)]})
+
+
+def _flush_session_metrics() -> dict:
+    """
+    Write session_metrics for every sketch changed since its last flush and
+    mark the sketch clean. A sketch updated in the meantime fails its
+    ``if_seq_no`` check, stays dirty and is flushed on the next run.
+    """
+    es = _get_es_client()
+    if not es:
+        log.error("ES client not available; skipping session metrics flush")
+        return {"status": "skipped"}
+
+    flushed = conflicts = 0
+    search_after = None
+    while True:
+        kwargs = {"search_after": search_after} if search_after else {}
+        with metrics.time("es.search"):
+            hits = es.search(
+                index=SKETCH_INDEX,
+                size=FLUSH_PAGE_SIZE,
+                query={"term": {"dirty": True}},
+                sort=[{"session_id": "asc"}],
+                seq_no_primary_term=True,
+                **kwargs,
+            )["hits"]["hits"]
+        if not hits:
+            break
+        search_after = hits[-1]["sort"]
+
+        now = _now_iso()
+        session_metrics = []
+        for hit in hits:
+            doc = hit["_source"]
+            session_metrics.append({"_index": "session_metrics", "_id": doc["session_id"], "_source": {
+                "@timestamp": doc.get("@timestamp") or now,
+                "session_id": doc["session_id"],
+                "customer_id": doc.get("customer_id"),
+                "route": doc.get("route"),
+                "device_type": doc.get("device_type"),
+                **SessionSketch.from_dict(doc.get("sketch")).metrics_doc(),
+            }})
+        # Only sketches whose metrics were written are marked clean
+        cleaned = [
+            {"_index": SKETCH_INDEX, "_id": hit["_id"], "if_seq_no": hit["_seq_no"],
+             "if_primary_term": hit["_primary_term"], "_source": {**hit["_source"], "dirty": False, "flushed_at": now}}
+            for hit, status in zip(hits, _bulk_index(session_metrics)) if status is None
+        ]
+        flushed += len(cleaned)
+        if cleaned:
+            conflicts += _bulk_index(cleaned).count(409)
+
+    log.info("Flushed session metrics", flushed=flushed, conflicts=conflicts)
+    return {"status": "ok", "flushed": flushed}
+
+
+def _process_event(detail: dict, detail_type: Optional[str] = None, index_document: IndexFn = _index_document,
+                   record_timing: TimingFn = _record_timing, update_document: UpdateFn = _update_document,
+                   delete_document: DeleteFn = _delete_document):
+    """
+    Index one event and derive its cart_state / cart_due_queue /
+    cart_contents / recommendation_cache documents. ``index_document(index,
+    doc_id, body)``, ``update_document(index, doc_id, update)`` and
+    ``delete_document(index, doc_id)`` write each document; the SQS path
+    passes ones that queue them for a bulk request. Page timings go to
+    ``record_timing(body)`` instead of being indexed.
+    """
     if not isinstance(detail, dict):
-        print("detail is not a dict, skipping", detail)
+        log.warning("detail is not a dict, skipping", detail_type=detail_type, detail_kind=type(detail).__name__)
         return
 
     # Determine index name
@@ -88,8 +464,15 @@ def _process_event(detail: dict, detail_type: Optional[str] = None):
     doc_id = detail.get("_id")
     body = detail.get("_source") if "_source" in detail else detail
 
+    if str(index).lower() == TIMING_INDEX:
+        if body.get("session_id"):
+            record_timing(body)
+        else:
+            log.warning("Page timing without session_id, skipping")
+        return
+
     # Index the original document
-    _index_document(index, doc_id, body)
+    index_document(index, doc_id, body)
 
     try:
         idx_lower = index.lower()
@@ -98,9 +481,16 @@ def _process_event(detail: dict, detail_type: Optional[str] = None):
 
     cart_id = body.get("cart_id")
 
+    if idx_lower == "suppression_list":
+        _update_suppression(body)
+
     # ── Scenario 1 & 2: cart_events with add_to_cart → create/update cart_state as "active"
     # Only trigger on cart_events index (not cart_state or other indices containing "cart")
     if idx_lower == "cart_events":
+        contents_update = _cart_contents_update(body, doc_id)
+        if contents_update:
+            update_document(CART_CONTENTS_INDEX, body["cart_id"], contents_update)
+
         event_type = (body.get("event_type") or "").lower()
         if event_type == "add_to_cart" and cart_id:
             last_seen = body.get("@timestamp") or body.get("last_seen") or _now_iso()
@@ -125,7 +515,16 @@ def _process_event(detail: dict, detail_type: Optional[str] = None):
                 "device_type": body.get("device_type"),
             }
 
-            _index_document("cart_state", f"state_{cart_id}", cart_state)
+            # Opted-out customers must not be messaged; keep their carts
+            # out of the abandonment scan altogether
+            reason = _suppression_reason(body.get("customer_id"))
+            if reason:
+                cart_state["status"] = "suppressed"
+                cart_state["suppression_reason"] = reason
+                metrics.incr("cart_state", "suppressed")
+
+            index_document("cart_state", f"state_{cart_id}", cart_state)
+            _sync_due_queue(cart_state, index_document, delete_document)
 
     # ── Scenario 3: Successful checkout/payment → cart_state "completed"
     if idx_lower in ("checkout_events", "payment_logs"):
@@ -168,7 +567,8 @@ def _process_event(detail: dict, detail_type: Optional[str] = None):
                     "currency": body.get("currency"),
                 }
 
-                _index_document("cart_state", f"state_{cart_id}", cart_state)
+                index_document("cart_state", f"state_{cart_id}", cart_state)
+                _sync_due_queue(cart_state, index_document, delete_document)
 
     # ── Scenario 4: recovery_history event → cart_state "recovery_sent"
     if idx_lower == "recovery_history":
@@ -191,19 +591,188 @@ def _process_event(detail: dict, detail_type: Optional[str] = None):
                 "action_type": body.get("action", {}).get("type") if isinstance(body.get("action"), dict) else None,
             }
 
-            _index_document("cart_state", f"state_{cart_id}", cart_state)
+            index_document("cart_state", f"state_{cart_id}", cart_state)
+            _sync_due_queue(cart_state, index_document, delete_document)
+
+        # ── Scenario 5: the agent's choice for a diagnosis fingerprint is
+        # cached so the workflow can reuse it for identical diagnoses. Per-
+        # customer outcomes (blocked, capped, skipped) are not a recommendation
+        fingerprint = body.get("fingerprint")
+        diagnosis = body.get("diagnosis") if isinstance(body.get("diagnosis"), dict) else {}
+        if fingerprint and body.get("decision_path") == "agent" and diagnosis.get("root_cause") \
+                and body.get("send_status") in PENDING_OR_SENT:
+            hours = int(os.getenv("RECOMMENDATION_CACHE_TTL_HOURS", "24"))
+            expires_at = datetime.now(timezone.utc) + timedelta(hours=hours)
+            recommendation = {
+                "@timestamp": _now_iso(),
+                "fingerprint": fingerprint,
+                "root_cause": diagnosis["root_cause"],
+                "action_type": body.get("action", {}).get("type") if isinstance(body.get("action"), dict) else None,
+                "source_recovery_id": body.get("recovery_id"),
+                "expires_at": expires_at.isoformat().replace("+00:00", "Z"),
+            }
+
+            index_document("recommendation_cache", fingerprint, recommendation)
+
+
+def _traced_process_event(detail, detail_type: Optional[str] = None, index_document: IndexFn = _index_document,
+                          record_timing: TimingFn = _record_timing, update_document: UpdateFn = _update_document,
+                          delete_document: DeleteFn = _delete_document):
+    """Process one detail in a span that continues the producer's trace (``detail["_meta"]``)."""
+    parent = tracer.extract(detail.get("_meta")) if isinstance(detail, dict) else None
+    index = detail.get("_index") if isinstance(detail, dict) else None
+    with tracer.span("ingest", kind="consumer", parent=parent, **{"es.index": index or detail_type}):
+        _process_event(detail, detail_type, index_document, record_timing, update_document, delete_document)
+
+
+def _details(event: dict):
+    """``(detail, detail_type)`` pairs of an EventBridge event; ``detail`` may be a list."""
+    detail = event.get("detail")
+    detail_type = event.get("detail-type") or event.get("detailType")
+    details = detail if isinstance(detail, list) else [detail]
+    return [(d, detail_type) for d in details]
+
 
+def _bulk_index(operations: List[dict]) -> List[Optional[int]]:
+    """
+    Send queued documents in bulk requests. Returns, per operation, None on
+    success or the failure status (0 when the request itself failed).
+    """
+    es = _get_es_client()
+    if not es:
+        log.error("ES client not available; skipping documents", documents=len(operations))
+        metrics.incr("es.index", "skipped", len(operations))
+        return [None] * len(operations)
 
+    statuses: List[Optional[int]] = []
+    try:
+        with tracer.span("es.bulk", kind="client", **{"es.documents": len(operations)}), \
+                metrics.time("es.bulk") as call:
+            for ok, item in helpers.streaming_bulk(
+                es, operations, chunk_size=500, raise_on_error=False, raise_on_exception=False
+            ):
+                if ok:
+                    statuses.append(None)
+                    continue
+                op_type, result = next(iter(item.items()))
+                status = result.get("status")
+                if op_type == "delete" and status == 404:
+                    # Already gone, e.g. a cart that was never queued
+                    statuses.append(None)
+                    continue
+                statuses.append(status if isinstance(status, int) else 0)
+                log.warning("Bulk item failed", index=result.get("_index"), doc_id=result.get("_id"),
+                            status=status, error=str(result.get("error"))[:500])
+            if any(status is not None for status in statuses):
+                call.outcome = "partial"
+    except Exception as e:
+        log.exception("Bulk request failed", e, documents=len(operations))
+        statuses += [0] * (len(operations) - len(statuses))
+    failed = len(statuses) - statuses.count(None)
+    metrics.incr("es.index", "ok", len(statuses) - failed)
+    if failed:
+        metrics.incr("es.index", "error", failed)
+    return statuses
+
+
+def _process_records(records: List[dict]) -> dict:
+    """
+    Index a batch of SQS records, each holding one EventBridge event, with
+    bulk requests. Records whose documents failed with a retryable status are
+    reported in ``batchItemFailures`` so only they are redelivered.
+    """
+    operations: List[dict] = []
+    owners: List[str] = []
+    failures = set()
+    # Timings are merged per session, one sketch update per session per batch
+    timings: Dict[str, List[Tuple[Optional[str], dict]]] = {}
+    timing_owners: Dict[str, set] = {}
+
+    for record in records:
+        message_id = record.get("messageId")
+        try:
+            event = json.loads(record["body"])
+        except (KeyError, TypeError, ValueError):
+            log.error("Malformed queue record", message_id=message_id)
+            continue
+        # Documents without an _id get one derived from the EventBridge event
+        # id, so a redelivered message overwrites instead of duplicating them
+        event_id = event.get("id") or message_id
+        ordinal = 0
+
+        def queue_document(index: str, doc_id: Optional[str], body: dict):
+            nonlocal ordinal
+            ordinal += 1
+            operations.append({"_index": index, "_id": doc_id or f"{event_id}-{ordinal}", "_source": body})
+            owners.append(message_id)
+
+        def queue_update(index: str, doc_id: str, update: dict):
+            # The cart_events row is queued just before its cart_contents
+            # update; its derived _id makes a redelivered row a no-op too
+            params = update["script"]["params"]
+            if params.get("event_id") is None:
+                params["event_id"] = f"{event_id}-{ordinal}"
+            operations.append({"_op_type": "update", "_index": index, "_id": doc_id,
+                               "retry_on_conflict": UPDATE_RETRY_ON_CONFLICT, **update})
+            owners.append(message_id)
+
+        def queue_delete(index: str, doc_id: str):
+            operations.append({"_op_type": "delete", "_index": index, "_id": doc_id})
+            owners.append(message_id)
+
+        def queue_timing(body: dict):
+            # Timings take a derived id like documents do, so a redelivered
+            # message's timings are recognised as already applied
+            nonlocal ordinal
+            ordinal += 1
+            timings.setdefault(body["session_id"], []).append((f"{event_id}-{ordinal}", body))
+            timing_owners.setdefault(body["session_id"], set()).add(message_id)
+
+        try:
+            for detail, detail_type in _details(event):
+                _traced_process_event(detail, detail_type, queue_document, queue_timing, queue_update, queue_delete)
+        except Exception as e:
+            log.exception("Error processing queued event", e, message_id=message_id)
+            failures.add(message_id)
+
+    if operations:
+        for owner, status in zip(owners, _bulk_index(operations)):
+            if status is not None and (status == 0 or status in RETRYABLE_BULK_STATUSES):
+                failures.add(owner)
+    if timings:
+        for session_id in _update_session_sketches(timings):
+            failures.update(timing_owners[session_id])
+
+    log.info("Processed queued events", records=len(records), documents=len(operations),
+             sessions=len(timings), failed=len(failures))
+    return {"batchItemFailures": [{"itemIdentifier": m} for m in sorted(failures)]}
+
+
+@metrics.instrument
+@tracer.instrument
 def lambda_handler(event, context):
+    # Scheduled rule: derive session_metrics from the changed sketches
+    if event.get("action") == "flush_session_metrics":
+        log.begin(context, action="flush_session_metrics")
+        return _flush_session_metrics()
+
+    # EventBridge -> SQS -> Lambda: a batch of queued events
+    if "Records" in event:
+        log.begin(context, records=len(event["Records"]))
+        return _process_records(event["Records"])
+
     detail = event.get("detail")
     detail_type = event.get("detail-type") or event.get("detailType")
+    log.begin(context, detail_type=detail_type)
 
     # If a list of details was provided, iterate
     if isinstance(detail, list):
         for d in detail:
-            _process_event(d, detail_type)
+            _traced_process_event(d, detail_type)
+        log.info("Processed events", processed=len(detail))
         return {"status": "ok", "processed": len(detail)}
 
     # Single event
-    _process_event(detail, detail_type)
+    _traced_process_event(detail, detail_type)
+    log.info("Processed event", processed=1)
     return {"status": "ok"}
@@ -0,0 +1,181 @@
+"""
+Per-session page-timing sketches.
+
+Raw page timings are folded into one ``SessionSketch`` per session instead of
+being stored: a DDSketch of ``duration_ms`` plus request, error and Apdex
+counters. A DDSketch maps each value to the logarithmic bucket
+``ceil(log_gamma(value))`` with ``gamma = (1 + a) / (1 - a)``, so every
+quantile it returns is within relative accuracy ``a`` of a true sample value,
+and sketches merge by adding bucket counts. Memory is bounded by
+``max_bins``: past it the lowest buckets are collapsed together, which only
+costs accuracy at the low end, far from p95.
+
+Sketches are stored in session_sketches as plain JSON (``to_dict`` /
+``from_dict``); the derived session_metrics document comes from
+``metrics_doc``.
+"""
+
+import math
+from typing import Dict, Iterable, Optional
+
+RELATIVE_ACCURACY = 0.01
+MAX_BINS = 1024
+# Apdex target: satisfied at or under T, tolerating up to 4T
+APDEX_T_MS = 500.0
+
+
+class DDSketch:
+    """Relative-error quantile sketch over non-negative values."""
+
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY, max_bins: int = MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float) -> None:
+        value = float(value)
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with different accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for bound in (other.min, other.max):
+            if bound is not None:
+                self.min = bound if self.min is None else min(self.min, bound)
+                self.max = bound if self.max is None else max(self.max, bound)
+
+    def _collapse(self) -> None:
+        """Fold the lowest buckets into one until at most ``max_bins`` remain."""
+        keys = sorted(self.bins)
+        excess = keys[: len(keys) - self.max_bins + 1]
+        target = excess[-1]
+        self.bins[target] = sum(self.bins.pop(k) for k in excess[:-1]) + self.bins[target]
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        # Nearest rank: a session's few slow pages still show up in its p95
+        rank = max(0, math.ceil(q * self.count) - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        keys = sorted(self.bins)
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "keys": keys,
+            "counts": [self.bins[k] for k in keys],
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, max_bins: int = MAX_BINS) -> "DDSketch":
+        sketch = cls(data.get("relative_accuracy", RELATIVE_ACCURACY), max_bins)
+        sketch.bins = dict(zip(data.get("keys", []), data.get("counts", [])))
+        sketch.zero_count = data.get("zero_count", 0)
+        sketch.count = data.get("count", 0)
+        sketch.min = data.get("min")
+        sketch.max = data.get("max")
+        return sketch
+
+
+def is_error(timing: dict) -> bool:
+    """A timing counts as an error when flagged or answered with a 5xx."""
+    if timing.get("error"):
+        return True
+    try:
+        return int(timing.get("status_code") or 0) >= 500
+    except (TypeError, ValueError):
+        return False
+
+
+class SessionSketch:
+    """Latency sketch and request/error/Apdex counters for one session."""
+
+    def __init__(self, latency: Optional[DDSketch] = None, requests: int = 0, errors: int = 0,
+                 satisfied: int = 0, tolerating: int = 0):
+        self.latency = latency or DDSketch()
+        self.requests = requests
+        self.errors = errors
+        self.satisfied = satisfied
+        self.tolerating = tolerating
+
+    def add_timings(self, timings: Iterable[dict]) -> None:
+        for timing in timings:
+            self.requests += 1
+            if is_error(timing):
+                self.errors += 1
+            try:
+                duration = float(timing["duration_ms"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            # NaN, infinite or negative durations have no place in the sketch
+            if not math.isfinite(duration) or duration < 0:
+                continue
+            self.latency.add(duration)
+            if duration <= APDEX_T_MS:
+                self.satisfied += 1
+            elif duration <= 4 * APDEX_T_MS:
+                self.tolerating += 1
+
+    def metrics_doc(self) -> dict:
+        """session_metrics fields: p95 latency, error rate and Apdex."""
+        p95 = self.latency.quantile(0.95)
+        timed = self.latency.count
+        return {
+            "p95_latency_ms": round(p95) if p95 is not None else None,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else None,
+            "apdex": round((self.satisfied + self.tolerating / 2) / timed, 4) if timed else None,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "latency": self.latency.to_dict(),
+            "requests": self.requests,
+            "errors": self.errors,
+            "satisfied": self.satisfied,
+            "tolerating": self.tolerating,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "SessionSketch":
+        if not data:
+            return cls()
+        return cls(
+            DDSketch.from_dict(data.get("latency") or {}),
+            data.get("requests", 0),
+            data.get("errors", 0),
+            data.get("satisfied", 0),
+            data.get("tolerating", 0),
+        )
@@ -2,28 +2,52 @@
 MCP (Model Context Protocol) Server – AWS Lambda Handler.
 
 Implements the MCP JSON-RPC 2.0 protocol over Streamable HTTP transport.
-Exposes the Decision Engine and Recovery Action Lambdas as MCP tools.
+Exposes the Decision Engine and Recovery Action Lambdas as MCP tools, plus the
+composite recover_cart / recover_carts_batch tools that run both server-side.
 
 Authentication is handled upstream by API Gateway API-key enforcement.
 """
 
+import contextvars
 import json
 import os
-import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import boto3
 from botocore.exceptions import ClientError
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from metrics import Metrics
+from structured_log import get_logger
+from tracing import Tracer
+
+logger = get_logger("mcp_server")
+metrics = Metrics("mcp_server")
+tracer = Tracer("mcp_server")
 
 lambda_client = boto3.client("lambda")
 
 DECISION_ENGINE_FUNCTION = os.environ.get("DECISION_ENGINE_FUNCTION", "")
 RECOVERY_ACTION_FUNCTION = os.environ.get("RECOVERY_ACTION_FUNCTION", "")
 
+# recover_carts_batch limits. No cart is started after the time budget, so
+# the call answers within API Gateway's 29 s integration timeout.
+BATCH_MAX_CARTS = int(os.environ.get("BATCH_MAX_CARTS", "25"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_TIME_BUDGET_SECONDS = float(os.environ.get("BATCH_TIME_BUDGET_SECONDS", "20"))
+
 MCP_SERVER_NAME = "ai-abandoned-cart-recovery-mcp"
 MCP_SERVER_VERSION = "1.0.0"
-MCP_PROTOCOL_VERSION = "2025-03-26"
+MCP_PROTOCOL_VERSION = "2025-06-18"
+# Older clients ignore structuredContent and read the text content block
+SUPPORTED_PROTOCOL_VERSIONS = ("2025-06-18", "2025-03-26")
+STRUCTURED_CONTENT_VERSION = "2025-06-18"
+# Streamable HTTP clients send MCP-Protocol-Version; without it, assume this
+DEFAULT_HTTP_PROTOCOL_VERSION = "2025-03-26"
+# Longest string value quoted in a structured result's text summary
+SUMMARY_VALUE_MAX = 200
+
+COMPACT_SEPARATORS = (",", ":")
 
 # ── MCP Tool Definitions ────────────────────────────────────────────────────
 
@@ -74,6 +98,18 @@ TOOLS = [
                     "description": "Customer fraud risk level: low, medium, high",
                     "enum": ["low", "medium", "high"],
                 },
+                "lifetime_value": {
+                    "type": "number",
+                    "description": "Customer lifetime value (optional, used by matrix rules)",
+                },
+                "device_type": {
+                    "type": "string",
+                    "description": "Device the cart was built on, e.g. mobile, desktop (optional, used by matrix rules)",
+                },
+                "locale": {
+                    "type": "string",
+                    "description": "Customer locale, e.g. en-US (optional, used by matrix rules)",
+                },
             },
             "required": ["cart_id", "customer_id", "user_segment", "abandonment_reason"],
         },
@@ -131,21 +167,141 @@ TOOLS = [
                             "type": "string",
                             "description": "Recovery message to include in the email",
                         },
+                        "experiment": {
+                            "type": "string",
+                            "description": "A/B experiment the action was assigned by (pass through unchanged)",
+                        },
+                        "variant": {
+                            "type": "string",
+                            "description": "Experiment variant the customer was assigned (pass through unchanged)",
+                        },
                     },
                     "required": ["type", "message"],
                 },
+                "segment": {
+                    "type": "string",
+                    "description": "Customer segment, recorded in recovery_history (optional)",
+                },
+                "fraud_risk": {
+                    "type": "string",
+                    "description": "Customer fraud risk level, recorded in recovery_history (optional)",
+                },
+                "root_cause": {
+                    "type": "string",
+                    "description": "Diagnosed root cause, recorded in recovery_history (optional)",
+                },
+                "cart_value": {
+                    "type": "number",
+                    "description": "Cart value, recorded in recovery_history (optional)",
+                },
+                "currency": {
+                    "type": "string",
+                    "description": "Cart currency, recorded in recovery_history (optional)",
+                },
+                "timezone": {
+                    "type": "string",
+                    "description": (
+                        "Customer IANA timezone (optional); sends outside the local send "
+                        "window are scheduled for the next morning"
+                    ),
+                },
             },
             "required": ["cart_id", "customer_id", "email", "recommended_action"],
         },
     },
 ]
 
+# A diagnosed cart, as taken by the composite tools
+CART_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "cart_id": {"type": "string", "description": "Unique identifier for the abandoned cart"},
+        "customer_id": {"type": "string", "description": "Unique identifier for the customer"},
+        "email": {"type": "string", "description": "Customer email address"},
+        "customer_name": {"type": "string", "description": "Customer display name (optional)"},
+        "user_segment": {"type": "string", "description": "Customer segment: VIP, standard, high_fraud_risk"},
+        "root_cause": {
+            "type": "string",
+            "description": (
+                "Diagnosed root cause, as emitted by the workflow (payment_failure, "
+                "pricing_shipping, performance_latency, browsing_or_window_shopping, unknown) "
+                "or as a decision matrix reason (shipping_issue, browsing_abandonment)"
+            ),
+        },
+        "cart_value": {"type": "number", "description": "Total value of the abandoned cart"},
+        "currency": {"type": "string", "description": "Cart currency"},
+        "fraud_risk": {"type": "string", "description": "Customer fraud risk level: low, medium, high"},
+        "timezone": {"type": "string", "description": "Customer IANA timezone from the profile (optional)"},
+        "lifetime_value": {"type": "number", "description": "Customer lifetime value (optional)"},
+        "device_type": {"type": "string", "description": "Device the cart was built on (optional)"},
+        "locale": {"type": "string", "description": "Customer locale, e.g. en-US (optional)"},
+        "decision_path": {
+            "type": "string",
+            "description": "How the cart was routed by the workflow, recorded in recovery_history",
+            "enum": ["fast_path", "cached", "agent"],
+        },
+        "run_id": {"type": "string", "description": "Workflow execution id, recorded in recovery_history"},
+        "fingerprint": {
+            "type": "string",
+            "description": (
+                "Diagnosis fingerprint from the workflow, recorded in recovery_history; "
+                "agent decisions are cached under it"
+            ),
+        },
+    },
+    "required": ["cart_id", "customer_id", "email", "root_cause"],
+}
+
+TOOLS += [
+    {
+        "name": "recover_cart",
+        "description": (
+            "Run the full recovery for one diagnosed cart in a single call: decide the "
+            "action with the decision engine, then send it with the recovery action. "
+            "Returns the recommended action and send result."
+        ),
+        "inputSchema": CART_SCHEMA,
+    },
+    {
+        "name": "recover_carts_batch",
+        "description": (
+            f"Run recover_cart for up to {BATCH_MAX_CARTS} diagnosed carts concurrently. "
+            "Returns one result per processed cart, in input order, and the cart_ids left "
+            "unprocessed when the time budget ran out in `remaining` (call again with those "
+            "carts). On servers that stream SSE, a progress token also streams each cart's "
+            "result as a progress notification when it completes."
+        ),
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "carts": {"type": "array", "items": CART_SCHEMA, "maxItems": BATCH_MAX_CARTS},
+            },
+            "required": ["carts"],
+        },
+    },
+]
+
 # Tool name → Lambda function name mapping
 TOOL_FUNCTION_MAP = {
     "decision_engine": DECISION_ENGINE_FUNCTION,
     "recovery_action": RECOVERY_ACTION_FUNCTION,
 }
 
+# Workflow diagnosis names → decision matrix reason keys
+ROOT_CAUSE_TO_REASON = {
+    "pricing_shipping": "shipping_issue",
+    "browsing_or_window_shopping": "browsing_abandonment",
+}
+
+# SSE responses are written by scripts/mcp_local_server.py; the Lambda behind
+# API Gateway always answers with JSON
+SSE_HEADERS = {
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Api-Key, Mcp-Session-Id, MCP-Protocol-Version",
+}
+
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
 
@@ -162,30 +318,235 @@ def _jsonrpc_error(id, code, message, data=None):
     return {"jsonrpc": "2.0", "id": id, "error": err}
 
 
-def _invoke_lambda(function_name, payload):
-    """Synchronously invoke a Lambda function and return its response body."""
+def _headers(event):
+    """HTTP headers with lower-cased names (also the trace context carrier)."""
+    return {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+
+
+def _invoke_lambda(function_name, payload, dependency="lambda.invoke"):
+    """
+    Synchronously invoke a Lambda function and return its response body.
+
+    The current trace context is passed along as ``payload["_meta"]``.
+    """
     try:
-        response = lambda_client.invoke(
-            FunctionName=function_name,
-            InvocationType="RequestResponse",
-            Payload=json.dumps(payload),
-        )
-        response_payload = json.loads(response["Payload"].read().decode("utf-8"))
+        with tracer.span(dependency, kind="client", **{"faas.invoked_name": function_name}) as span, \
+                metrics.time(dependency) as call:
+            payload = {**payload, "_meta": tracer.inject(payload.get("_meta"))}
+            response = lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType="RequestResponse",
+                Payload=json.dumps(payload, separators=COMPACT_SEPARATORS),
+            )
+            if response.get("FunctionError"):
+                call.outcome = "function_error"
+                span.set_error(response["FunctionError"])
+            response_payload = json.loads(response["Payload"].read().decode("utf-8"))
         return response_payload
     except ClientError as exc:
-        logger.error(f"Lambda invoke error ({function_name}): {exc}")
+        logger.error("Lambda invoke error", function_name=function_name, error=str(exc))
         raise
 
 
+def _parse_lambda_response(lambda_response):
+    """
+    Split a tool Lambda response into (status_code, body, text). The body is
+    parsed if the Lambda returned the standard API Gateway shape; ``text`` is
+    the original body string, or None.
+    """
+    if not isinstance(lambda_response, dict):
+        return 200, lambda_response, None
+    status_code = lambda_response.get("statusCode", 200)
+    if "body" not in lambda_response:
+        return status_code, lambda_response, None
+    text = lambda_response["body"]
+    try:
+        body = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        body = text
+    return status_code, body, text if isinstance(text, str) else None
+
+
+# ── Composite Tools ─────────────────────────────────────────────────────────
+
+
+def _call_tool_lambda(tool_name, payload):
+    """Invoke a tool Lambda and return (status_code, parsed body)."""
+    function_name = TOOL_FUNCTION_MAP.get(tool_name)
+    if not function_name:
+        raise RuntimeError(f"Lambda function not configured for tool: {tool_name}")
+    status_code, body, _ = _parse_lambda_response(
+        _invoke_lambda(function_name, payload, f"lambda.{tool_name}")
+    )
+    return status_code, body
+
+
+def _to_float(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def recover_cart(cart):
+    """
+    Run decision_engine then recovery_action for one diagnosed cart. Failures
+    are reported in the returned result (``status`` "failed" plus the failing
+    ``stage``) rather than raised, so one bad cart does not fail a batch.
+    """
+    if not isinstance(cart, dict):
+        return {"cart_id": None, "status": "failed", "stage": "validation", "error": "cart must be an object"}
+    cart_id = cart.get("cart_id")
+    customer_id = cart.get("customer_id")
+    if not cart_id or not customer_id:
+        return {"cart_id": cart_id, "status": "failed", "stage": "validation",
+                "error": "cart_id and customer_id are required"}
+
+    root_cause = cart.get("root_cause") or cart.get("abandonment_reason") or "unknown"
+    if not isinstance(root_cause, str):
+        return {"cart_id": cart_id, "status": "failed", "stage": "validation",
+                "error": "root_cause must be a string"}
+    root_cause = root_cause.strip().lower()
+    segment = cart.get("user_segment") or cart.get("segment")
+    cart_value = _to_float(cart.get("cart_value"))
+    stage = "decision_engine"
+    try:
+        status_code, decision = _call_tool_lambda("decision_engine", {
+            "cart_id": cart_id,
+            "customer_id": customer_id,
+            "user_segment": segment,
+            "abandonment_reason": ROOT_CAUSE_TO_REASON.get(root_cause, root_cause),
+            "cart_value": cart_value,
+            "fraud_risk": cart.get("fraud_risk") or "low",
+            "lifetime_value": _to_float(cart.get("lifetime_value")),
+            "device_type": cart.get("device_type"),
+            "locale": cart.get("locale"),
+        })
+        if status_code >= 400 or not isinstance(decision, dict):
+            return {"cart_id": cart_id, "status": "failed", "stage": stage, "error": decision}
+        action = decision.get("recommended_action") or {}
+
+        stage = "recovery_action"
+        status_code, recovery = _call_tool_lambda("recovery_action", {
+            "cart_id": cart_id,
+            "customer_id": customer_id,
+            "email": cart.get("email", ""),
+            "customer_name": cart.get("customer_name"),
+            "recommended_action": action,
+            "segment": segment,
+            "fraud_risk": cart.get("fraud_risk") or "low",
+            "root_cause": root_cause,
+            "cart_value": cart_value,
+            "currency": cart.get("currency"),
+            "decision_path": cart.get("decision_path"),
+            "run_id": cart.get("run_id"),
+            "fingerprint": cart.get("fingerprint"),
+            "timezone": cart.get("timezone"),
+        })
+        if status_code >= 400 or not isinstance(recovery, dict):
+            return {"cart_id": cart_id, "status": "failed", "stage": stage,
+                    "recommended_action": action, "error": recovery}
+    except Exception as exc:
+        logger.exception("Composite tool error", exc, cart_id=cart_id, stage=stage)
+        return {"cart_id": cart_id, "status": "failed", "stage": stage, "error": str(exc)}
+
+    return {
+        "cart_id": cart_id,
+        "status": "completed",
+        "recommended_action": action,
+        "policy": decision.get("policy"),
+        "rule": decision.get("rule"),
+        "recovery_id": recovery.get("recovery_id"),
+        "action_taken": recovery.get("action_taken"),
+        "send_result": recovery.get("send_result"),
+    }
+
+
+def recover_carts_batch(arguments):
+    """
+    Run ``recover_cart`` for each cart on a thread pool. Yields
+    (completed, total, result) as carts finish and returns the summary with
+    the results in input order.
+
+    Carts are started in input order while ``BATCH_TIME_BUDGET_SECONDS`` has
+    not elapsed; carts already started always finish, since a cart's email
+    may already be sent. The rest are returned in ``remaining``.
+    """
+    carts = arguments.get("carts")
+    if not isinstance(carts, list):
+        raise ValueError("carts must be an array")
+    if len(carts) > BATCH_MAX_CARTS:
+        raise ValueError(f"at most {BATCH_MAX_CARTS} carts per call, got {len(carts)}")
+
+    deadline = time.monotonic() + BATCH_TIME_BUDGET_SECONDS
+    results = [None] * len(carts)
+    started = 0
+    if carts:
+        workers = min(BATCH_CONCURRENCY, len(carts))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            completed = 0
+            while True:
+                while started < len(carts) and len(pending) < workers and time.monotonic() < deadline:
+                    # A context copy per cart keeps the trace span of this call as parent
+                    future = pool.submit(contextvars.copy_context().run, recover_cart, carts[started])
+                    pending[future] = started
+                    started += 1
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    exc = future.exception()
+                    if exc is not None:
+                        # recover_cart reports failures itself; never lose the
+                        # results of carts already sent because of one bug
+                        cart_id = carts[index].get("cart_id") if isinstance(carts[index], dict) else None
+                        logger.exception("Composite tool error", exc, cart_id=cart_id)
+                        result = {"cart_id": cart_id, "status": "failed", "stage": "unknown", "error": str(exc)}
+                    else:
+                        result = future.result()
+                    results[index] = result
+                    completed += 1
+                    yield completed, len(carts), result
+
+    processed = results[:started]
+    succeeded = sum(1 for r in processed if r["status"] == "completed")
+    remaining = [cart.get("cart_id") if isinstance(cart, dict) else None for cart in carts[started:]]
+    if remaining:
+        logger.warning("Batch time budget exhausted", processed=started, remaining=len(remaining))
+    return {
+        "processed": started,
+        "succeeded": succeeded,
+        "failed": started - succeeded,
+        "remaining": remaining,
+        "results": processed,
+    }
+
+
+# Tools implemented in this server on top of the tool Lambdas
+COMPOSITE_TOOLS = {
+    "recover_cart": recover_cart,
+}
+
+# Tool name → generator function(arguments) for tools that report partial
+# results. The generator yields (completed, total, item) after each item and
+# returns the final result body; each item is streamed to SSE clients as a
+# notifications/progress message.
+STREAMING_TOOLS = {
+    "recover_carts_batch": recover_carts_batch,
+}
+
 # ── JSON-RPC Method Handlers ────────────────────────────────────────────────
 
 
-def _handle_initialize(id, _params):
+def _handle_initialize(id, params):
     """Respond to the MCP initialize handshake."""
+    requested = (params or {}).get("protocolVersion")
     return _jsonrpc_response(
         id,
         {
-            "protocolVersion": MCP_PROTOCOL_VERSION,
+            "protocolVersion": requested if requested in SUPPORTED_PROTOCOL_VERSIONS else MCP_PROTOCOL_VERSION,
             "capabilities": {
                 "tools": {"listChanged": False},
             },
@@ -207,17 +568,108 @@ def _handle_tools_list(id, _params):
     return _jsonrpc_response(id, {"tools": TOOLS})
 
 
-def _handle_tools_call(id, params):
+def _progress_notification(token, progress, total=None, message=None):
+    """Build an MCP notifications/progress message."""
+    params = {"progressToken": token, "progress": progress}
+    if total is not None:
+        params["total"] = total
+    if message is not None:
+        params["message"] = message
+    return {"jsonrpc": "2.0", "method": "notifications/progress", "params": params}
+
+
+def _supports_structured_content(protocol_version):
+    return (protocol_version or DEFAULT_HTTP_PROTOCOL_VERSION) >= STRUCTURED_CONTENT_VERSION
+
+
+def _summary_text(body):
+    """
+    One-line text summary of an object result: its scalar fields, the
+    ``type`` of nested objects and the length of lists.
+    """
+    parts = []
+    for key, value in body.items():
+        if isinstance(value, str):
+            if len(value) > SUMMARY_VALUE_MAX:
+                value = value[:SUMMARY_VALUE_MAX] + "..."
+            parts.append(f"{key}={value}")
+        elif isinstance(value, (bool, int, float)):
+            parts.append(f"{key}={value}")
+        elif isinstance(value, dict) and isinstance(value.get("type"), str):
+            parts.append(f"{key}.type={value['type']}")
+        elif isinstance(value, list):
+            parts.append(f"{key}: {len(value)} items")
+    return "; ".join(parts) or "result in structuredContent"
+
+
+def _tool_result(id, body, is_error=False, text=None, structured=False):
+    """
+    Build a tools/call result. Clients that negotiated structured content
+    (``structured``) get object results as ``structuredContent`` with a short
+    summary in the text content block. Older clients get only the text
+    block with the full result: ``text`` (the tool's own JSON string) as-is
+    when given, so the result is not serialized a second time.
+    """
+    if structured and isinstance(body, dict):
+        result = {"content": [{"type": "text", "text": _summary_text(body)}], "isError": is_error,
+                  "structuredContent": body}
+        return _jsonrpc_response(id, result)
+    if text is None:
+        text = body if isinstance(body, str) else json.dumps(body, separators=COMPACT_SEPARATORS)
+    result = {"content": [{"type": "text", "text": text}], "isError": is_error}
+    return _jsonrpc_response(id, result)
+
+
+def _iter_tools_call(id, params, structured=False):
+    """
+    Yield the messages of one tools/call: progress notifications (only when
+    the caller sent ``params._meta.progressToken``) followed by the response.
+    """
+    tool_name = params.get("name")
+    token = (params.get("_meta") or {}).get("progressToken")
+    stream_fn = STREAMING_TOOLS.get(tool_name)
+
+    if stream_fn is None:
+        if token is not None:
+            yield _progress_notification(token, 0, 1, f"Calling {tool_name}")
+        yield _handle_tools_call(id, params, structured)
+        return
+
+    items = stream_fn(params.get("arguments", {}))
+    try:
+        while True:
+            completed, total, item = next(items)
+            if token is not None:
+                yield _progress_notification(
+                    token, completed, total, json.dumps(item, separators=COMPACT_SEPARATORS)
+                )
+    except StopIteration as done:
+        yield _tool_result(id, done.value, structured=structured)
+    except Exception as exc:
+        logger.exception("Tool execution error", exc, tool=tool_name)
+        yield _tool_result(id, {"error": str(exc)}, is_error=True, structured=structured)
+
+
+def _handle_tools_call(id, params, structured=False):
     """Execute an MCP tool by invoking the corresponding Lambda."""
     tool_name = params.get("name")
     arguments = params.get("arguments", {})
 
+    composite_fn = COMPOSITE_TOOLS.get(tool_name)
+    if composite_fn is not None:
+        try:
+            result = composite_fn(arguments)
+            return _tool_result(id, result, is_error=result.get("status") == "failed", structured=structured)
+        except Exception as exc:
+            logger.exception("Tool execution error", exc, tool=tool_name)
+            return _tool_result(id, {"error": str(exc)}, is_error=True, structured=structured)
+
     if tool_name not in TOOL_FUNCTION_MAP:
         return _jsonrpc_error(
             id,
             -32602,
             f"Unknown tool: {tool_name}",
-            {"available_tools": list(TOOL_FUNCTION_MAP.keys())},
+            {"available_tools": [t["name"] for t in TOOLS]},
         )
 
     function_name = TOOL_FUNCTION_MAP[tool_name]
@@ -229,46 +681,14 @@ def _handle_tools_call(id, params):
         )
 
     try:
-        lambda_response = _invoke_lambda(function_name, arguments)
+        lambda_response = _invoke_lambda(function_name, arguments, f"lambda.{tool_name}")
 
-        # Parse the body if the Lambda returned the standard API Gateway shape
-        body = lambda_response
-        if isinstance(lambda_response, dict) and "body" in lambda_response:
-            try:
-                body = json.loads(lambda_response["body"])
-            except (json.JSONDecodeError, TypeError):
-                body = lambda_response["body"]
-
-        status_code = lambda_response.get("statusCode", 200) if isinstance(lambda_response, dict) else 200
-        is_error = status_code >= 400
-
-        return _jsonrpc_response(
-            id,
-            {
-                "content": [
-                    {
-                        "type": "text",
-                        "text": json.dumps(body, indent=2),
-                    }
-                ],
-                "isError": is_error,
-            },
-        )
+        status_code, body, text = _parse_lambda_response(lambda_response)
+        return _tool_result(id, body, is_error=status_code >= 400, text=text, structured=structured)
 
     except Exception as exc:
-        logger.error(f"Tool execution error ({tool_name}): {exc}")
-        return _jsonrpc_response(
-            id,
-            {
-                "content": [
-                    {
-                        "type": "text",
-                        "text": json.dumps({"error": str(exc)}),
-                    }
-                ],
-                "isError": True,
-            },
-        )
+        logger.exception("Tool execution error", exc, tool=tool_name)
+        return _tool_result(id, {"error": str(exc)}, is_error=True, structured=structured)
 
 
 # Method routing table
@@ -282,9 +702,69 @@ METHOD_HANDLERS = {
 # Notification methods (no response expected)
 NOTIFICATION_METHODS = {"notifications/initialized", "notifications/cancelled"}
 
+
+def iter_messages(requests, protocol_version=None):
+    """
+    Process JSON-RPC requests in order, yielding each outgoing message as soon
+    as it is ready: responses, plus notifications/progress for tool calls
+    that carry a progress token. ``protocol_version`` is the request's
+    MCP-Protocol-Version header.
+    """
+    structured = _supports_structured_content(protocol_version)
+    for req in requests:
+        if not isinstance(req, dict):
+            yield _jsonrpc_error(None, -32600, "Invalid Request: expected an object")
+            continue
+
+        jsonrpc = req.get("jsonrpc")
+        method = req.get("method")
+        params = req.get("params", {})
+        req_id = req.get("id")
+
+        # Validate JSON-RPC version
+        if jsonrpc != "2.0":
+            yield _jsonrpc_error(req_id, -32600, "Invalid Request: jsonrpc must be '2.0'")
+            continue
+
+        # Handle notifications (no id → no response)
+        if req_id is None and method in NOTIFICATION_METHODS:
+            logger.info("Received notification", method=method)
+            continue
+
+        # Route to handler
+        handler_fn = METHOD_HANDLERS.get(method)
+        if handler_fn is None:
+            yield _jsonrpc_error(req_id, -32601, f"Method not found: {method}")
+            continue
+
+        logger.info("JSON-RPC request", method=method, id=req_id, tool=params.get("name"))
+        # A caller-supplied params._meta.traceparent takes precedence over the
+        # HTTP header, so each request of a batch can join its own trace
+        with tracer.span(
+            f"jsonrpc {method}",
+            kind="server",
+            parent=tracer.extract(params.get("_meta")),
+            **{"rpc.system": "jsonrpc", "rpc.method": method, "mcp.tool": params.get("name")},
+        ):
+            if method == "tools/call":
+                yield from _iter_tools_call(req_id, params, structured)
+            else:
+                result = handler_fn(req_id, params)
+                if result is not None:
+                    yield result
+
+
+def iter_sse_events(requests, protocol_version=None):
+    """Yield ``iter_messages`` output encoded as SSE ``message`` events."""
+    for n, message in enumerate(iter_messages(requests, protocol_version), 1):
+        yield f"id: {n}\nevent: message\ndata: {json.dumps(message, separators=COMPACT_SEPARATORS)}\n\n"
+
+
 # ── Main Lambda Handler ─────────────────────────────────────────────────────
 
 
+@metrics.instrument
+@tracer.instrument(carrier=_headers)
 def handler(event, context):
     """
     Lambda handler for the MCP server.
@@ -294,6 +774,7 @@ def handler(event, context):
     and DELETE for session termination.
     """
     http_method = event.get("httpMethod") or event.get("requestContext", {}).get("http", {}).get("method", "POST")
+    logger.begin(context, http_method=http_method)
 
     # ── GET: Health check / SSE not supported in stateless mode ──
     if http_method == "GET":
@@ -331,7 +812,7 @@ def handler(event, context):
             "headers": {
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "GET, POST, DELETE, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Api-Key, Mcp-Session-Id",
+                "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Api-Key, Mcp-Session-Id, MCP-Protocol-Version",
                 "Access-Control-Max-Age": "86400",
             },
             "body": "",
@@ -355,36 +836,11 @@ def handler(event, context):
     is_batch = isinstance(body, list)
     requests = body if is_batch else [body]
 
-    responses = []
-    for req in requests:
-        jsonrpc = req.get("jsonrpc")
-        method = req.get("method")
-        params = req.get("params", {})
-        req_id = req.get("id")
-
-        # Validate JSON-RPC version
-        if jsonrpc != "2.0":
-            responses.append(
-                _jsonrpc_error(req_id, -32600, "Invalid Request: jsonrpc must be '2.0'")
-            )
-            continue
-
-        # Handle notifications (no id → no response)
-        if req_id is None and method in NOTIFICATION_METHODS:
-            logger.info(f"Received notification: {method}")
-            continue
-
-        # Route to handler
-        handler_fn = METHOD_HANDLERS.get(method)
-        if handler_fn is None:
-            responses.append(
-                _jsonrpc_error(req_id, -32601, f"Method not found: {method}")
-            )
-            continue
-
-        result = handler_fn(req_id, params)
-        if result is not None:
-            responses.append(result)
+    # API Gateway buffers the whole Lambda response, so SSE could not deliver
+    # progress early; clients that accept text/event-stream get JSON too, as
+    # Streamable HTTP allows, and progress notifications are dropped
+    protocol_version = _headers(event).get("mcp-protocol-version")
+    responses = [m for m in iter_messages(requests, protocol_version) if "method" not in m]
 
     # Build HTTP response
     if not responses:
@@ -402,7 +858,7 @@ def handler(event, context):
         "headers": {
             "Content-Type": "application/json",
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Api-Key, Mcp-Session-Id",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Api-Key, Mcp-Session-Id, MCP-Protocol-Version",
         },
-        "body": json.dumps(response_body),
+        "body": json.dumps(response_body, separators=COMPACT_SEPARATORS),
     }
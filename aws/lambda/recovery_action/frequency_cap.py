@@ -0,0 +1,180 @@
+"""
+Per-customer frequency cap for recovery sends.
+
+At most ``max_sends`` recoveries per customer within ``window`` seconds,
+counted from recovery_history documents that were sent or are still pending
+(deferred, scheduled). Checks are layered so the common case stays in
+process:
+
+1. An LRU of recently checked customers: their count as of the last
+   recovery_history lookup, plus sends this instance made since, is reused
+   for ``cache_ttl`` seconds.
+2. A Bloom filter of every customer with a send in the window, rebuilt from
+   recovery_history every ``refresh_interval`` seconds. A miss proves there
+   is no recent send, so the send is allowed without a query.
+3. Otherwise a count query against recovery_history.
+
+The filter is rebuilt on a background thread, so ``check`` never waits for
+the paged aggregation: until the first build finishes every LRU miss uses
+the count query, and afterwards the previous filter answers until its
+replacement is ready. A failed rebuild keeps the previous filter. Sends made
+by other instances after the last rebuild are not seen until the next one.
+Failed lookups allow the send (fail open).
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on blake2b)."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class FrequencyCap:
+    """
+    ``count_fn(customer_id, since)`` returns the number of recent sends and
+    ``senders_fn(since)`` yields every customer id with a recent send; both
+    take ``since`` as epoch seconds.
+    """
+
+    def __init__(
+        self,
+        count_fn: Callable[[str, float], int],
+        senders_fn: Callable[[float], Iterable[str]],
+        max_sends: int,
+        window: float,
+        lru_size: int = 10000,
+        cache_ttl: float = 60.0,
+        refresh_interval: float = 300.0,
+        bloom_capacity: int = 100000,
+        clock: Callable[[], float] = time.time,
+        background: bool = True,
+    ):
+        self._count_fn = count_fn
+        self._senders_fn = senders_fn
+        self.max_sends = max_sends
+        self.window = window
+        self._lru_size = lru_size
+        self._cache_ttl = cache_ttl
+        self._refresh_interval = refresh_interval
+        self._bloom_capacity = bloom_capacity
+        self._clock = clock
+        self._background = background
+
+        # customer_id -> [count at lookup, looked up at, [own sends since]];
+        # guarded by _lock for callers that share the cap across threads
+        self._recent: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._senders: Optional[BloomFilter] = None
+        self._senders_built_at = float("-inf")
+        # Own sends while a rebuild runs, added to the new filter before the swap
+        self._rebuild_sends: Optional[List[str]] = None
+
+    def refresh(self, now: Optional[float] = None) -> bool:
+        """Rebuild the senders filter now; on failure the previous one is kept."""
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._rebuild_sends = []
+        try:
+            senders = BloomFilter(self._bloom_capacity)
+            for customer_id in self._senders_fn(now - self.window):
+                senders.add(customer_id)
+        except Exception:
+            with self._lock:
+                self._rebuild_sends = None
+            return False
+        with self._lock:
+            for customer_id in self._rebuild_sends:
+                senders.add(customer_id)
+            self._rebuild_sends = None
+            self._senders = senders
+        return True
+
+    def _refresh_senders(self, now: float) -> None:
+        with self._lock:
+            if now - self._senders_built_at < self._refresh_interval:
+                return
+            # Also marks a rebuild in flight; a failed one is retried after the interval
+            self._senders_built_at = now
+        if self._background:
+            threading.Thread(target=self.refresh, args=(now,), name="frequency-cap-refresh", daemon=True).start()
+        else:
+            self.refresh(now)
+
+    def _cached(self, customer_id: str, now: float) -> Optional[int]:
+        with self._lock:
+            entry = self._recent.get(customer_id)
+            if entry is None or now - entry[1] >= self._cache_ttl:
+                return None
+            self._recent.move_to_end(customer_id)
+            return entry[0] + len(entry[2])
+
+    def _remember(self, customer_id: str, count: int, now: float) -> list:
+        with self._lock:
+            entry = self._recent[customer_id] = [count, now, []]
+            self._recent.move_to_end(customer_id)
+            while len(self._recent) > self._lru_size:
+                self._recent.popitem(last=False)
+            return entry
+
+    def check(self, customer_id: str) -> Tuple[bool, int, str]:
+        """
+        Return ``(allowed, recent_sends, source)``; ``source`` names the layer
+        that answered: "lru", "bloom", "count", "fail_open" or "disabled".
+        """
+        if self.max_sends <= 0 or not customer_id:
+            return True, 0, "disabled"
+        now = self._clock()
+        count = self._cached(customer_id, now)
+        if count is not None:
+            return count < self.max_sends, count, "lru"
+
+        self._refresh_senders(now)
+        if self._senders is not None and customer_id not in self._senders:
+            return True, 0, "bloom"
+
+        try:
+            count = int(self._count_fn(customer_id, now - self.window))
+        except Exception:
+            return True, 0, "fail_open"
+        self._remember(customer_id, count, now)
+        return count < self.max_sends, count, "count"
+
+    def record(self, customer_id: str) -> None:
+        """Note a send to ``customer_id`` by this instance."""
+        if self.max_sends <= 0 or not customer_id:
+            return
+        now = self._clock()
+        with self._lock:
+            if self._senders is not None:
+                self._senders.add(customer_id)
+            if self._rebuild_sends is not None:
+                self._rebuild_sends.append(customer_id)
+            entry = self._recent.get(customer_id)
+        if entry is None or now - entry[1] >= self._cache_ttl:
+            # Allowed by a bloom miss: no other recent send is known
+            entry = self._remember(customer_id, 0, now)
+        entry[2].append(now)
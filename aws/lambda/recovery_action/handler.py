@@ -1,21 +1,184 @@
+import base64
+import contextvars
+import html
 import json
 import os
-import logging
+import urllib.request
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 import boto3
 from botocore.exceptions import ClientError
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+import send_scheduler
+from frequency_cap import FrequencyCap
+from metrics import Metrics
+from send_governor import SendGovernor
+from structured_log import get_logger
+from tracing import Tracer
+
+logger = get_logger("recovery_action")
+metrics = Metrics("recovery_action")
+tracer = Tracer("recovery_action")
 
 ses_client = boto3.client("ses")
 events_client = boto3.client("events")
+sqs_client = boto3.client("sqs")
 
 SENDER_EMAIL = os.environ.get("SENDER_EMAIL", "")
 EVENT_BUS_NAME = os.environ.get("EVENT_BUS_NAME", "")
 ENVIRONMENT = os.environ.get("ENVIRONMENT", "dev")
+RETRY_QUEUE_URL = os.environ.get("RETRY_QUEUE_URL", "")
+RETRY_DELAY_SECONDS = int(os.environ.get("RETRY_DELAY_SECONDS", "60"))
+# Overrides ses.get_send_quota (e.g. when the role lacks ses:GetSendQuota)
+SES_MAX_SEND_RATE = os.environ.get("SES_MAX_SEND_RATE", "")
+SEND_MAX_WAIT_SECONDS = float(os.environ.get("SEND_MAX_WAIT_SECONDS", "2"))
+SCHEDULE_QUEUE_URL = os.environ.get("SCHEDULE_QUEUE_URL", "")
+SEND_WINDOW_START_HOUR = int(os.environ.get("SEND_WINDOW_START_HOUR", "9"))
+SEND_WINDOW_END_HOUR = int(os.environ.get("SEND_WINDOW_END_HOUR", "21"))
+SEND_SPREAD_MINUTES = int(os.environ.get("SEND_SPREAD_MINUTES", "30"))
+# Sends of one due minute bucket dispatched concurrently (paced by the governor)
+SCHEDULE_DISPATCH_CONCURRENCY = int(os.environ.get("SCHEDULE_DISPATCH_CONCURRENCY", "10"))
+# Fail at init rather than hold every send for a day on a misconfigured window
+send_scheduler.validate_window(SEND_WINDOW_START_HOUR, SEND_WINDOW_END_HOUR)
+# Read-only access to recovery_history for the frequency cap
+ES_ENDPOINT = os.environ.get("ES_ENDPOINT", "")
+ES_API_KEY = os.environ.get("ES_API_KEY", "")
+ES_USERNAME = os.environ.get("ES_USERNAME", "")
+ES_PASSWORD = os.environ.get("ES_PASSWORD", "")
+
+
+def _send_quota():
+    if SES_MAX_SEND_RATE:
+        return {"MaxSendRate": float(SES_MAX_SEND_RATE)}
+    with metrics.time("ses.get_send_quota"):
+        return ses_client.get_send_quota()
+
+
+# Module scope, so the learned rate carries over between warm invocations
+send_governor = SendGovernor(
+    _send_quota,
+    fraction=float(os.environ.get("SES_RATE_FRACTION", "1.0")),
+    quota_ttl=float(os.environ.get("SEND_QUOTA_TTL_SECONDS", "300")),
+)
+
+
+def _es_request(path, body):
+    """POST a JSON body to Elasticsearch and return the parsed response."""
+    headers = {"Content-Type": "application/json"}
+    if ES_API_KEY:
+        headers["Authorization"] = f"ApiKey {ES_API_KEY}"
+    elif ES_USERNAME and ES_PASSWORD:
+        token = base64.b64encode(f"{ES_USERNAME}:{ES_PASSWORD}".encode("utf-8")).decode("ascii")
+        headers["Authorization"] = f"Basic {token}"
+    request = urllib.request.Request(
+        ES_ENDPOINT.rstrip("/") + path,
+        data=json.dumps(body).encode("utf-8"),
+        headers=headers,
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=2) as response:
+        return json.loads(response.read())
+
+
+def _recent_sends_query(since, customer_id=None):
+    filters = [
+        {"terms": {"status": list(PENDING_OR_SENT)}},
+        {"range": {"@timestamp": {"gte": int(since * 1000), "format": "epoch_millis"}}},
+    ]
+    if customer_id is not None:
+        filters.append({"term": {"customer_id": customer_id}})
+    return {"bool": {"filter": filters}}
+
+
+def _count_recent_sends(customer_id, since):
+    with tracer.span("es.count", kind="client"), metrics.time("es.count"):
+        response = _es_request("/recovery_history/_count", {"query": _recent_sends_query(since, customer_id)})
+    return response["count"]
+
+
+def _recent_senders(since):
+    """Every customer_id with a recent send, paged with a composite aggregation."""
+    after = None
+    while True:
+        composite = {"size": 10000, "sources": [{"customer_id": {"terms": {"field": "customer_id"}}}]}
+        if after:
+            composite["after"] = after
+        with tracer.span("es.search", kind="client"), metrics.time("es.search"):
+            response = _es_request("/recovery_history/_search", {
+                "size": 0,
+                "query": _recent_sends_query(since),
+                "aggs": {"senders": {"composite": composite}},
+            })
+        agg = response["aggregations"]["senders"]
+        for bucket in agg["buckets"]:
+            yield bucket["key"]["customer_id"]
+        after = agg.get("after_key")
+        if not after or not agg["buckets"]:
+            return
+
+
+EMAIL_MAX_ITEMS = int(os.environ.get("EMAIL_MAX_ITEMS", "10"))
+
+
+def _cart_items(cart_id):
+    """
+    The cart's current line items from cart_contents (maintained by event
+    ingest), largest line first. None when unavailable; the email then goes
+    out without an item list.
+    """
+    if not ES_ENDPOINT or not cart_id:
+        return None
+    try:
+        with tracer.span("es.search", kind="client", **{"es.index": "cart_contents"}), \
+                metrics.time("es.cart_contents") as call:
+            response = _es_request("/cart_contents/_search", {
+                "size": 1,
+                "query": {"ids": {"values": [cart_id]}},
+                "_source": ["items"],
+            })
+            hits = response["hits"]["hits"]
+            if not hits:
+                call.outcome = "miss"
+                return None
+    except Exception as e:
+        logger.warning("cart_contents lookup failed", error=str(e))
+        return None
+    items = [{"product_id": product_id, **line} for product_id, line in (hits[0]["_source"].get("items") or {}).items()]
+    items.sort(key=lambda item: -(item.get("quantity") or 0) * (item.get("unit_price") or 0))
+    return items
+
+
+# cart_state statuses for which a held send must not go out
+CLOSED_CART_STATUSES = ("completed", "suppressed")
+
+
+def _cart_status(cart_id):
+    """The cart's current cart_state status; None when it has no document."""
+    with tracer.span("es.search", kind="client", **{"es.index": "cart_state"}), \
+            metrics.time("es.cart_state") as call:
+        response = _es_request("/cart_state/_search", {
+            "size": 1,
+            "query": {"ids": {"values": [f"state_{cart_id}"]}},
+            "_source": ["status"],
+        })
+        hits = response["hits"]["hits"]
+        if not hits:
+            call.outcome = "miss"
+            return None
+    return hits[0]["_source"].get("status")
+
+
+# The LRU and Bloom filter persist across warm invocations
+frequency_cap = FrequencyCap(
+    _count_recent_sends,
+    _recent_senders,
+    max_sends=int(os.environ.get("FREQUENCY_CAP_MAX", "1")) if ES_ENDPOINT else 0,
+    window=float(os.environ.get("FREQUENCY_CAP_WINDOW_HOURS", "24")) * 3600,
+    cache_ttl=float(os.environ.get("FREQUENCY_CAP_CACHE_SECONDS", "60")),
+    refresh_interval=float(os.environ.get("FREQUENCY_CAP_REFRESH_SECONDS", "300")),
+)
 
 
 def _now_iso():
@@ -26,33 +189,62 @@ def _send_email(recipient, subject, body_html, body_text):
     """Send a recovery email via Amazon SES."""
     if not SENDER_EMAIL:
         logger.warning("SENDER_EMAIL not configured – skipping email send")
+        metrics.incr("ses.send_email", "skipped")
         return {"status": "skipped", "reason": "SENDER_EMAIL not set"}
 
     if not recipient:
         logger.warning("No recipient email provided – skipping email send")
+        metrics.incr("ses.send_email", "skipped")
         return {"status": "skipped", "reason": "no recipient"}
 
-    try:
-        response = ses_client.send_email(
-            Source=SENDER_EMAIL,
-            Destination={"ToAddresses": [recipient]},
-            Message={
-                "Subject": {"Data": subject, "Charset": "UTF-8"},
-                "Body": {
-                    "Html": {"Data": body_html, "Charset": "UTF-8"},
-                    "Text": {"Data": body_text, "Charset": "UTF-8"},
+    if not send_governor.acquire(SEND_MAX_WAIT_SECONDS):
+        logger.warning("SES send rate exhausted – deferring send", send_rate=send_governor.rate)
+        metrics.incr("ses.send_email", "deferred")
+        return {"status": "deferred", "channel": "email", "reason": "send rate exceeded"}
+
+    with tracer.span("ses.send_email", kind="client") as span, metrics.time("ses.send_email") as call:
+        try:
+            response = ses_client.send_email(
+                Source=SENDER_EMAIL,
+                Destination={"ToAddresses": [recipient]},
+                Message={
+                    "Subject": {"Data": subject, "Charset": "UTF-8"},
+                    "Body": {
+                        "Html": {"Data": body_html, "Charset": "UTF-8"},
+                        "Text": {"Data": body_text, "Charset": "UTF-8"},
+                    },
                 },
-            },
-        )
-        message_id = response.get("MessageId", "")
-        logger.info(f"SES email sent to {recipient}, MessageId={message_id}")
-        return {"status": "sent", "channel": "email", "message_id": message_id}
-    except ClientError as e:
-        logger.error(f"SES send_email failed: {e}")
-        return {"status": "failed", "channel": "email", "error": str(e)}
-
-
-def _build_email_content(action_type, message, discount, cart_id, customer_name=None):
+            )
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code", "")
+            if code == "Throttling":
+                call.outcome = "throttled"
+                send_governor.on_throttle()
+                logger.warning("SES throttled – deferring send", error=str(e), send_rate=send_governor.rate)
+                return {"status": "deferred", "channel": "email", "reason": "throttled", "error": str(e)}
+            call.outcome = "error"
+            span.set_error(code or "ClientError")
+            logger.error("SES send_email failed", error=str(e), error_code=code)
+            return {"status": "failed", "channel": "email", "error": str(e)}
+
+    send_governor.on_success()
+    message_id = response.get("MessageId", "")
+    logger.info("SES email sent", message_id=message_id)
+    return {"status": "sent", "channel": "email", "message_id": message_id}
+
+
+def _item_lines(items, currency=None):
+    """``(label, price)`` display pairs for at most EMAIL_MAX_ITEMS items, plus the overflow count."""
+    lines = []
+    for item in items[:EMAIL_MAX_ITEMS]:
+        label = f"{item.get('quantity', 1)} × {item.get('product_name') or item['product_id']}"
+        price = item.get("unit_price")
+        total = f"{price * item.get('quantity', 1):.2f} {currency or ''}".strip() if price is not None else ""
+        lines.append((label, total))
+    return lines, max(0, len(items) - EMAIL_MAX_ITEMS)
+
+
+def _build_email_content(action_type, message, discount, cart_id, customer_name=None, items=None, currency=None):
     """Build HTML and plain-text email bodies based on the recovery action."""
     name = customer_name or "Valued Customer"
     subject = "Don't forget your cart!"
@@ -66,13 +258,29 @@ def _build_email_content(action_type, message, discount, cart_id, customer_name=
     elif action_type == "reminder":
         subject = "You left something behind!"
 
-    body_text = f"Hi {name},\n\n{message}\n\nCart ID: {cart_id}\n\nThank you!"
+    items_text = items_html = ""
+    if items:
+        lines, more = _item_lines(items, currency)
+        items_text = "Your cart:\n" + "".join(f"- {label}  {total}\n" for label, total in lines)
+        items_html = "".join(
+            f"<tr><td style='padding: 4px 0;'>{html.escape(label)}</td>"
+            f"<td style='padding: 4px 0; text-align: right;'>{html.escape(total)}</td></tr>"
+            for label, total in lines
+        )
+        if more:
+            items_text += f"- and {more} more\n"
+            items_html += f"<tr><td colspan='2' style='padding: 4px 0; color: #999;'>and {more} more</td></tr>"
+        items_text += "\n"
+        items_html = f"<table style='width: 100%; font-size: 14px; color: #555;'>{items_html}</table>"
+
+    body_text = f"Hi {name},\n\n{message}\n\n{items_text}Cart ID: {cart_id}\n\nThank you!"
 
     body_html = f"""
     <html>
     <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
         <h2 style="color: #333;">Hi {name},</h2>
         <p style="font-size: 16px; color: #555;">{message}</p>
+        {items_html}
         {"<p style='font-size: 18px; color: #e74c3c; font-weight: bold;'>Use discount: " + discount + "</p>" if discount else ""}
         <p style="margin-top: 20px;">
             <a href="#" style="background: #3498db; color: white; padding: 12px 24px;
@@ -88,8 +296,17 @@ def _build_email_content(action_type, message, discount, cart_id, customer_name=
     return subject, body_html, body_text
 
 
-def _publish_recovery_history(cart_id, customer_id, action, send_result, recovery_id):
-    """Publish a recovery_history event to EventBridge for indexing."""
+PENDING_OR_SENT = ("sent", "deferred", "scheduled")
+
+
+def _publish_recovery_history(cart_id, customer_id, action, send_result, recovery_id, attributes=None):
+    """
+    Publish a recovery_history event to EventBridge for indexing.
+
+    ``attributes`` adds optional context fields (segment, fraud_risk, diagnosis,
+    cart_value, currency, decision_path, run_id, fingerprint, deliver_at);
+    None values are left out.
+    """
     if not EVENT_BUS_NAME:
         logger.warning("EVENT_BUS_NAME not configured – skipping recovery history event")
         return
@@ -107,34 +324,104 @@ def _publish_recovery_history(cart_id, customer_id, action, send_result, recover
             "send_status": send_result.get("status", "unknown"),
             "message_id": send_result.get("message_id"),
             "sent_at": _now_iso(),
-            "status": "sent" if send_result.get("status") == "sent" else "failed",
+            "status": send_result.get("status") if send_result.get("status") in PENDING_OR_SENT else "failed",
         },
     }
+    detail["_source"].update({k: v for k, v in (attributes or {}).items() if v is not None})
 
     try:
-        response = events_client.put_events(
-            Entries=[
-                {
-                    "Source": "ai-abandoned-cart",
-                    "DetailType": "recovery_history",
-                    "Detail": json.dumps(detail),
-                    "EventBusName": EVENT_BUS_NAME,
-                }
-            ]
-        )
-        failed = response.get("FailedEntryCount", 0)
+        with tracer.span("events.put_events", kind="producer") as span, \
+                metrics.time("events.put_events") as call:
+            # Lets event_ingest continue the trace across the async hop
+            detail["_meta"] = tracer.inject()
+            response = events_client.put_events(
+                Entries=[
+                    {
+                        "Source": "ai-abandoned-cart",
+                        "DetailType": "recovery_history",
+                        "Detail": json.dumps(detail),
+                        "EventBusName": EVENT_BUS_NAME,
+                    }
+                ]
+            )
+            failed = response.get("FailedEntryCount", 0)
+            if failed > 0:
+                call.outcome = "failed"
+                span.set_error(f"{failed} failed entries")
         if failed > 0:
-            logger.error(f"EventBridge put_events failed: {response}")
+            logger.error("EventBridge put_events failed", failed=failed, entries=response.get("Entries"))
         else:
-            logger.info(f"Recovery history event published for cart {cart_id}")
+            logger.info("Recovery history event published", recovery_id=recovery_id)
+    except ClientError as e:
+        logger.error("EventBridge put_events error", error=str(e))
+
+
+def _enqueue(queue_url, queue, event, recovery_id, delay, **fields):
+    """
+    Send ``event`` to one of the recovery queues, tagged with ``queue`` so the
+    consumer knows how to process it. Returns False if the send failed.
+    """
+    message = {k: v for k, v in event.items() if k not in ("_meta", "_queue")}
+    message.update(fields, recovery_id=recovery_id, _queue=queue)
+    try:
+        with tracer.span("sqs.send_message", kind="producer", **{"sqs.queue": queue}), \
+                metrics.time("sqs.send_message"):
+            message["_meta"] = tracer.inject()
+            sqs_client.send_message(QueueUrl=queue_url, MessageBody=json.dumps(message), DelaySeconds=delay)
     except ClientError as e:
-        logger.error(f"EventBridge put_events error: {e}")
+        logger.error("SQS send_message error", error=str(e), queue=queue)
+        return False
+    return True
+
 
+def _enqueue_retry(event, recovery_id):
+    """
+    Queue a deferred recovery for another send attempt. The retry keeps
+    ``recovery_id``, so its recovery_history document replaces the
+    'deferred' one. Returns False if there is no queue or the send failed.
+    """
+    if not RETRY_QUEUE_URL:
+        logger.warning("RETRY_QUEUE_URL not configured – deferred send is dropped")
+        return False
+    if not _enqueue(RETRY_QUEUE_URL, "retry", event, recovery_id, RETRY_DELAY_SECONDS):
+        return False
+    logger.info("Deferred send queued for retry", recovery_id=recovery_id, delay_seconds=RETRY_DELAY_SECONDS)
+    return True
 
+
+def _schedule_send(event, recovery_id, deliver_at, now):
+    """
+    Queue a recovery until ``deliver_at`` (first hop of at most 15 minutes;
+    ``_process_scheduled`` re-queues until it is due). Returns False if there
+    is no schedule queue or the send failed.
+    """
+    if not SCHEDULE_QUEUE_URL:
+        return False
+    delay = send_scheduler.delay_seconds(deliver_at, now)
+    deliver_at_iso = deliver_at.isoformat().replace("+00:00", "Z")
+    return _enqueue(SCHEDULE_QUEUE_URL, "schedule", event, recovery_id, delay, deliver_at=deliver_at_iso)
+
+
+@metrics.instrument
+@tracer.instrument
 def handler(event, context):
     """
     Lambda handler for recovery action execution.
 
+    Invoked directly (decision engine, MCP tool call) with a single recovery,
+    or by SQS with ``Records`` from the schedule queue (sends held for the
+    recipient's local send window) or the retry queue (sends deferred by the
+    SES send-rate governor); see ``_process_queued``.
+
+    With SCHEDULE_QUEUE_URL set, a recovery for a recipient whose local time
+    (``timezone``) is outside SEND_WINDOW_START_HOUR–SEND_WINDOW_END_HOUR is
+    recorded as 'scheduled' and sent when the window opens. A missing or
+    unknown timezone sends immediately.
+
+    With ES_ENDPOINT set, a customer who already has FREQUENCY_CAP_MAX sent
+    or pending recoveries within FREQUENCY_CAP_WINDOW_HOURS gets none
+    ('capped'); see frequency_cap.py.
+
     Expected event payload (from decision engine or MCP tool call):
     {
         "cart_id": "string",
@@ -145,14 +432,119 @@ def handler(event, context):
             "type": "payment_retry | discount | free_shipping | reminder | reminder_only | blocked",
             "discount": "15% (optional)",
             "message": "string"
-        }
+        },
+        "segment": "string (optional, recorded in recovery_history)",
+        "fraud_risk": "low | medium | high (optional, recorded in recovery_history)",
+        "root_cause": "string (optional, recorded in recovery_history)",
+        "cart_value": 450.00 (optional, recorded in recovery_history),
+        "currency": "string (optional, recorded in recovery_history)",
+        "decision_path": "fast_path | cached | agent (optional, recorded in recovery_history)",
+        "run_id": "string (optional, recorded in recovery_history)",
+        "fingerprint": "string (optional, recorded in recovery_history)",
+        "timezone": "IANA name from the customer profile (optional, e.g. America/Chicago)"
     }
     """
-    try:
-        logger.info(f"Recovery action received: {json.dumps(event)}")
+    if "Records" in event:
+        return _process_queued(event["Records"], context)
+    return _process_recovery(event, context)
+
 
+def _process_queued(records, context):
+    """
+    Process an SQS batch. Due scheduled sends are grouped by minute bucket
+    and each bucket is dispatched as one concurrent batch, oldest bucket
+    first; retries and scheduled sends that need another hop follow one by
+    one. Records that fail, or whose retry is deferred again, are reported as
+    batch item failures, so SQS redelivers them after the visibility timeout
+    and moves them to the dead-letter queue eventually.
+    """
+    failures = []
+    queued = []
+    for record in records:
+        try:
+            event = json.loads(record["body"])
+            queued.append((str(event.get("deliver_at") or ""), event, record["messageId"]))
+        except (KeyError, ValueError, TypeError, AttributeError):
+            logger.begin(context, message_id=record.get("messageId"))
+            logger.error("Malformed queue record")
+            failures.append({"itemIdentifier": record.get("messageId")})
+    queued.sort(key=lambda item: item[0])
+
+    now = datetime.now(timezone.utc)
+    buckets = {}
+    single = []
+    for _, event, message_id in queued:
+        at = send_scheduler.parse(event.get("deliver_at"))
+        if event.get("_queue") == "schedule" and at is not None and send_scheduler.delay_seconds(at, now) == 0:
+            buckets.setdefault(send_scheduler.bucket(at), []).append((event, message_id))
+        else:
+            single.append((event, message_id))
+
+    for label, items in buckets.items():
+        logger.info("Dispatching scheduled send bucket", bucket=label, sends=len(items))
+        with ThreadPoolExecutor(max_workers=min(SCHEDULE_DISPATCH_CONCURRENCY, len(items))) as pool:
+            # A context copy per send keeps log fields and trace spans apart
+            oks = list(pool.map(lambda item: contextvars.copy_context().run(_dispatch_queued, *item, context), items))
+        failures.extend({"itemIdentifier": message_id} for (_, message_id), ok in zip(items, oks) if not ok)
+
+    for event, message_id in single:
+        if not _dispatch_queued(event, message_id, context):
+            failures.append({"itemIdentifier": message_id})
+    return {"batchItemFailures": failures}
+
+
+def _dispatch_queued(event, message_id, context):
+    """Process one queued recovery; False if it should be redelivered."""
+    queue = event.get("_queue", "retry")
+    parent = tracer.extract(event.get("_meta"))
+    with tracer.span(f"recovery_action.{queue}", kind="consumer", parent=parent):
+        if queue == "schedule":
+            return _process_scheduled(event, context)
+        result = _process_recovery(event, context, source="retry")
+        send_status = json.loads(result["body"]).get("send_result", {}).get("status")
+        return result["statusCode"] < 500 and send_status != "deferred"
+
+
+def _process_scheduled(event, context):
+    """
+    Send a scheduled recovery if it is due, else queue its next hop. A due
+    send whose cart has since completed (or been suppressed) is dropped
+    without a recovery_history update.
+    """
+    now = datetime.now(timezone.utc)
+    at = send_scheduler.parse(event.get("deliver_at"))
+    if at is not None and send_scheduler.delay_seconds(at, now) > 0:
+        logger.begin(context, cart_id=event.get("cart_id"), customer_id=event.get("customer_id"))
+        return _schedule_send(event, event.get("recovery_id"), at, now)
+    # The cart may have been bought or opted out while the send was held
+    if ES_ENDPOINT and event.get("cart_id"):
+        logger.begin(context, cart_id=event.get("cart_id"), customer_id=event.get("customer_id"))
+        try:
+            status = _cart_status(event["cart_id"])
+        except Exception as e:
+            logger.warning("cart_state lookup failed – redelivering scheduled send", error=str(e))
+            return False
+        if status in CLOSED_CART_STATUSES:
+            logger.info("Cart closed while held – scheduled send dropped",
+                        recovery_id=event.get("recovery_id"), cart_status=status)
+            metrics.incr("scheduled_send", "dropped")
+            return True
+    result = _process_recovery(event, context, source="schedule")
+    return result["statusCode"] < 500
+
+
+def _process_recovery(event, context, source="direct"):
+    """
+    Send one recovery. ``source`` is "direct" for invocations, or the queue
+    ("schedule", "retry") it was taken from; queued recoveries keep their
+    ``recovery_id`` and are not rescheduled.
+    """
+    try:
         cart_id = event.get("cart_id", "unknown")
         customer_id = event.get("customer_id", "unknown")
+        logger.begin(context, cart_id=cart_id, customer_id=customer_id)
+        logger.debug("Recovery action received", event=event)
+
         email = event.get("email", "")
         customer_name = event.get("customer_name")
         recommended_action = event.get("recommended_action", {})
@@ -160,12 +552,27 @@ def handler(event, context):
         action_type = recommended_action.get("type", "reminder")
         message = recommended_action.get("message", "Complete your purchase")
         discount = recommended_action.get("discount")
-
-        recovery_id = f"rec_{uuid.uuid4().hex[:12]}"
+        history_action = {"type": action_type, "message": message, "discount": discount}
+        if recommended_action.get("experiment"):
+            history_action["experiment"] = recommended_action["experiment"]
+            history_action["variant"] = recommended_action.get("variant")
+
+        recovery_id = (source != "direct" and event.get("recovery_id")) or f"rec_{uuid.uuid4().hex[:12]}"
+        history_attributes = {
+            "segment": event.get("segment"),
+            "fraud_risk": event.get("fraud_risk"),
+            "diagnosis": {"root_cause": event["root_cause"]} if event.get("root_cause") else None,
+            "cart_value": event.get("cart_value"),
+            "currency": event.get("currency"),
+            "decision_path": event.get("decision_path"),
+            "run_id": event.get("run_id"),
+            "fingerprint": event.get("fingerprint"),
+            "deliver_at": event.get("deliver_at"),
+        }
 
         # Blocked actions – do nothing
         if action_type == "blocked":
-            logger.info(f"Cart {cart_id} blocked – no recovery action taken")
+            logger.info("Cart blocked – no recovery action taken")
             result = {
                 "statusCode": 200,
                 "body": json.dumps({
@@ -177,27 +584,101 @@ def handler(event, context):
             }
             _publish_recovery_history(
                 cart_id, customer_id,
-                {"type": action_type, "message": message, "discount": discount},
+                history_action,
                 {"status": "blocked", "channel": "none"},
                 recovery_id,
+                history_attributes,
             )
             return result
 
+        # At most FREQUENCY_CAP_MAX recoveries per customer per window; queued
+        # recoveries were counted when they were first accepted
+        if source == "direct":
+            with metrics.time("frequency_cap") as call:
+                allowed, recent_sends, cap_source = frequency_cap.check(customer_id)
+                call.outcome = cap_source
+            if not allowed:
+                logger.info("Frequency cap reached – no recovery sent", recent_sends=recent_sends)
+                send_result = {"status": "capped", "channel": "none", "recent_sends": recent_sends}
+                _publish_recovery_history(
+                    cart_id, customer_id,
+                    history_action,
+                    send_result,
+                    recovery_id,
+                    history_attributes,
+                )
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps({
+                        "cart_id": cart_id,
+                        "recovery_id": recovery_id,
+                        "action_taken": "capped",
+                        "send_result": send_result,
+                    }),
+                }
+
+        # Hold the send until the recipient's local send window opens
+        if source == "direct" and SCHEDULE_QUEUE_URL and event.get("timezone"):
+            zone = send_scheduler.local_zone(event["timezone"])
+            if zone is None:
+                logger.warning("Unknown timezone – sending immediately", timezone=event["timezone"])
+            else:
+                now = datetime.now(timezone.utc)
+                at = send_scheduler.deliver_at(
+                    now, zone, SEND_WINDOW_START_HOUR, SEND_WINDOW_END_HOUR,
+                    key=cart_id, spread_minutes=SEND_SPREAD_MINUTES,
+                )
+                if at is not None and _schedule_send(event, recovery_id, at, now):
+                    frequency_cap.record(customer_id)
+                    send_result = {
+                        "status": "scheduled",
+                        "channel": "email",
+                        "deliver_at": at.isoformat().replace("+00:00", "Z"),
+                    }
+                    _publish_recovery_history(
+                        cart_id, customer_id,
+                        history_action,
+                        send_result,
+                        recovery_id,
+                        {**history_attributes, "deliver_at": send_result["deliver_at"]},
+                    )
+                    logger.info("Recovery scheduled", recovery_id=recovery_id,
+                                bucket=send_scheduler.bucket(at), timezone=event["timezone"])
+                    return {
+                        "statusCode": 200,
+                        "body": json.dumps({
+                            "cart_id": cart_id,
+                            "recovery_id": recovery_id,
+                            "action_taken": action_type,
+                            "send_result": send_result,
+                        }),
+                    }
+
         # Build email content
         subject, body_html, body_text = _build_email_content(
-            action_type, message, discount, cart_id, customer_name
+            action_type, message, discount, cart_id, customer_name,
+            items=_cart_items(cart_id) if SENDER_EMAIL and email else None, currency=event.get("currency"),
         )
 
         # Send via SES
         send_result = _send_email(email, subject, body_html, body_text)
 
-        # Publish recovery history event to EventBridge
-        _publish_recovery_history(
-            cart_id, customer_id,
-            {"type": action_type, "message": message, "discount": discount},
-            send_result,
-            recovery_id,
-        )
+        if send_result.get("status") == "deferred" and source != "retry":
+            if not _enqueue_retry(event, recovery_id):
+                send_result = {**send_result, "status": "failed"}
+        if source == "direct" and send_result.get("status") in PENDING_OR_SENT:
+            frequency_cap.record(customer_id)
+
+        # Publish recovery history event to EventBridge. A retry that is
+        # deferred again leaves the existing 'deferred' document as it is.
+        if not (source == "retry" and send_result.get("status") == "deferred"):
+            _publish_recovery_history(
+                cart_id, customer_id,
+                history_action,
+                send_result,
+                recovery_id,
+                history_attributes,
+            )
 
         result = {
             "statusCode": 200,
@@ -209,11 +690,16 @@ def handler(event, context):
             }),
         }
 
-        logger.info(f"Recovery action result: {json.dumps(result)}")
+        logger.info(
+            "Recovery action result",
+            recovery_id=recovery_id,
+            action_type=action_type,
+            send_status=send_result.get("status"),
+        )
         return result
 
     except Exception as e:
-        logger.error(f"Recovery action error: {e}")
+        logger.exception("Recovery action error", e)
         return {
             "statusCode": 500,
             "body": json.dumps({
@@ -0,0 +1,105 @@
+"""
+Adaptive send-rate governor for SES.
+
+A token bucket refilled at the current send rate, which starts at the
+account's ``MaxSendRate`` (``ses.get_send_quota``, scaled by ``fraction`` when
+several Lambda instances share the quota) and adapts AIMD-style:
+
+- every successful send adds ``increase_fraction`` × max rate, up to the max
+- every SES ``Throttling`` error halves the rate, down to ``min_rate``
+
+``acquire`` never blocks for longer than ``max_wait``; callers defer the send
+(e.g. to a retry queue) when it returns False instead of letting it fail.
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+
+DEFAULT_MAX_SEND_RATE = 1.0  # SES sandbox rate, used until the quota is known
+
+
+class SendGovernor:
+    """Token bucket with AIMD rate adjustment on throttling."""
+
+    def __init__(
+        self,
+        quota_fn: Callable[[], dict],
+        fraction: float = 1.0,
+        quota_ttl: float = 300.0,
+        increase_fraction: float = 0.05,
+        decrease_factor: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._quota_fn = quota_fn
+        self._fraction = fraction
+        self._quota_ttl = quota_ttl
+        self._increase_fraction = increase_fraction
+        self._decrease_factor = decrease_factor
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        self.max_rate = DEFAULT_MAX_SEND_RATE
+        self.rate = DEFAULT_MAX_SEND_RATE
+        self._tokens = 1.0
+        self._updated = clock()
+        self._quota_loaded_at: Optional[float] = None
+        self._quota_known = False
+
+    @property
+    def min_rate(self) -> float:
+        return min(1.0, self.max_rate)
+
+    def _refresh_quota(self, now: float) -> None:
+        if self._quota_loaded_at is not None and now - self._quota_loaded_at < self._quota_ttl:
+            return
+        # Retry a failed lookup only after the TTL, keeping the last known rate
+        self._quota_loaded_at = now
+        try:
+            quota = self._quota_fn()
+        except Exception:
+            return
+        max_rate = float(quota.get("MaxSendRate") or 0) * self._fraction
+        if max_rate <= 0:
+            return
+        # Start at the ceiling; afterwards only clamp, so backoff survives a refresh
+        self.rate = max_rate if not self._quota_known else min(self.rate, max_rate)
+        self.max_rate = max_rate
+        self._quota_known = True
+
+    def _refill(self, now: float) -> None:
+        capacity = max(1.0, self.rate)
+        self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, max_wait: float = 0.0) -> bool:
+        """
+        Take one send token, waiting up to ``max_wait`` seconds for it.
+        Returns False if the send would exceed the current rate.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refresh_quota(now)
+            self._refill(now)
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            wait = (1.0 - self._tokens) / self.rate
+            if wait > max_wait:
+                return False
+            # Reserve the token now so concurrent callers queue behind it
+            self._tokens -= 1.0
+        self._sleep(wait)
+        return True
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self._increase_fraction)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self._decrease_factor)
+            # Drop the burst so the reduced rate takes effect immediately
+            self._tokens = min(self._tokens, 0.0)
@@ -0,0 +1,100 @@
+"""
+Local-time send scheduling for recovery emails.
+
+Recoveries are delivered only inside the recipient's local send window
+(``start_hour`` to ``end_hour`` in the profile ``timezone``; a window with
+start > end wraps past midnight, e.g. 22–6). Outside it, the send is
+scheduled for the next opening of the window, offset by a stable hash of the
+cart id over the first ``spread_minutes`` so that a whole timezone waking up
+does not reach SES in the same second, and truncated to the minute. Sends due
+in the same minute share a bucket; the recovery action dispatches the due
+sends of each bucket in an SQS batch concurrently.
+
+SQS delays a message by at most 15 minutes, so longer waits are covered by
+re-queueing it in hops of up to ``MAX_DELAY_SECONDS``: a send held for 12
+hours takes 48 hops. Each hop is one SQS send and receive, and hops share
+Lambda invocations through the queue's batching (up to 100 messages per
+invocation), so the cost stays well below one invocation per hop while many
+sends wait. At high volume with long waits, EventBridge Scheduler one-time
+schedules would replace the hops with a single delivery.
+"""
+
+import math
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+MAX_DELAY_SECONDS = 900  # SQS DelaySeconds limit
+
+
+def local_zone(name) -> Optional[ZoneInfo]:
+    """ZoneInfo for an IANA name, or None if missing or unknown."""
+    if not name or not isinstance(name, str):
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def validate_window(start_hour: int, end_hour: int) -> None:
+    """Raise ValueError for hours out of range or an empty window (start == end)."""
+    if not 0 <= start_hour <= 23 or not 0 <= end_hour <= 24:
+        raise ValueError(f"send window hours out of range: {start_hour}-{end_hour}")
+    if start_hour == end_hour:
+        raise ValueError(f"send window {start_hour}-{end_hour} is empty")
+
+
+def in_window(hour: int, start_hour: int, end_hour: int) -> bool:
+    if start_hour < end_hour:
+        return start_hour <= hour < end_hour
+    return hour >= start_hour or hour < end_hour
+
+
+def deliver_at(
+    now: datetime,
+    zone: ZoneInfo,
+    start_hour: int,
+    end_hour: int,
+    key: str = "",
+    spread_minutes: int = 0,
+) -> Optional[datetime]:
+    """
+    UTC minute bucket at which to deliver, or None if ``now`` already falls
+    inside the local send window.
+    """
+    local = now.astimezone(zone)
+    if in_window(local.hour, start_hour, end_hour):
+        return None
+
+    opens = local.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+    if local.hour >= start_hour:
+        # Past today's opening: wall-clock arithmetic gives 09:00 tomorrow,
+        # whatever the DST offset
+        opens += timedelta(days=1)
+    if spread_minutes > 0:
+        opens += timedelta(minutes=zlib.crc32(key.encode("utf-8")) % spread_minutes)
+    return opens.astimezone(timezone.utc).replace(second=0, microsecond=0)
+
+
+def bucket(at: datetime) -> str:
+    """Minute bucket label, e.g. ``2024-01-01T14:00Z``."""
+    return at.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%MZ")
+
+
+def delay_seconds(at: datetime, now: datetime) -> int:
+    """SQS delay for the next hop towards ``at`` (0 when due)."""
+    remaining = math.ceil((at - now).total_seconds())
+    return max(0, min(MAX_DELAY_SECONDS, remaining))
+
+
+def parse(value) -> Optional[datetime]:
+    """Parse an ISO-8601 ``deliver_at`` (``Z`` suffix allowed)."""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
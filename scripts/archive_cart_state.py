@@ -0,0 +1,163 @@
+"""
+Archive terminal cart_state documents into dated archive indices.
+
+cart_state keeps one document per cart forever; carts that reached a
+terminal status (completed, recovery_sent, suppressed) are only history once
+they are old. Each run moves those whose ``@timestamp`` is older than
+``--days`` (default ``CART_STATE_RETENTION_DAYS``, 30) to monthly indices
+``cart_state-archive-<yyyy.MM>`` (by the document's ``@timestamp``):
+
+1. ``_reindex`` the matching documents into the archive indices
+2. ``_delete_by_query`` the same documents from cart_state
+
+Both run as sliced background tasks throttled to ``--requests-per-second``
+and are polled to completion. The cutoff is fixed for the run, so both steps
+see the same documents. A document updated between the two steps (e.g. a new
+add_to_cart reactivated the cart) fails the delete's version check and stays
+in cart_state. Nothing is deleted if the reindex reports failures.
+
+Each run also records the document count and store size of cart_state,
+cart_due_queue and every archive index in index_size_metrics, for
+index size over time. The archive indices take the cart_state mapping from
+the template ``bootstrap_indices.py --archive`` installs.
+
+Usage:
+    python scripts/archive_cart_state.py [--days 30] [--requests-per-second 500] [--dry-run]
+    python scripts/archive_cart_state.py --stats-only
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from elasticsearch import ApiError, Elasticsearch
+
+from bootstrap_indices import ARCHIVE_INDEX_PREFIX, build_es_client
+from watermarks import save_watermark, utc
+
+
+JOB_NAME = "cart_state_archive"
+STATE_INDEX = "cart_state"
+METRICS_INDEX = "index_size_metrics"
+TERMINAL_STATUSES = ["completed", "recovery_sent", "suppressed"]
+RETENTION_DAYS = int(os.getenv("CART_STATE_RETENTION_DAYS", "30"))
+POLL_SECONDS = 5
+
+# cart_state-archive-2024.06 from "2024-06-...": the month of the document
+ARCHIVE_SCRIPT = (
+    "ctx._index = params.prefix + ctx._source['@timestamp'].substring(0, 7).replace('-', '.')"
+)
+
+
+def terminal_query(cutoff: datetime) -> dict:
+    return {
+        "bool": {
+            "filter": [
+                {"terms": {"status": TERMINAL_STATUSES}},
+                {"range": {"@timestamp": {"lt": utc(cutoff)}}},
+            ]
+        }
+    }
+
+
+def wait_for_task(es: Elasticsearch, task_id: str, label: str) -> dict:
+    """Poll a background task until it completes and return its response."""
+    while True:
+        task = es.tasks.get(task_id=task_id)
+        status = task["task"].get("status", {})
+        if task.get("completed"):
+            if task.get("error"):
+                raise RuntimeError(f"{label} failed: {task['error']}")
+            return task.get("response", {})
+        done = status.get("created", 0) + status.get("updated", 0) + status.get("deleted", 0)
+        print(f"{label}: {done}/{status.get('total', '?')}")
+        time.sleep(POLL_SECONDS)
+
+
+def archive(es: Elasticsearch, cutoff: datetime, requests_per_second: float) -> dict:
+    query = terminal_query(cutoff)
+    task = es.reindex(
+        source={"index": STATE_INDEX, "query": query},
+        dest={"index": ARCHIVE_INDEX_PREFIX, "op_type": "index"},
+        script={"lang": "painless", "source": ARCHIVE_SCRIPT, "params": {"prefix": ARCHIVE_INDEX_PREFIX}},
+        slices="auto",
+        requests_per_second=requests_per_second,
+        conflicts="proceed",
+        wait_for_completion=False,
+    )
+    reindexed = wait_for_task(es, task["task"], "reindex")
+    if reindexed.get("failures"):
+        raise RuntimeError(f"reindex reported {len(reindexed['failures'])} failures; nothing deleted: "
+                           f"{reindexed['failures'][:3]}")
+
+    task = es.delete_by_query(
+        index=STATE_INDEX,
+        query=query,
+        slices="auto",
+        requests_per_second=requests_per_second,
+        conflicts="proceed",
+        wait_for_completion=False,
+    )
+    deleted = wait_for_task(es, task["task"], "delete_by_query")
+    return {
+        "archived": reindexed.get("created", 0) + reindexed.get("updated", 0),
+        "deleted": deleted.get("deleted", 0),
+        "version_conflicts": deleted.get("version_conflicts", 0),
+    }
+
+
+def record_index_sizes(es: Elasticsearch) -> List[dict]:
+    """Write one index_size_metrics document per cart_state / queue / archive index."""
+    now = utc(datetime.now(timezone.utc))
+    pattern = f"{STATE_INDEX},cart_due_queue,{ARCHIVE_INDEX_PREFIX}*"
+    try:
+        stats = es.indices.stats(index=pattern, metric=["docs", "store"])["indices"]
+        sizes = [
+            (index, s["primaries"]["docs"]["count"], s["primaries"]["store"]["size_in_bytes"])
+            for index, s in stats.items()
+        ]
+    except ApiError:
+        # _stats is unavailable on Serverless; document counts only
+        indices = es.indices.get(index=pattern, allow_no_indices=True)
+        sizes = [(index, es.count(index=index)["count"], None) for index in indices]
+
+    docs = []
+    for index, count, size in sorted(sizes):
+        doc = {"@timestamp": now, "index": index, "docs_count": count, "store_size_bytes": size, "job": JOB_NAME}
+        es.index(index=METRICS_INDEX, document=doc)
+        docs.append(doc)
+    return docs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS,
+                        help="Archive terminal carts whose last update is older than this")
+    parser.add_argument("--requests-per-second", type=float, default=500.0,
+                        help="Throttle for the reindex and delete tasks (documents per second)")
+    parser.add_argument("--dry-run", action="store_true", help="Count the documents that would be archived")
+    parser.add_argument("--stats-only", action="store_true", help="Only record index sizes")
+    args = parser.parse_args()
+
+    es = build_es_client()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=args.days)
+
+    if not args.stats_only:
+        if args.dry_run:
+            count = es.count(index=STATE_INDEX, query=terminal_query(cutoff))["count"]
+            print(f"{count} terminal cart_state documents older than {utc(cutoff)}")
+            return
+        result = archive(es, cutoff, args.requests_per_second)
+        save_watermark(es, JOB_NAME, cutoff, archived=result["archived"], deleted=result["deleted"])
+        print(f"Archived {result['archived']}, deleted {result['deleted']} "
+              f"({result['version_conflicts']} changed since archiving and kept)")
+
+    for doc in record_index_sizes(es):
+        size = f"{doc['store_size_bytes']} bytes" if doc["store_size_bytes"] is not None else "size n/a"
+        print(f"{doc['index']}: {doc['docs_count']} docs, {size}")
+
+
+if __name__ == "__main__":
+    main()
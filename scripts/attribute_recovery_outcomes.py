@@ -0,0 +1,220 @@
+"""
+Incremental recovery outcome attribution.
+
+Reads successful checkout_events / payment_logs that arrived since the last
+run, joins each one to the open recovery_history entry for the same cart and
+writes ``outcome`` back with bulk partial updates. Open recoveries older than
+the attribution window are closed as ``not_recovered``.
+
+Progress is tracked by a watermark in the pipeline_watermarks index, so a run
+only reads events newer than the previous one instead of rescanning history.
+Updates are idempotent (only recoveries without an outcome are touched), which
+lets each run re-read a short lookback window to absorb ingest lag.
+
+Usage:
+    python scripts/attribute_recovery_outcomes.py [--since 2024-01-01T00:00:00Z] [--dry-run]
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List
+
+from elasticsearch import Elasticsearch, helpers
+
+from bootstrap_indices import build_es_client
+from watermarks import load_watermark, parse_ts, save_watermark, utc
+
+
+JOB_NAME = "recovery_outcome_attribution"
+SOURCE_INDICES = "checkout_events,payment_logs"
+RECOVERY_INDEX = "recovery_history"
+PAGE_SIZE = 500
+
+ATTRIBUTION_WINDOW = timedelta(days=int(os.getenv("ATTRIBUTION_WINDOW_DAYS", "7")))
+LOOKBACK = timedelta(minutes=int(os.getenv("ATTRIBUTION_LOOKBACK_MINUTES", "10")))
+
+# Same success indicators event_ingest uses to mark a cart_state "completed"
+SUCCESS_STATUSES = ["completed", "success", "succeeded", "paid"]
+SUCCESS_STEPS = ["completed", "order_completed", "payment_completed"]
+
+# Sends that never reached the customer cannot be credited with a recovery
+NOT_DELIVERED = ["blocked", "capped", "deferred", "failed", "scheduled", "skipped"]
+
+
+def iter_successful_events(es: Elasticsearch, start: datetime, end: datetime) -> Iterator[List[dict]]:
+    """Yield pages of successful checkout/payment events in (start, end], oldest first."""
+    pit = es.open_point_in_time(index=SOURCE_INDICES, keep_alive="2m")["id"]
+    search_after = None
+    try:
+        while True:
+            kwargs = {}
+            if search_after is not None:
+                kwargs["search_after"] = search_after
+            resp = es.search(
+                pit={"id": pit, "keep_alive": "2m"},
+                size=PAGE_SIZE,
+                query={
+                    "bool": {
+                        "filter": [
+                            {"exists": {"field": "cart_id"}},
+                            {"range": {"@timestamp": {"gt": utc(start), "lte": utc(end)}}},
+                        ],
+                        "should": [
+                            {"terms": {"status": SUCCESS_STATUSES}},
+                            {"terms": {"step": SUCCESS_STEPS}},
+                        ],
+                        "minimum_should_match": 1,
+                    }
+                },
+                sort=[{"@timestamp": "asc"}, {"_shard_doc": "asc"}],
+                _source=["@timestamp", "cart_id", "checkout_id", "payment_id", "total"],
+                track_total_hits=False,
+                **kwargs,
+            )
+            pit = resp.get("pit_id", pit)
+            hits = resp["hits"]["hits"]
+            if not hits:
+                return
+            yield hits
+            search_after = hits[-1]["sort"]
+    finally:
+        es.close_point_in_time(id=pit)
+
+
+def find_open_recoveries(es: Elasticsearch, cart_ids: List[str]) -> Dict[str, dict]:
+    """Return the latest delivered recovery without an outcome, per cart."""
+    resp = es.search(
+        index=RECOVERY_INDEX,
+        size=len(cart_ids),
+        query={
+            "bool": {
+                "filter": [{"terms": {"cart_id": cart_ids}}],
+                "must_not": [
+                    {"exists": {"field": "outcome.status"}},
+                    {"terms": {"send_status": NOT_DELIVERED}},
+                ],
+            }
+        },
+        collapse={"field": "cart_id"},
+        sort=[{"sent_at": {"order": "desc", "unmapped_type": "date"}}],
+        _source=["cart_id", "cart_value", "sent_at"],
+    )
+    return {hit["_source"]["cart_id"]: hit for hit in resp["hits"]["hits"]}
+
+
+def build_outcome_updates(events: List[dict], recoveries: Dict[str, dict]) -> List[dict]:
+    """Pair each cart's first success after the send with its open recovery."""
+    actions = []
+    attributed = set()
+    for event in events:
+        src = event["_source"]
+        cart_id = src["cart_id"]
+        recovery = recoveries.get(cart_id)
+        if recovery is None or cart_id in attributed:
+            continue
+
+        outcome_at = parse_ts(src["@timestamp"])
+        sent_at = recovery["_source"].get("sent_at")
+        if sent_at:
+            sent_at_dt = parse_ts(sent_at)
+            if outcome_at < sent_at_dt or outcome_at - sent_at_dt > ATTRIBUTION_WINDOW:
+                continue
+
+        revenue = src.get("total")
+        if revenue is None:
+            revenue = recovery["_source"].get("cart_value") or 0.0
+
+        actions.append({
+            "_op_type": "update",
+            "_index": RECOVERY_INDEX,
+            "_id": recovery["_id"],
+            "retry_on_conflict": 3,
+            "doc": {
+                "outcome": {
+                    "status": "recovered",
+                    "order_id": src.get("checkout_id") or src.get("payment_id"),
+                    "revenue_recovered": revenue,
+                    "outcome_at": utc(outcome_at),
+                }
+            },
+        })
+        attributed.add(cart_id)
+    return actions
+
+
+def expire_open_recoveries(es: Elasticsearch, now: datetime, dry_run: bool) -> int:
+    """Close recoveries that saw no purchase within the attribution window."""
+    query = {
+        "bool": {
+            "filter": [{"range": {"sent_at": {"lt": utc(now - ATTRIBUTION_WINDOW)}}}],
+            "must_not": [
+                {"exists": {"field": "outcome.status"}},
+                {"terms": {"send_status": NOT_DELIVERED}},
+            ],
+        }
+    }
+    if dry_run:
+        return es.count(index=RECOVERY_INDEX, query=query)["count"]
+
+    resp = es.update_by_query(
+        index=RECOVERY_INDEX,
+        query=query,
+        script={
+            "lang": "painless",
+            "source": (
+                "ctx._source.outcome = ['status': 'not_recovered', 'order_id': null, "
+                "'revenue_recovered': 0.0, 'outcome_at': params.now]"
+            ),
+            "params": {"now": utc(now)},
+        },
+        conflicts="proceed",
+        refresh=True,
+    )
+    return resp.get("updated", 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--since", help="Override the stored watermark (ISO-8601)")
+    parser.add_argument("--dry-run", action="store_true", help="Report matches without writing")
+    args = parser.parse_args()
+
+    es = build_es_client()
+    now = datetime.now(timezone.utc)
+
+    if args.since:
+        watermark = parse_ts(args.since)
+    else:
+        watermark = load_watermark(es, JOB_NAME) or (now - ATTRIBUTION_WINDOW)
+    start = watermark - LOOKBACK
+    print(f"Attributing outcomes for events in ({utc(start)}, {utc(now)}]")
+
+    processed = 0
+    updated = 0
+    for page in iter_successful_events(es, start, now):
+        processed += len(page)
+        cart_ids = sorted({hit["_source"]["cart_id"] for hit in page})
+        actions = build_outcome_updates(page, find_open_recoveries(es, cart_ids))
+        if not actions:
+            continue
+        if args.dry_run:
+            updated += len(actions)
+            continue
+        ok, errors = helpers.bulk(es, actions, raise_on_error=False, refresh="wait_for")
+        updated += ok
+        for err in errors:
+            print(f"  Update failed: {err}")
+
+    expired = expire_open_recoveries(es, now, args.dry_run)
+
+    if not args.dry_run:
+        save_watermark(es, JOB_NAME, now, processed=processed, updated=updated, expired=expired)
+
+    print(f"Events scanned: {processed}")
+    print(f"Recoveries attributed: {updated}")
+    print(f"Recoveries expired as not_recovered: {expired}")
+
+
+if __name__ == "__main__":
+    main()
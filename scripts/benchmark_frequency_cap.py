@@ -0,0 +1,85 @@
+"""
+Benchmark frequency-cap evaluation latency per layer.
+
+Builds a FrequencyCap over a synthetic population of recent senders (no
+Elasticsearch; the count query is a local function that sleeps
+``--count-ms`` to stand in for the round trip) and times ``check`` for:
+
+- bloom: customers with no recent send, answered by the Bloom filter
+- lru:   customers checked moments ago, answered by the LRU
+- count: recent senders not in the LRU, which need the count query
+
+Reports p50/p99 microseconds per layer and the share of checks each layer
+answers for a given ``--repeat-rate`` (customers checked again within the
+cache TTL) and ``--sender-rate`` (customers with a recent send).
+
+Usage:
+    python scripts/benchmark_frequency_cap.py [--senders 100000] [--checks 20000]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT / "aws" / "lambda" / "recovery_action"))
+
+from frequency_cap import FrequencyCap  # noqa: E402
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--senders", type=int, default=100000, help="Customers with a recent send")
+    parser.add_argument("--checks", type=int, default=20000, help="Cap checks to time")
+    parser.add_argument("--sender-rate", type=float, default=0.1, help="Share of checks for recent senders")
+    parser.add_argument("--repeat-rate", type=float, default=0.2, help="Share of checks repeating a customer")
+    parser.add_argument("--count-ms", type=float, default=5.0, help="Simulated count query latency")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    senders = [f"cust_{i:07d}" for i in range(args.senders)]
+
+    def count(customer_id, since):
+        time.sleep(args.count_ms / 1000)
+        return 1
+
+    cap = FrequencyCap(count, lambda since: senders, max_sends=2, window=86400,
+                       bloom_capacity=max(args.senders, 1), background=False)
+    start = time.perf_counter()
+    cap.check("warmup")
+    print(f"bloom build: {(time.perf_counter() - start) * 1000:.1f} ms for {args.senders} senders")
+
+    samples = {"bloom": [], "lru": [], "count": []}
+    checked = []
+    for i in range(args.checks):
+        if checked and rng.random() < args.repeat_rate:
+            customer_id = rng.choice(checked)
+        elif rng.random() < args.sender_rate:
+            customer_id = rng.choice(senders)
+        else:
+            customer_id = f"new_{i:07d}"
+        start = time.perf_counter()
+        _, _, source = cap.check(customer_id)
+        samples.setdefault(source, []).append((time.perf_counter() - start) * 1e6)
+        checked.append(customer_id)
+
+    total = sum(len(s) for s in samples.values())
+    all_samples = [v for s in samples.values() for v in s]
+    print(f"{'layer':>7} {'share':>7} {'p50_us':>10} {'p99_us':>10}")
+    for layer, values in samples.items():
+        if values:
+            print(f"{layer:>7} {len(values) / total:>7.1%} "
+                  f"{percentile(values, 0.5):>10.1f} {percentile(values, 0.99):>10.1f}")
+    print(f"{'all':>7} {1:>7.0%} {percentile(all_samples, 0.5):>10.1f} {percentile(all_samples, 0.99):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
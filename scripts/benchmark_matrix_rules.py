@@ -0,0 +1,144 @@
+"""
+Microbenchmark decision-matrix rule evaluation as the rule count grows.
+
+Generates synthetic ``rules`` (random segment, reason, device, locale, fraud
+risk and numeric bounds), compiles them with matrix_rules.RuleSet and times
+``match`` for random carts against a naive interpreter that checks every
+rule in priority order. Two workloads: random carts (many hit a rule early)
+and carts no rule matches (the interpreter's worst case, and the common one
+with a handful of targeted rules). Reports compile time and p50/p99
+microseconds per evaluation.
+
+Usage:
+    python scripts/benchmark_matrix_rules.py [--sizes 10 1000 10000] [--evaluations 5000]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT / "aws" / "lambda" / "decision_engine"))
+
+from matrix_rules import NUMERIC_OPERATORS, RuleSet  # noqa: E402
+
+SEGMENTS = ["vip", "standard", "default", "high_fraud_risk"]
+REASONS = ["payment_failure", "shipping_issue", "browsing_abandonment"]
+DEVICES = ["mobile", "desktop", "tablet"]
+LOCALES = ["en-us", "en-gb", "de-de", "fr-fr", "es-es", "ja-jp", "pt-br", "it-it"]
+FRAUD_RISKS = ["low", "medium", "high"]
+
+
+def synthetic_rules(count: int, rng: random.Random):
+    rules = []
+    for i in range(count):
+        when = {}
+        if rng.random() < 0.6:
+            when["device_type"] = rng.sample(DEVICES, rng.randint(1, 2))
+        if rng.random() < 0.5:
+            when["locale"] = rng.choice(LOCALES + ["en", "de"])
+        if rng.random() < 0.3:
+            when["fraud_risk"] = rng.choice(FRAUD_RISKS)
+        if rng.random() < 0.7:
+            low = rng.choice([0, 50, 100, 300])
+            when["cart_value"] = {"gte": low, "lt": low + rng.choice([50, 200, 1000])}
+        if rng.random() < 0.5:
+            when["lifetime_value"] = {"gte": rng.choice([100, 500, 2000, 10000])}
+        rule = {"name": f"rule_{i}", "when": when, "priority": rng.randint(0, 5),
+                "action": {"type": "discount", "discount": "10%", "message": "m"}}
+        if rng.random() < 0.9:
+            rule["segment"] = rng.choice(SEGMENTS)
+        if rng.random() < 0.9:
+            rule["reason"] = rng.choice(REASONS)
+        rules.append(rule)
+    return rules
+
+
+def naive_match(ordered_rules, facts):
+    """Reference: interpret rules in priority order until one matches."""
+    for rule in ordered_rules:
+        if "segment" in rule and rule["segment"] != facts["segment"]:
+            continue
+        if "reason" in rule and rule["reason"] != facts["reason"]:
+            continue
+        ok = True
+        for field, condition in rule["when"].items():
+            value = facts.get(field)
+            if isinstance(condition, dict):
+                ok = value is not None and all(NUMERIC_OPERATORS[op](value, b) for op, b in condition.items())
+            elif field == "locale":
+                ok = value is not None and condition in (value, value.split("-")[0])
+            else:
+                ok = value in (condition if isinstance(condition, list) else [condition])
+            if not ok:
+                break
+        if ok:
+            return rule["name"], rule["action"]
+    return None
+
+
+def random_facts(rng: random.Random):
+    return {
+        "segment": rng.choice(SEGMENTS),
+        "reason": rng.choice(REASONS),
+        "device_type": rng.choice(DEVICES),
+        "locale": rng.choice(LOCALES),
+        "fraud_risk": rng.choice(FRAUD_RISKS),
+        "cart_value": rng.uniform(5, 1500),
+        "lifetime_value": rng.uniform(0, 20000),
+    }
+
+
+def unmatched_facts(rng: random.Random):
+    """A cart only fully unconditional rules (if any were generated) match."""
+    return {"segment": "new_customer", "reason": "unknown", "device_type": "tv", "locale": "ko-kr",
+            "fraud_risk": "none", "cart_value": None, "lifetime_value": None}
+
+
+def time_us(fn, inputs):
+    samples = []
+    for facts in inputs:
+        start = time.perf_counter()
+        fn(facts)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Rule counts")
+    parser.add_argument("--evaluations", type=int, default=5000, help="Carts evaluated per size")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'rules':>6} {'workload':>9} {'compile_ms':>10} {'p50_us':>8} {'p99_us':>8} "
+          f"{'naive_p50':>10} {'naive_p99':>10}")
+    for size in args.sizes:
+        rules = synthetic_rules(size, rng)
+        start = time.perf_counter()
+        compiled = RuleSet(rules)
+        compile_ms = (time.perf_counter() - start) * 1000
+        ordered = sorted(rules, key=lambda r: -r.get("priority", 0))
+
+        for workload, make_facts in (("random", random_facts), ("no_match", unmatched_facts)):
+            inputs = [make_facts(rng) for _ in range(args.evaluations)]
+            mismatches = sum(
+                1 for facts in inputs[:200]
+                if (compiled.match(facts) or (None,))[0] != (naive_match(ordered, facts) or (None,))[0]
+            )
+            if mismatches:
+                print(f"warning: {mismatches} of 200 results differ from the naive interpreter")
+
+            p50, p99 = time_us(compiled.match, inputs)
+            naive_inputs = inputs[: max(50, args.evaluations // max(1, size // 100))]
+            naive_p50, naive_p99 = time_us(lambda facts: naive_match(ordered, facts), naive_inputs)
+            print(f"{size:>6} {workload:>9} {compile_ms:>10.1f} {p50:>8.1f} {p99:>8.1f} "
+                  f"{naive_p50:>10.1f} {naive_p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark JSON encoding cost of MCP tools/call responses.
+
+Replays the path a tool result takes from the Lambda invoke payload to the
+HTTP response body of the MCP server, for synthetic batch results of
+increasing size, and compares:
+
+- legacy:     body parsed, re-dumped with indent=2 into a text block, and the
+              whole response dumped again with default separators
+- compat:     a 2025-03-26 client: the tool's own JSON string reused as the
+              only (text) block, compact response
+- structured: a 2025-06-18 client: ``structuredContent`` plus a one-line
+              summary as the text block, compact response
+
+Reports response bytes and CPU time per call (``time.process_time``).
+
+Usage:
+    python scripts/benchmark_mcp_encoding.py [--sizes 1 100 1000] [--iterations 200]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+LAMBDA_ROOT = PROJECT_ROOT / "aws" / "lambda"
+
+os.environ.setdefault("METRICS_SINK", "none")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path[:0] = [str(LAMBDA_ROOT / "common" / "python"), str(LAMBDA_ROOT / "mcp_server")]
+
+import handler as mcp  # noqa: E402
+
+
+def sample_result(carts: int) -> dict:
+    """A batch-shaped tool result with ``carts`` per-cart entries."""
+    return {
+        "processed": carts,
+        "results": [
+            {
+                "cart_id": f"cart_{i:06d}",
+                "customer_id": f"cust_{i % 977:05d}",
+                "recommended_action": {
+                    "type": "discount",
+                    "discount": "10%",
+                    "message": "Complete your order today and save 10% on everything in your cart.",
+                },
+                "send_status": "sent",
+                "message_id": f"0100018c-{i:08x}-example",
+                "cart_value": round(40 + i * 1.37, 2),
+            }
+            for i in range(carts)
+        ],
+    }
+
+
+def invoke_payload(result: dict) -> bytes:
+    """What ``lambda_client.invoke`` returns for a tool Lambda."""
+    return json.dumps({"statusCode": 200, "body": json.dumps(result)}).encode("utf-8")
+
+
+def legacy_response(payload: bytes) -> str:
+    lambda_response = json.loads(payload.decode("utf-8"))
+    body = json.loads(lambda_response["body"])
+    response = mcp._jsonrpc_response(1, {
+        "content": [{"type": "text", "text": json.dumps(body, indent=2)}],
+        "isError": False,
+    })
+    return json.dumps(response)
+
+
+def compat_response(payload: bytes) -> str:
+    lambda_response = json.loads(payload.decode("utf-8"))
+    text = lambda_response["body"]
+    response = mcp._tool_result(1, json.loads(text), text=text)
+    return json.dumps(response, separators=mcp.COMPACT_SEPARATORS)
+
+
+def structured_response(payload: bytes) -> str:
+    lambda_response = json.loads(payload.decode("utf-8"))
+    text = lambda_response["body"]
+    response = mcp._tool_result(1, json.loads(text), text=text, structured=True)
+    return json.dumps(response, separators=mcp.COMPACT_SEPARATORS)
+
+
+def measure(fn, payload: bytes, iterations: int):
+    body = fn(payload)
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(payload)
+    cpu_us = (time.process_time() - start) / iterations * 1e6
+    return len(body.encode("utf-8")), cpu_us
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 1000], help="Carts per result")
+    parser.add_argument("--iterations", type=int, default=200, help="Calls per measurement")
+    args = parser.parse_args()
+
+    print(f"{'carts':>6} {'path':>11} {'bytes':>10} {'cpu_us':>10}")
+    for size in args.sizes:
+        payload = invoke_payload(sample_result(size))
+        baseline = None
+        for name, fn in (("legacy", legacy_response), ("compat", compat_response),
+                         ("structured", structured_response)):
+            size_bytes, cpu_us = measure(fn, payload, max(1, args.iterations // max(1, size // 100)))
+            note = ""
+            if baseline is None:
+                baseline = (size_bytes, cpu_us)
+            else:
+                note = f"  ({size_bytes / baseline[0]:.0%} bytes, {cpu_us / baseline[1]:.0%} cpu)"
+            print(f"{size:>6} {name:>11} {size_bytes:>10} {cpu_us:>10.1f}{note}")
+
+
+if __name__ == "__main__":
+    main()
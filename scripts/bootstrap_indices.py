@@ -1,9 +1,24 @@
+"""
+Create the Elasticsearch indices from elastic/mappings.
+
+By default every index is deleted and recreated with its latest mapping.
+``--keep-existing`` only creates the missing ones, which is how a live
+deployment picks up new indices, and ``--index`` limits the run to the given
+indices. ``--archive`` also installs the index template of the dated
+cart_state archive indices written by scripts/archive_cart_state.py.
+
+Usage:
+    python scripts/bootstrap_indices.py
+    python scripts/bootstrap_indices.py --keep-existing --archive
+"""
+
+import argparse
 import json
 import os
 from pathlib import Path
 
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
+from elasticsearch import BadRequestError, Elasticsearch
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -12,13 +27,25 @@ MAPPINGS_DIR = PROJECT_ROOT / "elastic" / "mappings"
 INDEX_FILES = {
     "cart_events": "cart_events.json",
     "cart_state": "cart_state.json",
+    "cart_due_queue": "cart_due_queue.json",
+    "cart_contents": "cart_contents.json",
     "checkout_events": "checkout_events.json",
     "payment_logs": "payment_logs.json",
     "session_metrics": "session_metrics.json",
+    "session_sketches": "session_sketches.json",
     "recovery_history": "recovery_history.json",
     "customer_profiles": "customer_profiles.json",
+    "pipeline_watermarks": "pipeline_watermarks.json",
+    "recommendation_cache": "recommendation_cache.json",
+    "suppression_list": "suppression_list.json",
+    "index_size_metrics": "index_size_metrics.json",
 }
 
+# Terminal cart_state documents are moved to monthly indices named
+# <prefix><yyyy.MM>, which take the cart_state mapping from this template
+ARCHIVE_INDEX_PREFIX = "cart_state-archive-"
+ARCHIVE_TEMPLATE = "cart_state_archive"
+
 
 def build_es_client() -> Elasticsearch:
     load_dotenv(PROJECT_ROOT / ".env")
@@ -48,26 +75,66 @@ def build_es_client() -> Elasticsearch:
     return Elasticsearch(es_url)
 
 
-def main() -> None:
-    es = build_es_client()
+def load_mapping(index_name: str) -> dict:
+    with (MAPPINGS_DIR / INDEX_FILES[index_name]).open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def create_index(es: Elasticsearch, index_name: str, keep_existing: bool) -> None:
+    body = load_mapping(index_name)
+
+    # Shard and replica counts are unsupported in Serverless; other
+    # settings (cart_due_queue's index sort) are kept
+    settings = {
+        k: v for k, v in body.pop("settings", {}).items()
+        if k not in ("number_of_shards", "number_of_replicas")
+    }
+
+    exists = es.indices.exists(index=index_name)
+    if exists:
+        if keep_existing:
+            print(f"Keeping existing index: {index_name}")
+            return
+        # Delete and recreate to get latest mapping
+        print(f"Deleting existing index: {index_name}")
+        es.indices.delete(index=index_name)
+
+    try:
+        es.indices.create(index=index_name, settings=settings or None, **body)
+    except BadRequestError as e:
+        if not settings:
+            raise
+        print(f"Settings {sorted(settings)} rejected for {index_name} ({e}); creating without them")
+        es.indices.create(index=index_name, **body)
+    print(f"Created index: {index_name}")
 
-    for index_name, filename in INDEX_FILES.items():
-        mapping_path = MAPPINGS_DIR / filename
-        with mapping_path.open("r", encoding="utf-8") as f:
-            body = json.load(f)
 
-        # Remove settings unsupported in Serverless
-        if "settings" in body:
-            del body["settings"]
+def install_archive_template(es: Elasticsearch) -> None:
+    """Index template giving every cart_state archive index the cart_state mapping."""
+    es.indices.put_index_template(
+        name=ARCHIVE_TEMPLATE,
+        index_patterns=[f"{ARCHIVE_INDEX_PREFIX}*"],
+        template={"mappings": load_mapping("cart_state")["mappings"]},
+    )
+    print(f"Installed index template: {ARCHIVE_TEMPLATE} ({ARCHIVE_INDEX_PREFIX}*)")
 
-        exists = es.indices.exists(index=index_name)
-        if exists:
-            # Delete and recreate to get latest mapping
-            print(f"Deleting existing index: {index_name}")
-            es.indices.delete(index=index_name)
 
-        es.indices.create(index=index_name, **body)
-        print(f"Created index: {index_name}")
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--index", action="append", choices=list(INDEX_FILES),
+                        help="Index to create (repeatable; default all)")
+    parser.add_argument("--keep-existing", action="store_true",
+                        help="Only create missing indices instead of recreating every one")
+    parser.add_argument("--archive", action="store_true",
+                        help="Also install the cart_state archive index template")
+    args = parser.parse_args()
+
+    es = build_es_client()
+
+    for index_name in args.index or INDEX_FILES:
+        create_index(es, index_name, args.keep_existing)
+    if args.archive:
+        install_archive_template(es)
 
     print("Bootstrap complete.")
 
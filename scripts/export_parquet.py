@@ -0,0 +1,221 @@
+"""
+Incremental Parquet export of the event indices.
+
+Streams each index with a point in time and ``search_after`` (oldest first)
+and writes the hits as Arrow record batches to Parquet, so memory stays at
+one batch however large the index is. Columns are typed from the index
+mapping in elastic/mappings: keyword/text → string, date → timestamp[ms, UTC],
+numeric and boolean types → their Arrow equivalents, object properties →
+struct. Fields outside the mapping (dynamic fields) are not exported; a list
+in a string column is written as JSON, in any other column as its first
+element.
+
+Each run exports documents whose ``@timestamp`` is newer than the index's
+watermark in pipeline_watermarks (job ``parquet_export:<index>``) and at most
+``EXPORT_LAG_SECONDS`` old, to one new file per index:
+
+    <output>/<index>/<index>-<end watermark>.parquet
+
+The watermark only advances once the file is complete, so a failed run is
+retried from the same point. Documents updated after they were exported
+(e.g. a recovery_history outcome) are not exported again; use ``--full`` for
+a snapshot of the whole index.
+
+Usage:
+    python scripts/export_parquet.py [--output exports] [--index recovery_history] [--since 2024-01-01T00:00:00Z]
+    python scripts/export_parquet.py --full --index recovery_history
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from elasticsearch import Elasticsearch
+
+from bootstrap_indices import INDEX_FILES, MAPPINGS_DIR, PROJECT_ROOT, build_es_client
+from watermarks import load_watermark, parse_ts, save_watermark, utc
+
+
+EXPORT_INDICES = ["cart_events", "checkout_events", "payment_logs", "recovery_history"]
+JOB_PREFIX = "parquet_export"
+TIMESTAMP_FIELD = "@timestamp"
+PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "2000"))
+BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "50000"))
+# Documents younger than this may still be in flight through ingest
+EXPORT_LAG = timedelta(seconds=int(os.getenv("EXPORT_LAG_SECONDS", "300")))
+
+ARROW_TYPES = {
+    "keyword": pa.string(),
+    "text": pa.string(),
+    "match_only_text": pa.string(),
+    "wildcard": pa.string(),
+    "ip": pa.string(),
+    "date": pa.timestamp("ms", tz="UTC"),
+    "boolean": pa.bool_(),
+    "byte": pa.int8(),
+    "short": pa.int16(),
+    "integer": pa.int32(),
+    "long": pa.int64(),
+    "float": pa.float32(),
+    "half_float": pa.float32(),
+    "scaled_float": pa.float64(),
+    "double": pa.float64(),
+}
+
+
+def arrow_type(field: dict) -> pa.DataType:
+    """Arrow type for one mapping property; unknown types fall back to string."""
+    if "properties" in field:
+        return pa.struct([pa.field(name, arrow_type(sub)) for name, sub in field["properties"].items()])
+    return ARROW_TYPES.get(field.get("type"), pa.string())
+
+
+def schema_for(index: str) -> pa.Schema:
+    with (MAPPINGS_DIR / INDEX_FILES[index]).open("r", encoding="utf-8") as f:
+        properties = json.load(f)["mappings"]["properties"]
+    return pa.schema([pa.field(name, arrow_type(field)) for name, field in properties.items()])
+
+
+def _coerce(value, dtype: pa.DataType):
+    """Convert one _source value to what pyarrow expects for ``dtype``."""
+    if value is None:
+        return None
+    if pa.types.is_struct(dtype):
+        if not isinstance(value, dict):
+            return None
+        return {f.name: _coerce(value.get(f.name), f.type) for f in dtype}
+    if isinstance(value, list):
+        if pa.types.is_string(dtype):
+            return json.dumps(value, separators=(",", ":"))
+        value = value[0] if value else None
+        if value is None:
+            return None
+    try:
+        if pa.types.is_timestamp(dtype):
+            if isinstance(value, (int, float)):
+                return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+            return parse_ts(str(value))
+        if pa.types.is_string(dtype):
+            return value if isinstance(value, str) else json.dumps(value, separators=(",", ":"))
+        if pa.types.is_boolean(dtype):
+            return value if isinstance(value, bool) else str(value).lower() == "true"
+        if pa.types.is_integer(dtype):
+            return int(value)
+        if pa.types.is_floating(dtype):
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+def to_record_batch(hits: List[dict], schema: pa.Schema) -> pa.RecordBatch:
+    rows = [{f.name: _coerce(hit["_source"].get(f.name), f.type) for f in schema} for hit in hits]
+    return pa.RecordBatch.from_pylist(rows, schema=schema)
+
+
+def iter_pages(es: Elasticsearch, index: str, start: Optional[datetime], end: datetime) -> Iterator[List[dict]]:
+    """Yield pages of hits with ``start < @timestamp <= end``, oldest first."""
+    time_range = {"lte": utc(end)}
+    if start is not None:
+        time_range["gt"] = utc(start)
+    pit = es.open_point_in_time(index=index, keep_alive="2m")["id"]
+    search_after = None
+    try:
+        while True:
+            kwargs = {}
+            if search_after is not None:
+                kwargs["search_after"] = search_after
+            resp = es.search(
+                pit={"id": pit, "keep_alive": "2m"},
+                size=PAGE_SIZE,
+                query={"bool": {"filter": [{"range": {TIMESTAMP_FIELD: time_range}}]}},
+                sort=[{TIMESTAMP_FIELD: "asc"}, {"_shard_doc": "asc"}],
+                track_total_hits=False,
+                **kwargs,
+            )
+            pit = resp.get("pit_id", pit)
+            hits = resp["hits"]["hits"]
+            if not hits:
+                return
+            yield hits
+            search_after = hits[-1]["sort"]
+    finally:
+        es.close_point_in_time(id=pit)
+
+
+def export_index(es: Elasticsearch, index: str, output: Path, start: Optional[datetime], end: datetime) -> int:
+    """Write one Parquet file for ``index`` over (start, end]; returns rows written."""
+    schema = schema_for(index)
+    directory = output / index
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{index}-{end.strftime('%Y%m%dT%H%M%SZ')}.parquet"
+    tmp = path.with_suffix(".parquet.tmp")
+
+    rows = 0
+    pending: List[dict] = []
+    writer = None
+    try:
+        for page in iter_pages(es, index, start, end):
+            pending.extend(page)
+            if len(pending) < BATCH_ROWS:
+                continue
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, schema, compression="zstd")
+            writer.write_batch(to_record_batch(pending, schema))
+            rows += len(pending)
+            pending = []
+        if pending:
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, schema, compression="zstd")
+            writer.write_batch(to_record_batch(pending, schema))
+            rows += len(pending)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        tmp.unlink(missing_ok=True)
+        raise
+    if writer is not None:
+        writer.close()
+    if rows:
+        tmp.replace(path)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", type=Path, default=PROJECT_ROOT / "exports", help="Output directory")
+    parser.add_argument("--index", action="append", choices=EXPORT_INDICES,
+                        help="Index to export (repeatable; default all)")
+    parser.add_argument("--since", help="Override the stored watermarks (ISO-8601)")
+    parser.add_argument("--full", action="store_true", help="Export everything, ignoring watermarks")
+    args = parser.parse_args()
+
+    es = build_es_client()
+    end = datetime.now(timezone.utc) - EXPORT_LAG
+
+    for index in args.index or EXPORT_INDICES:
+        job = f"{JOB_PREFIX}:{index}"
+        if args.full:
+            start = None
+        elif args.since:
+            start = parse_ts(args.since)
+        else:
+            start = load_watermark(es, job)
+        if start is not None and start >= end:
+            print(f"{index}: up to date")
+            continue
+
+        print(f"{index}: exporting ({utc(start) if start else 'beginning'}, {utc(end)}]")
+        rows = export_index(es, index, args.output, start, end)
+        if not args.full:
+            save_watermark(es, job, end, processed=rows)
+        print(f"{index}: {rows} rows written")
+
+
+if __name__ == "__main__":
+    main()
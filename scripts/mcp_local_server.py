@@ -0,0 +1,132 @@
+"""
+Local streamable-HTTP server for the MCP Lambda handler.
+
+Runs aws/lambda/mcp_server/handler.py behind http.server so the
+``text/event-stream`` transport can be used. The deployed Lambda answers with
+JSON only, as API Gateway (REST) buffers its response; this server writes and
+flushes each SSE event as soon as the handler yields it.
+
+Tool calls invoke the deployed Lambdas (DECISION_ENGINE_FUNCTION /
+RECOVERY_ACTION_FUNCTION and AWS credentials required) unless ``--echo-tools``
+is given, in which case every tool answers with its own arguments after the
+given delay.
+
+Usage:
+    python scripts/mcp_local_server.py --port 8080 --echo-tools 0.5
+    curl -N localhost:8080/mcp -H 'Accept: application/json, text/event-stream' \\
+        -d '[{"jsonrpc":"2.0","id":1,"method":"tools/call","params":{"name":"decision_engine",
+              "arguments":{"cart_id":"c1"},"_meta":{"progressToken":"p1"}}},
+             {"jsonrpc":"2.0","id":2,"method":"tools/call","params":{"name":"decision_engine",
+              "arguments":{"cart_id":"c2"}}}]'
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+LAMBDA_ROOT = PROJECT_ROOT / "aws" / "lambda"
+
+# EMF metrics would only clutter the console locally
+os.environ.setdefault("METRICS_SINK", "none")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path[:0] = [str(LAMBDA_ROOT / "common" / "python"), str(LAMBDA_ROOT / "mcp_server")]
+
+import handler as mcp  # noqa: E402
+
+
+def use_echo_tools(delay: float) -> None:
+    """Replace Lambda invocation with a local echo that sleeps ``delay`` seconds."""
+
+    def echo(function_name, payload, dependency="lambda.invoke"):
+        time.sleep(delay)
+        return {"statusCode": 200, "body": json.dumps({"tool": function_name, "arguments": payload})}
+
+    mcp._invoke_lambda = echo
+    for tool_name in mcp.TOOL_FUNCTION_MAP:
+        mcp.TOOL_FUNCTION_MAP[tool_name] = mcp.TOOL_FUNCTION_MAP[tool_name] or f"echo-{tool_name}"
+
+
+class McpRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _event(self, body=""):
+        return {"httpMethod": self.command, "headers": dict(self.headers), "body": body}
+
+    def _reply(self, response):
+        body = (response.get("body") or "").encode("utf-8")
+        self.send_response(response["statusCode"])
+        for name, value in (response.get("headers") or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(mcp.handler(self._event(), None))
+
+    do_DELETE = do_GET
+    do_OPTIONS = do_GET
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        event = self._event(raw)
+        if "text/event-stream" not in self.headers.get("Accept", ""):
+            self._reply(mcp.handler(event, None))
+            return
+
+        try:
+            body = json.loads(raw)
+        except json.JSONDecodeError:
+            # Let the handler produce the JSON-RPC parse error
+            self._reply(mcp.handler(event, None))
+            return
+
+        mcp.logger.begin(None, http_method="POST")
+        requests = body if isinstance(body, list) else [body]
+        events = mcp.iter_sse_events(requests, self.headers.get("MCP-Protocol-Version"))
+        first = next(events, None)
+        if first is None:
+            self._reply({"statusCode": 204, "body": ""})
+            return
+
+        self.send_response(200)
+        for name, value in mcp.SSE_HEADERS.items():
+            self.send_header(name, value)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._write_chunk(first)
+            for chunk in events:
+                self._write_chunk(chunk)
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            mcp.tracer.flush()
+            mcp.metrics.flush()
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default 8080)")
+    parser.add_argument("--echo-tools", type=float, metavar="SECONDS",
+                        help="Answer tool calls locally with their arguments after SECONDS")
+    args = parser.parse_args()
+
+    if args.echo_tools is not None:
+        use_echo_tools(args.echo_tools)
+
+    print(f"Serving MCP on http://0.0.0.0:{args.port}/mcp")
+    ThreadingHTTPServer(("0.0.0.0", args.port), McpRequestHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
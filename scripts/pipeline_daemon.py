@@ -0,0 +1,528 @@
+"""
+Run the whole recovery pipeline as one long-running asyncio process.
+
+For deployments outside Lambda: the same handler code (aws/lambda/*/handler.py)
+is loaded in process and wired into async stages connected by bounded queues:
+
+    events ─► ingest ──► Elasticsearch
+                           │
+    scan (cart_due_queue) ─► diagnose ─► decide ─► recover ─► recovery_history
+                                                               └─► ingest
+
+- ingest: events read from ``--events`` (NDJSON file or ``-`` for stdin,
+  ``--follow`` to keep tailing) plus the recovery_history events the recover
+  stage publishes, indexed in batches through event_ingest's bulk path
+- scan: every ``--scan-interval`` seconds, carts in cart_due_queue whose
+  ``check_at`` has passed (the detect_abandonment_reasons workflow's query)
+- diagnose: the workflow's diagnosis rules over one multi-search per cart;
+  fast-path carts and carts with a cached agent decision continue. Carts that
+  need the AI agent are left "active" for the detect_abandonment_reasons
+  workflow, which must run alongside the daemon to recover them; the daemon
+  skips them for ``--agent-skip-interval`` seconds before diagnosing again
+- decide / recover: decision_engine and recovery_action handlers, called in
+  worker threads
+- flush: every ``--flush-interval`` seconds, session_metrics from the changed
+  page-timing sketches (the stack's SessionMetricsFlushSchedule)
+
+Every stage has its own concurrency; a full queue blocks the stage feeding
+it, so a slow stage throttles everything upstream instead of piling up
+memory. SIGINT/SIGTERM stop the scan and the event reader, then each stage
+drains its queue in pipeline order (bounded by ``--drain-timeout``).
+
+Configuration is the Lambdas' environment (ES_ENDPOINT or ES_URL plus
+credentials, DECISION_BUCKET, SENDER_EMAIL, ...), read from the environment
+or .env. recovery_history events go straight to the local ingest stage
+unless ``--event-bus`` names an EventBridge bus to publish them to.
+
+Usage:
+    python scripts/pipeline_daemon.py --events events.ndjson --follow
+    python scripts/pipeline_daemon.py --once --recover-concurrency 4
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import signal
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from train_action_posteriors import ROOT_CAUSE_TO_REASON
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+LAMBDA_ROOT = PROJECT_ROOT / "aws" / "lambda"
+
+# Mirrors the workflow's consts and thresholds
+DETERMINISTIC_ROOT_CAUSES = {"payment_failure", "pricing_shipping", "browsing_or_window_shopping"}
+SLOW_P95_MS = 1000
+HIGH_ERROR_RATE = 0.05
+VALUE_BUCKETS = [(50, "0-50"), (100, "50-100"), (300, "100-300"), (500, "300-500")]
+PROFILE_FIELDS = ["customer_id", "segment", "lifetime_value", "preferred_channel", "fraud_risk",
+                  "email", "phone", "timezone", "locale"]
+
+# A dispatched cart stays "active" until its recovery_history event is
+# ingested; skip it in later scans for this long
+DISPATCH_TTL_SECONDS = 900
+MAX_INGEST_ATTEMPTS = 5
+
+
+def _load_handler(name: str, directory: str):
+    """Import aws/lambda/<directory>/handler.py as module ``name``."""
+    spec = importlib.util.spec_from_file_location(name, LAMBDA_ROOT / directory / "handler.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _log(msg: str, **fields) -> None:
+    print(json.dumps({"ts": round(time.time(), 3), "logger": "pipeline_daemon", "msg": msg, **fields}), flush=True)
+
+
+class Stage:
+    """
+    A bounded queue plus ``concurrency`` workers. Each worker takes up to
+    ``batch_size`` items and awaits ``fn(items)``, whose results go to the
+    ``downstream`` stage.
+    """
+
+    def __init__(self, name: str, fn: Callable, concurrency: int, maxsize: int,
+                 batch_size: int = 1, downstream: Optional["Stage"] = None):
+        self.name = name
+        self.fn = fn
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.downstream = downstream
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.processed = 0
+        self.failed = 0
+        self._workers: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._work(), name=f"{self.name}-{i}") for i in range(self.concurrency)]
+
+    async def put(self, item) -> None:
+        await self.queue.put(item)
+
+    async def _work(self) -> None:
+        while True:
+            items = [await self.queue.get()]
+            while len(items) < self.batch_size and not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            try:
+                results = await self.fn(items) or []
+                self.processed += len(items)
+                if self.downstream is not None:
+                    for result in results:
+                        await self.downstream.put(result)
+            except Exception as e:
+                self.failed += len(items)
+                _log("Stage failed", stage=self.name, items=len(items), error=f"{type(e).__name__}: {e}")
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    async def drain(self) -> None:
+        """Wait until every queued item is handled, then stop the workers."""
+        await self.queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "processed": self.processed, "failed": self.failed}
+
+
+class LocalEventBus:
+    """
+    Stands in for recovery_action's EventBridge client: ``put_events`` hands
+    each entry to the ingest stage, blocking the calling worker thread while
+    the ingest queue is full.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, ingest: Stage):
+        self._loop = loop
+        self._ingest = ingest
+
+    def put_events(self, Entries):  # noqa: N803 - boto3 signature
+        for entry in Entries:
+            event = {"id": str(uuid.uuid4()), "detail-type": entry.get("DetailType"),
+                     "detail": json.loads(entry["Detail"])}
+            asyncio.run_coroutine_threadsafe(self._ingest.put((event, 1)), self._loop).result()
+        return {"FailedEntryCount": 0, "Entries": [{"EventId": "local"} for _ in Entries]}
+
+
+def _normalize_event(raw: dict) -> dict:
+    """Accept EventBridge events (``detail-type``/``detail``) or PutEvents entries."""
+    if "Detail" in raw:
+        detail = raw["Detail"]
+        return {"id": str(uuid.uuid4()), "detail-type": raw.get("DetailType"),
+                "detail": json.loads(detail) if isinstance(detail, str) else detail}
+    if "detail" in raw:
+        return {**raw, "id": raw.get("id") or str(uuid.uuid4())}
+    return {"id": str(uuid.uuid4()), "detail-type": raw.get("_index"), "detail": raw}
+
+
+def _value_bucket(cart_value) -> str:
+    try:
+        value = float(cart_value or 0)
+    except (TypeError, ValueError):
+        value = 0.0
+    for upper, label in VALUE_BUCKETS:
+        if value < upper:
+            return label
+    return "500+"
+
+
+def _first(response: dict) -> Optional[dict]:
+    hits = (response.get("hits") or {}).get("hits") or []
+    return hits[0]["_source"] if hits else None
+
+
+def _total(response: dict) -> int:
+    return len((response.get("hits") or {}).get("hits") or [])
+
+
+def diagnose(cart: dict, profile_r: dict, contents_r: dict, checkout_r: dict, payment_r: dict,
+             session_r: dict) -> dict:
+    """The workflow's diagnosis, classification and fingerprint for one cart."""
+    profile = _first(profile_r)
+    checkout, payment, session = _first(checkout_r), _first(payment_r), _first(session_r)
+
+    causes = []
+    if payment and payment.get("status") == "failed":
+        causes.append("payment_failure")
+    if checkout and checkout.get("step") == "shipping_failed":
+        causes.append("pricing_shipping")
+    if session and ((session.get("p95_latency_ms") or 0) > SLOW_P95_MS
+                    or (session.get("error_rate") or 0) > HIGH_ERROR_RATE):
+        causes.append("performance_latency")
+    if _total(contents_r) > 0 and checkout is None:
+        causes.append("browsing_or_window_shopping")
+
+    root_cause = causes[0] if causes else "unknown"
+    fast_path = len(causes) == 1 and root_cause in DETERMINISTIC_ROOT_CAUSES and profile is not None
+    profile = profile or {}
+    fingerprint = "|".join([
+        str(profile.get("segment") or "unknown").lower(),
+        "+".join(sorted(causes)) or "unknown",
+        str(profile.get("fraud_risk") or "unknown").lower(),
+        _value_bucket(cart.get("cart_value")),
+    ])
+    return {
+        **cart,
+        "profile": profile,
+        "causes": causes,
+        "root_cause": root_cause,
+        "decision_path": "fast_path" if fast_path else "agent",
+        "fingerprint": fingerprint,
+    }
+
+
+class Pipeline:
+    def __init__(self, args):
+        self.args = args
+        self.stop = asyncio.Event()
+        self.dispatched: Dict[str, float] = {}
+        # Carts left for the workflow's agent; kept apart from ``dispatched``
+        # because the workflow, not this process, takes them out of the queue
+        self.agent_carts: Dict[str, float] = {}
+        self.needs_agent = 0
+        # Ingest retries waiting out their backoff; see _retry_ingest
+        self.retries: set = set()
+        self.run_id = f"daemon-{uuid.uuid4().hex[:12]}"
+
+        self.ingest_handler = _load_handler("event_ingest_handler", "event_ingest")
+        self.decision_handler = _load_handler("decision_engine_handler", "decision_engine")
+        self.recovery_handler = _load_handler("recovery_action_handler", "recovery_action")
+        self.es = self.ingest_handler._get_es_client()
+        if self.es is None:
+            raise SystemExit("ES_ENDPOINT (or ES_URL) is required")
+
+        size, c = args.queue_size, args
+        self.ingest = Stage("ingest", self._ingest, c.ingest_concurrency, size, batch_size=c.ingest_batch)
+        self.recover = Stage("recover", self._recover, c.recover_concurrency, size)
+        self.decide = Stage("decide", self._decide, c.decide_concurrency, size, downstream=self.recover)
+        self.diagnose = Stage("diagnose", self._diagnose, c.diagnose_concurrency, size, downstream=self.decide)
+        # Drain order: work flows diagnose → decide → recover → ingest
+        self.stages = [self.diagnose, self.decide, self.recover, self.ingest]
+
+    # ── Sources ──────────────────────────────────────────────────────────
+
+    async def read_events(self, path: str) -> None:
+        """Feed NDJSON events to the ingest stage; with --follow, keep tailing."""
+        stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+        try:
+            while not self.stop.is_set():
+                line = await asyncio.to_thread(stream.readline)
+                if not line:
+                    if not self.args.follow or path == "-":
+                        return
+                    await asyncio.sleep(1)
+                    continue
+                if not line.strip():
+                    continue
+                try:
+                    event = _normalize_event(json.loads(line))
+                except (ValueError, TypeError) as e:
+                    _log("Skipping malformed event line", error=str(e))
+                    continue
+                await self.ingest.put((event, 1))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    def _due_carts(self, size: int) -> List[dict]:
+        resp = self.es.search(
+            index="cart_due_queue",
+            size=size,
+            query={"bool": {"filter": [{"range": {"check_at": {"lt": "now"}}}]}},
+            sort=[{"check_at": "asc"}],
+            track_total_hits=False,
+            _source=["cart_id", "customer_id", "last_seen", "check_at", "status", "cart_value", "currency",
+                     "device_type", "session_id"],
+        )
+        return [hit["_source"] for hit in resp["hits"]["hits"]]
+
+    async def scan(self) -> None:
+        """Queue due carts every --scan-interval seconds (once with --once)."""
+        while not self.stop.is_set():
+            now = time.monotonic()
+            self.dispatched = {k: t for k, t in self.dispatched.items() if t > now}
+            self.agent_carts = {k: t for k, t in self.agent_carts.items() if t > now}
+            try:
+                carts = await asyncio.to_thread(self._due_carts, self.args.scan_size)
+            except Exception as e:
+                _log("Scan failed", error=f"{type(e).__name__}: {e}")
+                carts = []
+            queued = 0
+            for cart in carts:
+                cart_id = cart.get("cart_id")
+                if not cart_id or cart_id in self.dispatched or cart_id in self.agent_carts:
+                    continue
+                self.dispatched[cart_id] = now + DISPATCH_TTL_SECONDS
+                await self.diagnose.put(cart)
+                queued += 1
+            _log("Scan complete", due=len(carts), queued=queued)
+            if self.args.once:
+                return
+            try:
+                await asyncio.wait_for(self.stop.wait(), timeout=self.args.scan_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _flush_session_metrics(self) -> None:
+        try:
+            await asyncio.to_thread(self.ingest_handler.lambda_handler, {"action": "flush_session_metrics"}, None)
+        except Exception as e:
+            _log("Session metrics flush failed", error=f"{type(e).__name__}: {e}")
+
+    async def flush_session_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.flush_interval)
+            await self._flush_session_metrics()
+
+    # ── Stages ───────────────────────────────────────────────────────────
+
+    async def _ingest(self, items) -> None:
+        records = [{"messageId": str(i), "body": json.dumps(event)} for i, (event, _) in enumerate(items)]
+        result = await asyncio.to_thread(self.ingest_handler.lambda_handler, {"Records": records}, None)
+        for failure in result.get("batchItemFailures", []):
+            event, attempt = items[int(failure["itemIdentifier"])]
+            if attempt >= MAX_INGEST_ATTEMPTS:
+                self.ingest.failed += 1
+                _log("Dropping event after retries", event_id=event.get("id"), attempts=attempt)
+                continue
+            self._retry_ingest(event, attempt + 1, min(2 ** attempt, 30))
+
+    def _retry_ingest(self, event: dict, attempt: int, delay: float) -> None:
+        """
+        Requeue a failed event after ``delay`` seconds from a task of its
+        own, so the ingest worker neither sleeps through the backoff nor
+        blocks on its own full queue.
+        """
+        async def requeue():
+            await asyncio.sleep(delay)
+            await self.ingest.put((event, attempt))
+
+        task = asyncio.create_task(requeue())
+        self.retries.add(task)
+        task.add_done_callback(self.retries.discard)
+
+    def _cart_signals(self, cart: dict) -> dict:
+        cart_id, customer_id = cart["cart_id"], cart.get("customer_id")
+        latest = [{"@timestamp": {"order": "desc", "unmapped_type": "date"}}]
+        searches = [
+            {"index": "customer_profiles"},
+            {"query": {"term": {"customer_id": customer_id or ""}}, "size": 1, "_source": PROFILE_FIELDS},
+            {"index": "cart_contents"},
+            {"query": {"ids": {"values": [cart_id]}}, "size": 1, "_source": ["item_count"]},
+            {"index": "checkout_events"},
+            {"query": {"term": {"cart_id": cart_id}}, "size": 1, "sort": latest},
+            {"index": "payment_logs"},
+            {"query": {"term": {"cart_id": cart_id}}, "size": 1, "sort": latest},
+            {"index": "session_metrics"},
+            {"query": {"term": {"session_id": cart.get("session_id") or ""}}, "size": 1},
+        ]
+        responses = self.es.msearch(searches=searches)["responses"]
+        diagnosis = diagnose(cart, *responses)
+        if diagnosis["decision_path"] == "agent":
+            cached = self.es.search(
+                index="recommendation_cache",
+                size=1,
+                query={"bool": {"filter": [{"term": {"fingerprint": diagnosis["fingerprint"]}},
+                                           {"range": {"expires_at": {"gt": "now"}}}]}},
+                _source=["root_cause"],
+            )["hits"]["hits"]
+            if cached:
+                diagnosis.update(root_cause=cached[0]["_source"]["root_cause"], decision_path="cached")
+        return diagnosis
+
+    async def _diagnose(self, carts) -> Iterable[dict]:
+        diagnosis = await asyncio.to_thread(self._cart_signals, carts[0])
+        if diagnosis["decision_path"] == "agent":
+            # Left "active" for the workflow's AI agent
+            self.needs_agent += 1
+            self.agent_carts[diagnosis["cart_id"]] = time.monotonic() + self.args.agent_skip_interval
+            return []
+        return [diagnosis]
+
+    async def _decide(self, carts) -> Iterable[dict]:
+        cart = carts[0]
+        profile = cart["profile"]
+        root_cause = cart["root_cause"]
+        response = await asyncio.to_thread(self.decision_handler.handler, {
+            "cart_id": cart["cart_id"],
+            "customer_id": cart.get("customer_id"),
+            "user_segment": profile.get("segment"),
+            "abandonment_reason": ROOT_CAUSE_TO_REASON.get(root_cause, root_cause),
+            "cart_value": cart.get("cart_value"),
+            "fraud_risk": profile.get("fraud_risk") or "low",
+            "lifetime_value": profile.get("lifetime_value"),
+            "device_type": cart.get("device_type"),
+            "locale": profile.get("locale"),
+        }, None)
+        if response.get("statusCode", 500) >= 400:
+            raise RuntimeError(f"decision_engine failed for {cart['cart_id']}: {response.get('body')}")
+        return [{**cart, "decision": json.loads(response["body"])}]
+
+    async def _recover(self, carts) -> None:
+        cart = carts[0]
+        profile = cart["profile"]
+        response = await asyncio.to_thread(self.recovery_handler.handler, {
+            "cart_id": cart["cart_id"],
+            "customer_id": cart.get("customer_id"),
+            "email": profile.get("email") or "",
+            "recommended_action": cart["decision"].get("recommended_action") or {},
+            "segment": profile.get("segment"),
+            "fraud_risk": profile.get("fraud_risk") or "low",
+            "root_cause": cart["root_cause"],
+            "cart_value": cart.get("cart_value"),
+            "currency": cart.get("currency"),
+            "decision_path": cart["decision_path"],
+            "run_id": self.run_id,
+            "fingerprint": cart["fingerprint"],
+            "timezone": profile.get("timezone"),
+        }, None)
+        if response.get("statusCode", 500) >= 400:
+            raise RuntimeError(f"recovery_action failed for {cart['cart_id']}: {response.get('body')}")
+
+    # ── Lifecycle ────────────────────────────────────────────────────────
+
+    async def report(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.stats_interval)
+            _log("Pipeline stats", needs_agent=self.needs_agent, **{s.name: s.stats() for s in self.stages})
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        workers = sum(s.concurrency for s in self.stages) + 4
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline"))
+        if not self.args.event_bus:
+            self.recovery_handler.events_client = LocalEventBus(loop, self.ingest)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop.set)
+
+        for stage in self.stages:
+            stage.start()
+        sources = [asyncio.create_task(self.scan())]
+        if self.args.events:
+            sources.append(asyncio.create_task(self.read_events(self.args.events)))
+        reporter = asyncio.create_task(self.report())
+        flusher = asyncio.create_task(self.flush_session_metrics())
+        _log("Pipeline started", run_id=self.run_id, **{f"{s.name}_concurrency": s.concurrency for s in self.stages})
+
+        if self.args.once:
+            await asyncio.gather(*sources, return_exceptions=True)
+        else:
+            await self.stop.wait()
+        _log("Draining pipeline")
+        for task in sources:
+            task.cancel()
+        await asyncio.gather(*sources, return_exceptions=True)
+        try:
+            await asyncio.wait_for(self._drain(), timeout=self.args.drain_timeout)
+        except asyncio.TimeoutError:
+            _log("Drain timed out; abandoning queued work", ingest_retries=len(self.retries),
+                 **{s.name: s.queue.qsize() for s in self.stages})
+            for task in list(self.retries):
+                task.cancel()
+        reporter.cancel()
+        flusher.cancel()
+        # Timings ingested while draining still reach session_metrics
+        await self._flush_session_metrics()
+        _log("Pipeline stopped", needs_agent=self.needs_agent, **{s.name: s.stats() for s in self.stages})
+
+    async def _drain(self) -> None:
+        for stage in self.stages[:-1]:
+            await stage.drain()
+        # Retries are registered before their batch is marked done, so once
+        # the queue is joined with none pending, ingest has nothing left
+        while True:
+            await self.ingest.queue.join()
+            if not self.retries:
+                break
+            await asyncio.wait(set(self.retries))
+        await self.ingest.drain()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", help="NDJSON file of events to ingest, or - for stdin")
+    parser.add_argument("--follow", action="store_true", help="Keep reading --events as it grows")
+    parser.add_argument("--once", action="store_true", help="Run one scan (and read --events once), drain and exit")
+    parser.add_argument("--event-bus", help="Publish recovery_history to this EventBridge bus instead of ingesting locally")
+    parser.add_argument("--scan-interval", type=float, default=60.0, help="Seconds between due-cart scans")
+    parser.add_argument("--scan-size", type=int, default=500, help="Due carts read per scan")
+    parser.add_argument("--agent-skip-interval", type=float, default=3600.0,
+                        help="Seconds before a cart left for the workflow's agent is diagnosed again")
+    parser.add_argument("--queue-size", type=int, default=1000, help="Bound of each stage's queue")
+    parser.add_argument("--ingest-batch", type=int, default=500, help="Events per bulk ingest")
+    parser.add_argument("--ingest-concurrency", type=int, default=2)
+    parser.add_argument("--diagnose-concurrency", type=int, default=16)
+    parser.add_argument("--decide-concurrency", type=int, default=8)
+    parser.add_argument("--recover-concurrency", type=int, default=8)
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Seconds to finish queued work on shutdown")
+    parser.add_argument("--flush-interval", type=float, default=60.0,
+                        help="Seconds between session_metrics flushes")
+    parser.add_argument("--stats-interval", type=float, default=30.0, help="Seconds between stats lines")
+    args = parser.parse_args()
+
+    load_dotenv(PROJECT_ROOT / ".env")
+    # Scripts configure Elasticsearch with ES_URL; the handlers read ES_ENDPOINT
+    if os.getenv("ES_URL"):
+        os.environ.setdefault("ES_ENDPOINT", os.environ["ES_URL"])
+    os.environ["EVENT_BUS_NAME"] = args.event_bus or os.getenv("EVENT_BUS_NAME") or "local"
+    sys.path[:0] = [str(LAMBDA_ROOT / d) for d in ("common/python", "event_ingest", "decision_engine", "recovery_action")]
+
+    asyncio.run(Pipeline(args).run())
+
+
+if __name__ == "__main__":
+    main()
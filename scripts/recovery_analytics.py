@@ -0,0 +1,344 @@
+"""
+Recovery analytics: recovery rate and revenue by segment × root_cause × action type.
+
+Results are computed from recovery_history with a paged composite aggregation
+(one page per PAGE_SIZE groups, following ``after_key``) over the recoveries
+that reached the customer (blocked, capped, skipped, ... sends are left out of
+the rate), and cached per daily time bucket, keyed by the query and the bucket
+start:
+
+- Closed buckets (older than the attribution settle period) never change and
+  are served from the cache forever.
+- Open buckets (today plus any day whose outcomes may still be attributed) are
+  recomputed at most once per OPEN_BUCKET_TTL, in a single composite query that
+  covers all of them.
+
+A dashboard refreshing every minute therefore costs at most one small
+aggregation per minute, however many viewers it has: concurrent requests for
+the same query wait for the one refreshing it instead of running their own
+aggregation. Entries not read for
+CACHE_IDLE_TTL are dropped whenever the cache is saved, so days and filter
+combinations nobody asks for again do not pile up.
+
+Usage:
+    python scripts/recovery_analytics.py --days 30 [--segment vip] [--experiment standard_discount_depth --variant 15pct]
+    python scripts/recovery_analytics.py --serve 8088
+        GET /recovery-analytics?days=30&segment=vip&root_cause=payment_failure
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from elasticsearch import Elasticsearch
+
+from attribute_recovery_outcomes import NOT_DELIVERED
+from bootstrap_indices import PROJECT_ROOT, build_es_client
+
+
+RECOVERY_INDEX = "recovery_history"
+PAGE_SIZE = 1000
+
+# Outcomes keep arriving until the attribution job closes a recovery, so a
+# day's numbers are only final once the attribution window has passed.
+SETTLE_PERIOD = timedelta(days=int(os.getenv("ATTRIBUTION_WINDOW_DAYS", "7")))
+OPEN_BUCKET_TTL = timedelta(seconds=int(os.getenv("ANALYTICS_OPEN_TTL_SECONDS", "60")))
+CACHE_IDLE_TTL = timedelta(days=int(os.getenv("ANALYTICS_CACHE_IDLE_DAYS", "30")))
+CACHE_PATH = Path(os.getenv("ANALYTICS_CACHE_PATH", str(PROJECT_ROOT / ".cache" / "recovery_analytics.json")))
+
+FILTER_FIELDS = {
+    "segment": "segment",
+    "root_cause": "diagnosis.root_cause",
+    "action_type": "action.type",
+    "decision_path": "decision_path",
+    "experiment": "action.experiment",
+    "variant": "action.variant",
+}
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _day_start(d: date) -> datetime:
+    return datetime(d.year, d.month, d.day, tzinfo=timezone.utc)
+
+
+class BucketCache:
+    """
+    Per-day aggregation results, persisted to a JSON file between runs.
+    Entries idle for longer than CACHE_IDLE_TTL are evicted on ``save``.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._query_locks: Dict[str, threading.Lock] = {}
+        self._entries: Dict[str, dict] = {}
+        if path.exists():
+            with path.open("r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def key(query_key: str, day: date) -> str:
+        return f"{query_key}:{day.isoformat()}"
+
+    def query_lock(self, query_key: str) -> threading.Lock:
+        """The lock serializing refreshes of one query's buckets."""
+        with self._lock:
+            return self._query_locks.setdefault(query_key, threading.Lock())
+
+    def get(self, query_key: str, day: date, now: datetime) -> Optional[List[dict]]:
+        with self._lock:
+            entry = self._entries.get(self.key(query_key, day))
+            if entry is None:
+                return None
+            entry["used_at"] = now.isoformat()
+            if entry["closed"]:
+                return entry["rows"]
+            computed_at = datetime.fromisoformat(entry["computed_at"])
+            return entry["rows"] if now - computed_at < OPEN_BUCKET_TTL else None
+
+    def put(self, query_key: str, day: date, rows: List[dict], closed: bool, now: datetime) -> None:
+        with self._lock:
+            self._entries[self.key(query_key, day)] = {
+                "rows": rows,
+                "closed": closed,
+                "computed_at": now.isoformat(),
+                "used_at": now.isoformat(),
+            }
+
+    def evict_idle(self, now: datetime) -> int:
+        """Drop entries not read since ``now - CACHE_IDLE_TTL``; returns how many."""
+        cutoff = now - CACHE_IDLE_TTL
+        with self._lock:
+            idle = [key for key, entry in self._entries.items()
+                    if datetime.fromisoformat(entry.get("used_at") or entry["computed_at"]) < cutoff]
+            for key in idle:
+                del self._entries[key]
+        return len(idle)
+
+    def save(self, now: Optional[datetime] = None) -> None:
+        self.evict_idle(now or _utc_now())
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            tmp.replace(self.path)
+
+
+def _query_key(filters: Dict[str, str]) -> str:
+    # v2: undelivered sends left out of the denominator
+    canonical = json.dumps({"v": 2, "filters": filters}, sort_keys=True)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _iter_composite(es: Elasticsearch, start: datetime, end: datetime, filters: Dict[str, str]) -> Iterator[dict]:
+    """Page through day × segment × root_cause × action_type groups."""
+    query_filters = [{"range": {"sent_at": {"gte": start.isoformat(), "lt": end.isoformat()}}}]
+    for name, value in filters.items():
+        query_filters.append({"term": {FILTER_FIELDS[name]: value}})
+
+    composite = {
+        "size": PAGE_SIZE,
+        "sources": [
+            {"day": {"date_histogram": {"field": "sent_at", "fixed_interval": "1d", "format": "yyyy-MM-dd"}}},
+            {"segment": {"terms": {"field": "segment", "missing_bucket": True}}},
+            {"root_cause": {"terms": {"field": "diagnosis.root_cause", "missing_bucket": True}}},
+            {"action_type": {"terms": {"field": "action.type", "missing_bucket": True}}},
+        ],
+    }
+    while True:
+        resp = es.search(
+            index=RECOVERY_INDEX,
+            size=0,
+            query={"bool": {"filter": query_filters,
+                            "must_not": [{"terms": {"send_status": NOT_DELIVERED}}]}},
+            aggs={
+                "groups": {
+                    "composite": composite,
+                    "aggs": {
+                        "recovered": {"filter": {"term": {"outcome.status": "recovered"}}},
+                        "revenue": {"sum": {"field": "outcome.revenue_recovered"}},
+                    },
+                }
+            },
+        )
+        groups = resp["aggregations"]["groups"]
+        yield from groups["buckets"]
+        after = groups.get("after_key")
+        if not after or not groups["buckets"]:
+            return
+        composite["after"] = after
+
+
+def _compute_days(es: Elasticsearch, days: List[date], filters: Dict[str, str]) -> Dict[date, List[dict]]:
+    """Aggregate a contiguous span of days with one paged composite query."""
+    result: Dict[date, List[dict]] = {d: [] for d in days}
+    start = _day_start(min(days))
+    end = _day_start(max(days)) + timedelta(days=1)
+    for bucket in _iter_composite(es, start, end, filters):
+        key = bucket["key"]
+        day = date.fromisoformat(key["day"])
+        if day not in result:
+            continue
+        result[day].append({
+            "segment": key["segment"],
+            "root_cause": key["root_cause"],
+            "action_type": key["action_type"],
+            "sent": bucket["doc_count"],
+            "recovered": bucket["recovered"]["doc_count"],
+            "revenue": bucket["revenue"]["value"] or 0.0,
+        })
+    return result
+
+
+def _merge(rows_by_day: Dict[date, List[dict]]) -> List[dict]:
+    totals: Dict[Tuple, dict] = {}
+    for rows in rows_by_day.values():
+        for row in rows:
+            group = (row["segment"], row["root_cause"], row["action_type"])
+            acc = totals.setdefault(group, {
+                "segment": row["segment"],
+                "root_cause": row["root_cause"],
+                "action_type": row["action_type"],
+                "sent": 0,
+                "recovered": 0,
+                "revenue": 0.0,
+            })
+            acc["sent"] += row["sent"]
+            acc["recovered"] += row["recovered"]
+            acc["revenue"] += row["revenue"]
+
+    merged = []
+    for acc in totals.values():
+        acc["recovery_rate"] = round(acc["recovered"] / acc["sent"], 4) if acc["sent"] else 0.0
+        acc["revenue"] = round(acc["revenue"], 2)
+        merged.append(acc)
+    merged.sort(key=lambda r: (-r["revenue"], -r["sent"]))
+    return merged
+
+
+def recovery_analytics(
+    es: Elasticsearch,
+    cache: BucketCache,
+    start: date,
+    end: date,
+    filters: Optional[Dict[str, str]] = None,
+) -> dict:
+    """Recovery rate and revenue per group for the days in [start, end]."""
+    filters = {k: v for k, v in (filters or {}).items() if v}
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unsupported filters: {sorted(unknown)}")
+
+    query_key = _query_key(filters)
+
+    # Single flight: a request that finds stale buckets refreshes them while
+    # concurrent requests for the same query wait and then read the cache
+    with cache.query_lock(query_key):
+        now = _utc_now()
+        settled_before = (now - SETTLE_PERIOD).date()
+        rows_by_day: Dict[date, List[dict]] = {}
+        stale: List[date] = []
+        day = start
+        while day <= end:
+            cached = cache.get(query_key, day, now)
+            if cached is None:
+                stale.append(day)
+            else:
+                rows_by_day[day] = cached
+            day += timedelta(days=1)
+
+        # Closed days only miss on first use; group stale days into contiguous
+        # spans so the steady state is a single query over the open days.
+        spans: List[List[date]] = []
+        for d in stale:
+            if spans and d - spans[-1][-1] == timedelta(days=1):
+                spans[-1].append(d)
+            else:
+                spans.append([d])
+        for span in spans:
+            for d, rows in _compute_days(es, span, filters).items():
+                closed = d < settled_before
+                cache.put(query_key, d, rows, closed, now)
+                rows_by_day[d] = rows
+        if stale:
+            cache.save(now)
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "filters": filters,
+        "buckets_computed": len(stale),
+        "buckets_cached": (end - start).days + 1 - len(stale),
+        "groups": _merge(rows_by_day),
+    }
+
+
+def _date_range(days: int, start: Optional[str], end: Optional[str]) -> Tuple[date, date]:
+    end_d = date.fromisoformat(end) if end else _utc_now().date()
+    start_d = date.fromisoformat(start) if start else end_d - timedelta(days=days - 1)
+    if start_d > end_d:
+        raise ValueError("'from' must not be after 'to'")
+    return start_d, end_d
+
+
+def serve(port: int, es: Elasticsearch, cache: BucketCache) -> None:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/recovery-analytics":
+                self._reply(404, {"error": "not found"})
+                return
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                start, end = _date_range(int(params.pop("days", "30")), params.pop("from", None), params.pop("to", None))
+                self._reply(200, recovery_analytics(es, cache, start, end, params))
+            except ValueError as e:
+                self._reply(400, {"error": str(e)})
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f"Serving recovery analytics on http://0.0.0.0:{port}/recovery-analytics")
+    ThreadingHTTPServer(("0.0.0.0", port), Handler).serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=30, help="Days to cover, ending today (default 30)")
+    parser.add_argument("--from", dest="start", help="First day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", help="Last day (YYYY-MM-DD)")
+    for name in FILTER_FIELDS:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, help=f"Only include this {name}")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="Run as an HTTP endpoint instead")
+    args = parser.parse_args()
+
+    es = build_es_client()
+    cache = BucketCache(CACHE_PATH)
+
+    if args.serve:
+        serve(args.serve, es, cache)
+        return
+
+    start, end = _date_range(args.days, args.start, args.end)
+    filters = {name: getattr(args, name) for name in FILTER_FIELDS}
+    print(json.dumps(recovery_analytics(es, cache, start, end, filters), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+"""
+What-if simulation of a candidate decision matrix over historical carts.
+
+Loads recovery_history documents into columnar NumPy arrays and evaluates the
+current and a candidate ``decision-matrix.json`` over every row with
+vectorized logic equivalent to decision_engine's ``resolve_action``
+(segment/reason table, default-segment fallback, ``high_cart_value``
+threshold override). Like the decision engine, rows with ``fraud_risk: high``
+are evaluated as the ``high_fraud_risk`` segment; recovery_history documents
+written before ``fraud_risk`` was recorded keep their profile segment, so
+high-risk carts among them are simulated with that segment's actions.
+Reports per matrix:
+
+- action mix (count and share per action type, plus rows whose action changes)
+- expected recoveries and recovered revenue, using the recovery rate observed
+  per segment × reason × action type, shrunk towards the action type's
+  ``success_indicators`` rate (the same prior train_action_posteriors.py uses)
+- expected incentive cost: discount percent × cart value, and
+  ``--shipping-cost`` per free-shipping recovery, on recovered carts only
+
+Conditional ``rules``, ``experiments`` and Thompson sampling are not
+simulated: recovery_history does not record the device, locale and lifetime
+value facts rules match on.
+
+Input is an NDJSON export of recovery_history (one ``_source`` or search hit
+per line, optionally gzipped), written by ``--export`` or any other tool. Parsing
+JSON dominates load time, so ``--save-columns`` keeps the parsed arrays as
+``.npz`` and later runs load them directly.
+
+Usage:
+    python scripts/simulate_decision_matrix.py --export history.ndjson.gz --days 90
+    python scripts/simulate_decision_matrix.py --input history.ndjson.gz --candidate new-matrix.json \\
+        --save-columns history.npz
+    python scripts/simulate_decision_matrix.py --input history.npz --candidate new-matrix.json
+    python scripts/simulate_decision_matrix.py --synthetic 5000000 --candidate new-matrix.json
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from elasticsearch import helpers
+
+from bootstrap_indices import build_es_client
+from train_action_posteriors import MATRIX_PATH, PRIOR_STRENGTH, RECOVERY_INDEX, ROOT_CAUSE_TO_REASON
+
+
+EXPORT_FIELDS = ["@timestamp", "segment", "fraud_risk", "diagnosis.root_cause", "cart_value", "action.type",
+                 "outcome.status", "outcome.revenue_recovered"]
+# Mirrors decision_engine's FALLBACK_ACTION
+FALLBACK_ACTION = {"type": "reminder", "discount": None, "free_shipping": False}
+# Action types that never reach the customer
+NO_SEND_TYPES = {"blocked"}
+
+
+class Columns:
+    """
+    Historical carts as parallel arrays. Strings are dictionary-encoded:
+    ``segment``/``reason``/``action`` hold codes into the matching vocabulary.
+    """
+
+    def __init__(self, segment, reason, action, cart_value, closed, recovered, revenue,
+                 segments: List[str], reasons: List[str], actions: List[str]):
+        self.segment = segment
+        self.reason = reason
+        self.action = action
+        self.cart_value = cart_value
+        self.closed = closed
+        self.recovered = recovered
+        self.revenue = revenue
+        self.segments = segments
+        self.reasons = reasons
+        self.actions = actions
+
+    def __len__(self):
+        return len(self.segment)
+
+    def save(self, path: Path) -> None:
+        np.savez_compressed(
+            path,
+            segment=self.segment, reason=self.reason, action=self.action, cart_value=self.cart_value,
+            closed=self.closed, recovered=self.recovered, revenue=self.revenue,
+            segments=np.array(self.segments, dtype=object), reasons=np.array(self.reasons, dtype=object),
+            actions=np.array(self.actions, dtype=object),
+        )
+
+    @classmethod
+    def load_npz(cls, path: Path) -> "Columns":
+        data = np.load(path, allow_pickle=True)
+        return cls(
+            data["segment"], data["reason"], data["action"], data["cart_value"],
+            data["closed"], data["recovered"], data["revenue"],
+            list(data["segments"]), list(data["reasons"]), list(data["actions"]),
+        )
+
+
+def _normalize(value) -> str:
+    return str(value).lower().replace(" ", "_") if value else ""
+
+
+def _segment(doc: dict) -> str:
+    """The segment the decision engine looked up: high fraud risk overrides the profile's."""
+    if _normalize(doc.get("fraud_risk")) == "high":
+        return "high_fraud_risk"
+    return _normalize(doc.get("segment"))
+
+
+def _reason(root_cause) -> str:
+    key = _normalize(root_cause)
+    return ROOT_CAUSE_TO_REASON.get(key, key)
+
+
+def _encoder(vocabulary: List[str]):
+    codes: Dict[str, int] = {value: code for code, value in enumerate(vocabulary)}
+
+    def encode(value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(vocabulary)
+            vocabulary.append(value)
+        return code
+
+    return encode
+
+
+def _open(path: Path):
+    return gzip.open(path, "rt", encoding="utf-8") if path.suffix == ".gz" else path.open("r", encoding="utf-8")
+
+
+def load_export(path: Path) -> Columns:
+    """Parse an NDJSON recovery_history export into Columns."""
+    segments: List[str] = [""]
+    reasons: List[str] = [""]
+    actions: List[str] = [""]
+    encode_segment, encode_reason, encode_action = _encoder(segments), _encoder(reasons), _encoder(actions)
+    seg, rsn, act, value, closed, recovered, revenue = [], [], [], [], [], [], []
+
+    with _open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            doc = json.loads(line)
+            doc = doc.get("_source", doc)
+            outcome = doc.get("outcome") or {}
+            seg.append(encode_segment(_segment(doc)))
+            rsn.append(encode_reason(_reason((doc.get("diagnosis") or {}).get("root_cause"))))
+            act.append(encode_action((doc.get("action") or {}).get("type") or ""))
+            cart_value = doc.get("cart_value")
+            value.append(float(cart_value) if cart_value is not None else np.nan)
+            status = outcome.get("status")
+            closed.append(status is not None)
+            recovered.append(status == "recovered")
+            revenue.append(float(outcome.get("revenue_recovered") or 0.0))
+
+    return Columns(
+        np.array(seg, dtype=np.int32), np.array(rsn, dtype=np.int32), np.array(act, dtype=np.int32),
+        np.array(value, dtype=np.float64), np.array(closed, dtype=bool), np.array(recovered, dtype=bool),
+        np.array(revenue, dtype=np.float64), segments, reasons, actions,
+    )
+
+
+def synthetic_columns(rows: int, seed: int) -> Columns:
+    """Random carts with plausible mixes, for timing the evaluator."""
+    rng = np.random.default_rng(seed)
+    segments = ["", "vip", "standard", "high_fraud_risk"]
+    reasons = ["", "payment_failure", "shipping_issue", "browsing_abandonment"]
+    actions = ["", "payment_retry", "discount", "free_shipping", "reminder", "reminder_only", "blocked"]
+    cart_value = rng.lognormal(4.5, 1.0, rows)
+    cart_value[rng.random(rows) < 0.02] = np.nan
+    closed = rng.random(rows) < 0.9
+    recovered = closed & (rng.random(rows) < 0.3)
+    return Columns(
+        rng.choice(4, rows, p=[0.05, 0.15, 0.75, 0.05]).astype(np.int32),
+        rng.choice(4, rows, p=[0.05, 0.3, 0.3, 0.35]).astype(np.int32),
+        rng.integers(1, len(actions), rows, dtype=np.int32),
+        cart_value, closed, recovered, np.where(recovered, np.nan_to_num(cart_value), 0.0),
+        segments, reasons, actions,
+    )
+
+
+def export_history(path: Path, days: int) -> int:
+    """Write recovery_history documents from the last ``days`` days as NDJSON."""
+    es = build_es_client()
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    count = 0
+    opener = gzip.open(path, "wt", encoding="utf-8") if path.suffix == ".gz" else path.open("w", encoding="utf-8")
+    with opener as f:
+        for hit in helpers.scan(
+            es,
+            index=RECOVERY_INDEX,
+            query={"query": {"range": {"@timestamp": {"gte": since}}}, "_source": EXPORT_FIELDS},
+            size=5000,
+            preserve_order=False,
+        ):
+            f.write(json.dumps(hit["_source"], separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+
+class CompiledMatrix:
+    """
+    A decision matrix as lookup arrays over a Columns vocabulary:
+    ``table[segment, reason]`` is the action index for the plain lookup,
+    ``threshold``/``high_action`` hold each segment's high_cart_value override
+    (NaN threshold when it has none).
+    """
+
+    def __init__(self, matrix: dict, columns: Columns):
+        self.actions: List[dict] = [FALLBACK_ACTION]
+        action_index: Dict[Tuple, int] = {self._action_key(FALLBACK_ACTION): 0}
+
+        def index_of(entry: dict) -> int:
+            action = {
+                "type": entry.get("type", "reminder"),
+                "discount": entry.get("discount"),
+                "free_shipping": bool(entry.get("free_shipping", False)),
+            }
+            key = self._action_key(action)
+            if key not in action_index:
+                action_index[key] = len(self.actions)
+                self.actions.append(action)
+            return action_index[key]
+
+        matrix_segments = matrix.get("segments", {})
+        n_segments, n_reasons = len(columns.segments), len(columns.reasons)
+        self.table = np.zeros((n_segments, n_reasons), dtype=np.int32)
+        self.threshold = np.full(n_segments, np.nan)
+        self.high_action = np.zeros(n_segments, dtype=np.int32)
+
+        for s, segment in enumerate(columns.segments):
+            segment_key = segment or "default"
+            if segment_key not in matrix_segments:
+                segment_key = "default"
+            segment_data = matrix_segments.get(segment_key, {})
+            for r, reason in enumerate(columns.reasons):
+                if reason and reason in segment_data:
+                    self.table[s, r] = index_of(segment_data[reason])
+            high = segment_data.get("high_cart_value")
+            if high:
+                self.threshold[s] = float(high.get("cart_value_threshold", 0))
+                self.high_action[s] = index_of(high)
+
+        # The override skips rows with no reason or a payment failure
+        self.override_reason = np.array(
+            [bool(reason) and reason != "payment_failure" for reason in columns.reasons], dtype=bool
+        )
+
+    @staticmethod
+    def _action_key(action: dict) -> Tuple:
+        return action["type"], action.get("discount"), bool(action.get("free_shipping"))
+
+    def evaluate(self, columns: Columns) -> np.ndarray:
+        """Action index per row, as resolve_action would pick it."""
+        threshold = self.threshold[columns.segment]
+        # NaN compares False, covering both a missing cart value and no override
+        with np.errstate(invalid="ignore"):
+            high = self.override_reason[columns.reason] & (columns.cart_value > threshold)
+        return np.where(high, self.high_action[columns.segment], self.table[columns.segment, columns.reason])
+
+
+def _discount_percent(discount) -> float:
+    if not discount:
+        return 0.0
+    try:
+        return float(str(discount).strip().rstrip("%")) / 100.0
+    except ValueError:
+        return 0.0
+
+
+def recovery_rates(columns: Columns, prior_matrix: dict, types: List[str]) -> Tuple[np.ndarray, List[str]]:
+    """
+    Rate per (segment, reason, action type in ``types``): recovered / closed
+    in history, shrunk towards the type's success_indicators rate (or its
+    overall observed rate) with PRIOR_STRENGTH pseudo-observations. Also
+    returns the types with neither, which are assumed never to recover.
+    """
+    n_s, n_r, n_t = len(columns.segments), len(columns.reasons), len(types)
+    type_of_action = np.array([types.index(a) if a in types else -1 for a in columns.actions], dtype=np.int64)
+    row_type = type_of_action[columns.action]
+    mask = columns.closed & (row_type >= 0)
+    cells = (columns.segment[mask].astype(np.int64) * n_r + columns.reason[mask]) * n_t + row_type[mask]
+    closed = np.bincount(cells, minlength=n_s * n_r * n_t).reshape(n_s, n_r, n_t)
+    recovered = np.bincount(cells, weights=columns.recovered[mask], minlength=n_s * n_r * n_t).reshape(n_s, n_r, n_t)
+
+    prior = np.zeros(n_t)
+    unestimated = []
+    indicators = prior_matrix.get("success_indicators", {})
+    type_closed, type_recovered = closed.sum(axis=(0, 1)), recovered.sum(axis=(0, 1))
+    for t, action_type in enumerate(types):
+        indicator = indicators.get(action_type)
+        if action_type in NO_SEND_TYPES:
+            prior[t] = 0.0
+        elif indicator:
+            prior[t] = float(str(indicator.get("estimated_success_rate", "0%")).rstrip("%")) / 100.0
+        elif type_closed[t]:
+            prior[t] = type_recovered[t] / type_closed[t]
+        else:
+            unestimated.append(action_type)
+    rates = (recovered + prior * PRIOR_STRENGTH) / (closed + PRIOR_STRENGTH)
+    rates[:, :, [t for t, a in enumerate(types) if a in NO_SEND_TYPES]] = 0.0
+    return rates, unestimated
+
+
+def simulate(compiled: CompiledMatrix, columns: Columns, rates: np.ndarray, types: List[str],
+             shipping_cost: float) -> Tuple[np.ndarray, dict]:
+    """Evaluate one matrix; returns the per-row action types and totals."""
+    chosen = compiled.evaluate(columns)
+    action_type = np.array([types.index(a["type"]) for a in compiled.actions], dtype=np.int64)[chosen]
+    discount = np.array([_discount_percent(a.get("discount")) for a in compiled.actions])[chosen]
+    free_shipping = np.array([a.get("free_shipping", False) for a in compiled.actions], dtype=bool)[chosen]
+
+    p = rates[columns.segment, columns.reason, action_type]
+    value = np.nan_to_num(columns.cart_value)
+    counts = np.bincount(action_type, minlength=len(types))
+    return action_type, {
+        "mix": {types[t]: int(c) for t, c in enumerate(counts) if c},
+        "expected_recoveries": float(p.sum()),
+        "expected_revenue": float((p * value).sum()),
+        "discount_cost": float((p * value * discount).sum()),
+        "shipping_cost": float((p * free_shipping).sum() * shipping_cost),
+    }
+
+
+def _action_types(*matrices: dict, columns: Columns) -> List[str]:
+    types = {FALLBACK_ACTION["type"]}
+    for matrix in matrices:
+        for entries in matrix.get("segments", {}).values():
+            types.update(e.get("type", "reminder") for e in entries.values())
+    types.update(a for a in columns.actions if a)
+    return sorted(types)
+
+
+def _load_matrix(path: Path) -> dict:
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _print_report(results: Dict[str, dict], types: List[str], rows: int, changed: Optional[int]) -> None:
+    names = list(results)
+    print(f"{'':<22}" + "".join(f"{name:>16}" for name in names))
+    for action_type in types:
+        counts = [results[name]["mix"].get(action_type, 0) for name in names]
+        if any(counts):
+            print(f"{action_type:<22}" + "".join(f"{c:>9} {c / rows:>6.1%}" for c in counts))
+    for field, label in (("expected_recoveries", "expected recoveries"), ("expected_revenue", "expected revenue"),
+                         ("discount_cost", "discount cost"), ("shipping_cost", "shipping cost")):
+        print(f"{label:<22}" + "".join(f"{results[name][field]:>16,.2f}" for name in names))
+    net = [results[n]["expected_revenue"] - results[n]["discount_cost"] - results[n]["shipping_cost"] for n in names]
+    print(f"{'net revenue':<22}" + "".join(f"{v:>16,.2f}" for v in net))
+    if changed is not None:
+        print(f"\nRows whose action type changes: {changed} ({changed / rows:.1%})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", type=Path, help="recovery_history export (.ndjson[.gz]) or saved columns (.npz)")
+    source.add_argument("--export", type=Path, help="Write a recovery_history export to this path and exit")
+    source.add_argument("--synthetic", type=int, help="Simulate this many random carts instead")
+    parser.add_argument("--days", type=int, default=90, help="Days of history to export")
+    parser.add_argument("--matrix", type=Path, default=MATRIX_PATH, help="Current decision matrix")
+    parser.add_argument("--candidate", type=Path, help="Candidate decision matrix to compare against")
+    parser.add_argument("--shipping-cost", type=float,
+                        default=float(os.getenv("SIMULATION_SHIPPING_COST", "7.5")),
+                        help="Cost per recovered free-shipping cart")
+    parser.add_argument("--save-columns", type=Path, help="Save the parsed input as .npz for faster reloads")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.export:
+        start = time.perf_counter()
+        count = export_history(args.export, args.days)
+        print(f"Exported {count} recovery_history documents to {args.export} in {time.perf_counter() - start:.1f}s")
+        return
+
+    start = time.perf_counter()
+    if args.synthetic:
+        columns = synthetic_columns(args.synthetic, args.seed)
+    elif args.input.suffix == ".npz":
+        columns = Columns.load_npz(args.input)
+    else:
+        columns = load_export(args.input)
+    load_seconds = time.perf_counter() - start
+    if args.save_columns:
+        columns.save(args.save_columns)
+    rows = len(columns)
+    if not rows:
+        print("No rows to simulate")
+        return
+
+    start = time.perf_counter()
+    current = _load_matrix(args.matrix)
+    matrices = {"current": current}
+    if args.candidate:
+        matrices["candidate"] = _load_matrix(args.candidate)
+    types = _action_types(*matrices.values(), columns=columns)
+    rates, unestimated = recovery_rates(columns, current, types)
+
+    results, chosen = {}, {}
+    for name, matrix in matrices.items():
+        chosen[name], results[name] = simulate(CompiledMatrix(matrix, columns), columns, rates, types,
+                                               args.shipping_cost)
+    changed = int((chosen["current"] != chosen["candidate"]).sum()) if args.candidate else None
+    simulate_seconds = time.perf_counter() - start
+
+    print(f"Rows: {rows}  load: {load_seconds:.2f}s  simulate: {simulate_seconds:.2f}s")
+    print(f"Observed: {int(columns.recovered.sum())} recoveries, {float(columns.revenue.sum()):,.2f} revenue\n")
+    _print_report(results, types, rows, changed)
+    if unestimated:
+        print(f"No history or success_indicators for {', '.join(unestimated)}: assumed to recover nothing")
+
+
+if __name__ == "__main__":
+    main()
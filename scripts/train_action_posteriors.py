@@ -0,0 +1,169 @@
+"""
+Train the decision engine's Thompson-sampling posterior table.
+
+Aggregates closed recoveries (those with ``outcome.status``) from
+recovery_history per segment × root cause × action type, maps them onto the
+candidate actions of the decision matrix and writes Beta(alpha, beta)
+posteriors as a compact JSON table (see
+aws/lambda/decision_engine/action_policy.py for the format).
+
+Priors come from the matrix's ``success_indicators`` so that arms with little
+history start near the expected rate instead of at 50%.
+
+Usage:
+    python scripts/train_action_posteriors.py [--output aws/decision-matrix/action-posteriors.json]
+    aws s3 cp aws/decision-matrix/action-posteriors.json s3://<bucket>/action-posteriors.json --sse AES256
+"""
+
+import argparse
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from elasticsearch import Elasticsearch
+
+from bootstrap_indices import PROJECT_ROOT, build_es_client
+
+
+MATRIX_PATH = PROJECT_ROOT / "aws" / "decision-matrix" / "decision-matrix.json"
+DEFAULT_OUTPUT = PROJECT_ROOT / "aws" / "decision-matrix" / "action-posteriors.json"
+RECOVERY_INDEX = "recovery_history"
+
+# Weight of the success_indicators prior, in pseudo-observations
+PRIOR_STRENGTH = float(os.getenv("POSTERIOR_PRIOR_STRENGTH", "10"))
+
+# Action types the policy may explore between. payment_retry only makes sense
+# for payment failures and guardrail types are never learned.
+EXPLORABLE_TYPES = {"reminder", "free_shipping", "discount"}
+
+# Workflow diagnosis names → decision matrix reason keys
+ROOT_CAUSE_TO_REASON = {
+    "pricing_shipping": "shipping_issue",
+    "browsing_or_window_shopping": "browsing_abandonment",
+}
+
+
+def _segment_key(matrix: dict, segment: str) -> str:
+    """Mirror decision_engine's segment normalization and fallback."""
+    key = segment.lower().replace(" ", "_") if segment else "default"
+    return key if key in matrix["segments"] else "default"
+
+
+def _reason_key(root_cause: str) -> str:
+    key = (root_cause or "").lower().replace(" ", "_")
+    return ROOT_CAUSE_TO_REASON.get(key, key)
+
+
+def candidate_arms(matrix: dict) -> Dict[Tuple[str, str], List[str]]:
+    """Matrix entries the policy may choose between, per (segment, reason)."""
+    arms = {}
+    for segment_key, entries in matrix["segments"].items():
+        # high_cart_value is a threshold override applied by resolve_action,
+        # not an action to offer on arbitrary carts
+        reasons = {k: e for k, e in entries.items() if k != "high_cart_value"}
+        explorable = [k for k, e in reasons.items() if e.get("type") in EXPLORABLE_TYPES]
+        for reason_key, entry in reasons.items():
+            # The static entry is always an arm; others only if explorable
+            choices = [reason_key]
+            if entry.get("type") in EXPLORABLE_TYPES:
+                choices += [k for k in explorable if k != reason_key]
+            # One arm per distinct action type
+            seen_types = set()
+            unique = []
+            for key in choices:
+                action_type = reasons[key].get("type")
+                if action_type not in seen_types:
+                    seen_types.add(action_type)
+                    unique.append(key)
+            arms[(segment_key, reason_key)] = unique
+    return arms
+
+
+def _prior(matrix: dict, action_type: str) -> Tuple[float, float]:
+    indicator = matrix.get("success_indicators", {}).get(action_type)
+    if not indicator:
+        return 1.0, 1.0
+    rate = float(str(indicator.get("estimated_success_rate", "50%")).rstrip("%")) / 100.0
+    return 1.0 + rate * PRIOR_STRENGTH, 1.0 + (1.0 - rate) * PRIOR_STRENGTH
+
+
+def iter_outcome_counts(es: Elasticsearch) -> Iterator[Tuple[str, str, str, int, int]]:
+    """Yield (segment, root_cause, action_type, closed, recovered) groups."""
+    composite = {
+        "size": 1000,
+        "sources": [
+            {"segment": {"terms": {"field": "segment", "missing_bucket": True}}},
+            {"root_cause": {"terms": {"field": "diagnosis.root_cause", "missing_bucket": True}}},
+            {"action_type": {"terms": {"field": "action.type"}}},
+        ],
+    }
+    while True:
+        resp = es.search(
+            index=RECOVERY_INDEX,
+            size=0,
+            query={"bool": {"filter": [{"exists": {"field": "outcome.status"}}]}},
+            aggs={
+                "groups": {
+                    "composite": composite,
+                    "aggs": {"recovered": {"filter": {"term": {"outcome.status": "recovered"}}}},
+                }
+            },
+        )
+        groups = resp["aggregations"]["groups"]
+        for bucket in groups["buckets"]:
+            key = bucket["key"]
+            yield key["segment"], key["root_cause"], key["action_type"], bucket["doc_count"], bucket["recovered"]["doc_count"]
+        after = groups.get("after_key")
+        if not after or not groups["buckets"]:
+            return
+        composite["after"] = after
+
+
+def build_posterior_table(matrix: dict, counts: Iterator[Tuple[str, str, str, int, int]]) -> dict:
+    # (segment_key, reason_key, action_type) → [closed, recovered]
+    observed = defaultdict(lambda: [0, 0])
+    for segment, root_cause, action_type, closed, recovered in counts:
+        key = (_segment_key(matrix, segment), _reason_key(root_cause), action_type)
+        observed[key][0] += closed
+        observed[key][1] += recovered
+
+    table = {}
+    for (segment_key, reason_key), entry_keys in sorted(candidate_arms(matrix).items()):
+        arms = []
+        for entry_key in entry_keys:
+            action_type = matrix["segments"][segment_key][entry_key]["type"]
+            alpha, beta = _prior(matrix, action_type)
+            closed, recovered = observed.get((segment_key, reason_key, action_type), (0, 0))
+            arms.append([entry_key, round(alpha + recovered, 3), round(beta + closed - recovered, 3)])
+        if len(arms) > 1:
+            table[f"{segment_key}|{reason_key}"] = arms
+
+    return {
+        "version": 1,
+        "generated_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "arms": table,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--matrix", type=Path, default=MATRIX_PATH, help="Decision matrix JSON")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="Posterior table to write")
+    args = parser.parse_args()
+
+    with args.matrix.open("r", encoding="utf-8") as f:
+        matrix = json.load(f)
+
+    es = build_es_client()
+    table = build_posterior_table(matrix, iter_outcome_counts(es))
+
+    with args.output.open("w", encoding="utf-8") as f:
+        json.dump(table, f, separators=(",", ":"))
+    print(f"Wrote {len(table['arms'])} posterior keys to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Persisted job watermarks stored in the pipeline_watermarks index."""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from elasticsearch import Elasticsearch, NotFoundError
+
+
+WATERMARK_INDEX = "pipeline_watermarks"
+
+
+def utc(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def parse_ts(s: str) -> datetime:
+    return datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+
+def load_watermark(es: Elasticsearch, job: str) -> Optional[datetime]:
+    """Return the last committed watermark for ``job``, or None on first run."""
+    try:
+        doc = es.get(index=WATERMARK_INDEX, id=job)
+    except NotFoundError:
+        return None
+    value = doc["_source"].get("watermark")
+    return parse_ts(value) if value else None
+
+
+def save_watermark(es: Elasticsearch, job: str, watermark: datetime, **counters: int) -> None:
+    """
+    Commit ``watermark`` for ``job`` together with run counters, stored under
+    ``counters``; each counter name must be declared in the index mapping.
+    """
+    es.index(
+        index=WATERMARK_INDEX,
+        id=job,
+        document={
+            "@timestamp": utc(datetime.now(timezone.utc)),
+            "job": job,
+            "watermark": utc(watermark),
+            "counters": counters,
+        },
+        refresh="wait_for",
+    )